@@ -1,13 +1,19 @@
+from ravellib.lib.analysis import AnalysisCache
 from ravellib.lib.effects import CompressSignal
 class Compress():
     """
     Creates a new Compressor channel
     """
 
-    def __init__(self, all_trackouts, signal_aggregator, sr):
+    def __init__(self, all_trackouts, signal_aggregator, sr, analysis_cache=None, mode="broadband"):
         self.all_trackouts = all_trackouts
         self.agg = signal_aggregator
         self.sr = sr
+        # "broadband" compresses the whole trackout, "multiband" compresses
+        # the bands between crossovers separately
+        self.mode = mode
+        self.crossovers = [200, 2000, 8000]
+        self.analysis_cache = analysis_cache or AnalysisCache()
 
 
     def compress(self):
@@ -31,7 +37,8 @@ class Compress():
             cp = CompressSignal(
                 loaded_np, 1024, 1024, 123,
                 200, audio_type, self.sr, 0.2, 1, 1000,
-                2, 0.08, 1.0)
+                2, 0.08, 1.0,
+                analysis=self.analysis_cache.analysis(loaded_np, 1024, 1024, 123, self.sr))
             comp_signals.append(cp)
             cp_crest_factor = cp.crest_factor
             cp_lfe = cp.lfe
@@ -44,8 +51,19 @@ class Compress():
         lfa = self.agg.lfa(comp_lfe)
         cfa = self.agg.cfa(comp_crest)
 
-        for mono_signal in comp_signals:
-            cp = mono_signal.comp_params(cfa, lfa)
-            compressed = mono_signal.compression(cp)
-            compressed_signals.append(compressed)
+        if self.mode == "multiband":
+            # per-band crest factors are averaged band by band across trackouts
+            band_cfa = self.agg.cfa([cp.band_crest_factors(self.crossovers) for cp in comp_signals])
+            for mono_signal in comp_signals:
+                cp = mono_signal.multiband_params(self.crossovers, band_cfa, lfa)
+                compressed_signals.append(mono_signal.multiband_compression(cp, self.crossovers))
+        else:
+            for mono_signal in comp_signals:
+                cp = mono_signal.comp_params(cfa, lfa)
+                compressed = mono_signal.compression(cp)
+                compressed_signals.append(compressed)
+
+        # no other effect reads this STFT setting, so it is not kept for the rest of the job
+        for loaded_np in self.all_trackouts:
+            self.analysis_cache.evict(loaded_np, 1024, 1024, 123)
         return compressed_signals
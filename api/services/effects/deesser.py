@@ -1,10 +1,12 @@
+from ravellib.lib.analysis import AnalysisCache
 from ravellib.lib.effects import DeEsserSignal
 class Deesser():
-    def __init__(self, main_trackout, sr):
+    def __init__(self, main_trackout, sr, analysis_cache=None):
         self.main_trackout = main_trackout
         self.sr = sr
+        self.analysis_cache = analysis_cache or AnalysisCache()
 
-    def deess(self):
+    def deesser_signal(self):
         # critical bands are the frequencies at which the deesser looks at to
         # calculate sharpness
         critical_bands = [
@@ -18,11 +20,24 @@ class Deesser():
         # audio type is the track type
         audio_type = "vocal"
         sig = DeEsserSignal(self.main_trackout, 256, 256, 256, -12, audio_type, self.sr,
-                            critical_bands, c, 1.2, 0.65)
+                            critical_bands, c, 1.2, 0.65,
+                            analysis=self.analysis_cache.analysis(self.main_trackout, 256, 256, 256, self.sr))
+        return sig
 
+    def deess(self):
+        sig = self.deesser_signal()
         sharpness = sig.compute_sharpness()
         gr = sig.gain_reduction(sharpness)
         processed = sig.deesser(gr)
 
         return processed
 
+    def spectral_processor(self):
+        """
+            De-essing gain as a SpectralChain processor, so it can share the
+            STFT of another spectral effect on the same trackout
+        """
+        sig = self.deesser_signal()
+        gr = sig.gain_reduction(sig.compute_sharpness())
+        return sig.spectral_deesser(gr)
+
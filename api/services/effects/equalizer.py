@@ -1,35 +1,39 @@
-from ravellib.lib.effects import EQSignal
-class Equalize():
+from api.services.effects.deesser import Deesser
+from ravellib.lib.analysis import AnalysisCache
+from ravellib.lib.effects import EQSignal, SpectralGate
+class EqualizeGroup():
     """
-        Please define Equalize
+        Equalizes every trackout against all of the others in one pass
     """
 
-    def __init__(self, main_trackout, other_trackouts, sr):
-        # trackout to be processed
-        self.main_trackout = main_trackout
-        # other trackouts does not contain main_trackout
-        self.other_trackouts = other_trackouts
+    def __init__(self, all_trackouts, sr, mask_mode="average", analysis_cache=None, eq_modes=None,
+                 deess=None, gate=None):
+        self.all_trackouts = all_trackouts
         self.sr = sr
+        self.mask_mode = mask_mode
+        self.analysis_cache = analysis_cache or AnalysisCache()
+        # one "iir", "linear" or "spectral" eq mode per trackout
+        self.eq_modes = eq_modes or ["iir"] * len(all_trackouts)
+        # trackouts in "spectral" mode flagged here are de-essed in the same STFT as their EQ
+        self.deess = deess or [False] * len(all_trackouts)
+        # SpectralGate threshold_db/reduction_db per trackout, None leaves it ungated
+        self.gate = gate or [None] * len(all_trackouts)
 
     def equalize(self):
-        # List of EQSignals, which contain a mono signal npArray
-        signals = list()
-        if len(self.other_trackouts) == 0:
-            self.other_trackouts.append(self.main_trackout)
-        for loaded_np in self.other_trackouts:
-            _eq = EQSignal(loaded_np, 1024, 1024, 1024, -12, "vocal", self.sr, 10, 3, -2)
-            signals.append(_eq)
-
-        '''
-            @parameters
-                1: numpy array
-                3: more to be desired...
-        '''
-        eq = EQSignal(self.main_trackout, 1024, 1024,
-                      1024, -12, "vocal", self.sr, 10, 3, -2)
-
-        # equalize the trackout and return
-        params = eq.eq_params(signals)
-        equalized = eq.equalization(params, 2)
-        print(f'returning eqwave of type {type(equalized)}: {equalized}')
+        # each trackout is analysed once, and the masking between every pair
+        # is computed together instead of once per trackout
+        signals = [EQSignal(loaded_np, 1024, 1024, 1024, -12, "vocal", self.sr, 10, 3, -2,
+                            mask_mode=self.mask_mode,
+                            analysis=self.analysis_cache.analysis(loaded_np, 1024, 1024, 1024, self.sr))
+                   for loaded_np in self.all_trackouts]
+        all_params = EQSignal.group_eq_params(signals)
+        equalized = []
+        for signal, params, eq_mode, deess, gate in zip(signals, all_params, self.eq_modes, self.deess,
+                                                        self.gate):
+            processors = []
+            if eq_mode == "spectral" and deess:
+                processors.append(Deesser(signal.signal, self.sr, self.analysis_cache).spectral_processor())
+            if eq_mode == "spectral" and gate:
+                processors.append(SpectralGate(**gate))
+            equalized.append(signal.equalization(params, 2, eq_mode, processors))
         return equalized
@@ -0,0 +1,43 @@
+from ravellib.lib.analysis import AnalysisCache
+from ravellib.lib.effects import FaderSignal
+import numpy as np
+class Fader():
+    """
+    Balances the level of every trackout against the others
+    """
+
+    def __init__(self, all_trackouts, signal_aggregator, sr, audio_types=None, analysis_cache=None):
+        self.all_trackouts = all_trackouts
+        self.agg = signal_aggregator
+        self.sr = sr
+        self.audio_types = audio_types or ["instrument"] * len(all_trackouts)
+        self.analysis_cache = analysis_cache or AnalysisCache()
+
+    def fade(self):
+        """
+            Loudness is measured per hop rather than per sample. The signal
+            aggregator gates out silent trackouts before averaging, and each
+            trackout's fader moves it toward that average.
+        """
+        hop_length = 512
+        fader_signals = []
+        curves = []
+        for loaded_np, audio_type in zip(self.all_trackouts, self.audio_types):
+            fs = FaderSignal(loaded_np, 1024, 1024, hop_length, -12, audio_type, self.sr,
+                             0.99995, 3, audio_type == "vocal", 2.0, 0.25, 3,
+                             analysis=self.analysis_cache.analysis(loaded_np, 1024, 1024, hop_length, self.sr))
+            fader_signals.append(fs)
+            curves.append(fs.full_loudness())
+
+        # shorter trackouts are treated as silent once they end
+        num_frames = max(curve.shape[0] for curve in curves)
+        L = np.full((len(curves), num_frames), -100.0)
+        for i, curve in enumerate(curves):
+            L[i, :curve.shape[0]] = curve
+        L_av = self.agg.loudness_avg(L, 0.5, -50, -40, 0.5, 0.1, rate=self.sr / hop_length)
+
+        faded_signals = []
+        for fs, curve in zip(fader_signals, curves):
+            F_m = fs.compute_fader(L_av[:curve.shape[0]], curve)
+            faded_signals.append(fs.fader(F_m).T)
+        return faded_signals
@@ -0,0 +1,35 @@
+import ravellib.lib.preprocessing as preprocessing
+from ravellib.lib.analysis import AnalysisCache
+from ravellib.lib.effects import PanSignal
+class Pan():
+    """
+    Places every trackout in the stereo field
+    """
+
+    def __init__(self, all_trackouts, signal_aggregator, sr, audio_types=None, analysis_cache=None):
+        self.all_trackouts = all_trackouts
+        self.agg = signal_aggregator
+        self.sr = sr
+        self.audio_types = audio_types or ["instrument"] * len(all_trackouts)
+        self.analysis_cache = analysis_cache or AnalysisCache()
+
+    def pan(self):
+        """
+            Every trackout is run through the same band-pass filter bank to
+            find the band holding its peaks. Trackouts that share a band are
+            spread across the stereo field by the signal aggregator.
+        """
+        # octave bands the lead filter chooses between, kept below Nyquist
+        cutoffs = preprocessing.octave_bands(50, 12800, self.sr)
+        pan_signals = []
+        lead_bands = []
+        for loaded_np, audio_type in zip(self.all_trackouts, self.audio_types):
+            ps = PanSignal(loaded_np, 1024, 1024, 512, -12, audio_type, self.sr,
+                           cutoffs, 0.5, 2, 'bandpass',
+                           analysis=self.analysis_cache.analysis(loaded_np, 1024, 1024, 512, self.sr))
+            pan_signals.append(ps)
+            lead_bands.append(cutoffs.index(tuple(ps.lead_filter())))
+
+        positions = self.agg.pan_positions(cutoffs, lead_bands)
+        panned_signals = [ps.pan(P) for ps, P in zip(pan_signals, positions)]
+        return panned_signals
@@ -1,8 +1,11 @@
+from ravellib.lib.analysis import AnalysisCache
 from ravellib.lib.effects import ReverbSignal
 class Reverb():
-    def __init__(self, main_trackout, sr):
+    def __init__(self, main_trackout, sr, analysis_cache=None, engine="native"):
         self.main_trackout = main_trackout
         self.sr = sr
+        self.analysis_cache = analysis_cache or AnalysisCache()
+        self.engine = engine
 
     def reverb(self):
         # audio type is the instrument on the track
@@ -12,7 +15,8 @@ class Reverb():
         room_scale = 10
         rev = ReverbSignal(
             self.main_trackout, 1024, 1024, 1024, -12, audio_type, self.sr,
-            amount, 0.0, room_scale, 0.0, 0.4, 600, 6000, 2, 70, 12
+            amount, 0.0, room_scale, 0.0, 0.4, 600, 6000, 2, 70, 12,
+            analysis=self.analysis_cache.analysis(self.main_trackout, 1024, 1024, 1024, self.sr)
         )
-        processed = rev.reverb()
+        processed = rev.reverb(self.engine)
         return processed
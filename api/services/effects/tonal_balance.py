@@ -0,0 +1,19 @@
+from ravellib.lib import preprocessing
+from ravellib.lib.analysis import AnalysisCache
+import numpy as np
+class TonalBalance():
+    def __init__(self, main_trackout, sr, analysis_cache=None):
+        self.main_trackout = main_trackout
+        self.sr = sr
+        self.analysis_cache = analysis_cache or AnalysisCache()
+
+    def balance(self):
+        # the PLL band limits the tracked fundamental to the low/mid range
+        # the eq parameters are applied at each of the strongest frequencies
+        mono_signal = self.analysis_cache.analysis(self.main_trackout, 1024, 1024, 512, self.sr).mono_signal
+        x_env = np.sqrt(np.mean(mono_signal**2)) + 1e-9
+        processed = preprocessing.tonal_balance(
+            self.main_trackout, self.sr, 20, 1500, 2, 4, x_env,
+            0.707, 1.0, 10, -2, 100, "cut"
+        )
+        return processed.astype(np.float32).T
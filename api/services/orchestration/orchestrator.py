@@ -1,12 +1,14 @@
 from api.services.firestore import retreive_from_file_store, publish_to_file_store
-from api.services.effects import reverb, equalizer, compressor, deesser
+from api.services.effects import reverb, equalizer, compressor, deesser, tonal_balance, panner, fader
 from api.models.track_models import Equalizer, Deesser, Compressor, Reverb, TrackOut
 from api.services.orchestration.processing import Processor
 from api.services.email.email import email_proxy
 from api.services.utility import clean_tmp, setup_tmp, create_trackout_exclusive_list, convert_to_stereo_signal
 from api import db, Q, Job
 from scipy.io.wavfile import write
+from ravellib.lib.analysis import AnalysisCache
 from ravellib.lib.effects import Mixer
+from ravellib.lib.spectrum import spectrum_cache
 from flask import current_app as app
 
 
@@ -22,32 +24,48 @@ class Orchestrator():
         """
         self.track = track
         self.current_user = current_user
-        self.processed_signals = list()
+        self.mixer = None
         self.toggle_effects_params = toggle_effects_params
         num_signals = len(all_trackouts)
-        self.processor = Processor(num_signals)
+        # spectra and level statistics are computed once per trackout for the whole job
+        self.analysis_cache = AnalysisCache()
+        self.processor = Processor(num_signals, analysis_cache=self.analysis_cache)
         self.all_trackouts = all_trackouts
         self.other_trackouts = list()
         self.sample_rate = None
-        self.compressed_result = list()
         self.stereo_signal_trackouts = list()
         # TODO get this from DB model
         self.eq_params = {"freq": "1200", "filter_type": 0, "gain": 1}
+        # time-chunked masking only compares stems where they overlap
+        self.eq_mask_mode = "chunk" if toggle_effects_params.get('eq_chunk') else "average"
+        # linear-phase EQ keeps dense band counts cheap and avoids phase shifts
+        self.eq_mode = "linear" if toggle_effects_params.get('eq_linear') else "iir"
+        if toggle_effects_params.get('eq_spectral'):
+            self.eq_mode = "spectral"
+        # spectral EQ de-esses in the same STFT instead of queueing a separate de-esser job
+        self.deess_in_eq = bool(toggle_effects_params.get('eq') and toggle_effects_params.get('de')
+                                and self.eq_mode == "spectral")
+        # spectral EQ can also gate bins below the noise floor in the same STFT
+        self.gate_in_eq = bool(toggle_effects_params.get('eq_gate') and self.eq_mode == "spectral")
+        self.gate_params = {"threshold_db": -60, "reduction_db": 20}
+        self.co_mode = "multiband" if toggle_effects_params.get('co_multiband') else "broadband"
+        # the SoX reverb runs as a single fused sox process per trackout
+        self.re_engine = "sox" if toggle_effects_params.get('re_sox') else "native"
         self.co_params = {"ratio": 1.1, "threshold": 1.0,
                           "knee_width": 1, "attack": 1.1, "release": 1.2}
         self.de_params = {"sharpness_avg": 1}
         app.logger.info(f'creating new track builder: {self}')
 
-    def compress_trackouts(self):
-        """ Initiate Compress """
+    def _queue_group(self, effect):
+        """ Queues one job that runs effect for all trackouts together, e.g. "compress" runs compress_and_save """
         try:
-            co_args = [[trackout.uuid for trackout in self.all_trackouts]]
-            processing_job = Job(self.compress_and_save, co_args)
+            group_args = [[trackout.uuid for trackout in self.all_trackouts]]
+            processing_job = Job(getattr(self, f"{effect}_and_save"), group_args)
             app.logger.info(f'processing job: {processing_job}')
             Q.put(processing_job) # currently cannot return
         except Exception as err:
-            app.logger.error(f"error in process_and_save for trackID {self.track.id}:", err)
-            raise Exception(f"Error occurred in process_and_save:\n {err}")
+            app.logger.error(f"error in {effect}_and_save for trackID {self.track.id}:", err)
+            raise Exception(f"Error occurred in {effect}_and_save:\n {err}")
 
     def engage_trackout_effects(self):
         try:
@@ -56,17 +74,10 @@ class Orchestrator():
                 # setup queue parameters and process
                 base_processing_args = [raw_trackout.uuid]
                 
-                """Initiate Equalize"""
-                if self.toggle_effects_params.get('eq'):
-                    eq_args = base_processing_args + ["equalize", main_trackout, other_trackouts]
-                    processing_job = Job(self.process_and_save, eq_args)
-                    app.logger.info(f'processing job: {processing_job}')
-                    Q.put(processing_job)  # currently cannot return
-                
                 """ Initiate Deessor """
                 # Blocked by drop down trackout type enforecement 
                 #raw_trackout.type == "vocals" and 
-                if self.toggle_effects_params.get('de'):
+                if self.toggle_effects_params.get('de') and not self.deess_in_eq:
                     de_args = base_processing_args + ["deesser", main_trackout, other_trackouts]
                     processing_job = Job(self.process_and_save, de_args)
                     app.logger.info(f'processing job: {processing_job}')
@@ -79,6 +90,13 @@ class Orchestrator():
                     processing_job = Job(self.process_and_save, rev_args)
                     app.logger.info(f'processing job: {processing_job}')
                     Q.put(processing_job)  # currently cannot return
+
+                """ Initiate Tonal Balance """
+                if self.toggle_effects_params.get('tb'):
+                    tb_args = base_processing_args + ["tonal_balance", main_trackout, other_trackouts]
+                    processing_job = Job(self.process_and_save, tb_args)
+                    app.logger.info(f'processing job: {processing_job}')
+                    Q.put(processing_job)  # currently cannot return
         except Exception as err:
             app.logger.error(f"Error occurred in track fx: {err}")
             raise Exception(f"Error occurred in track fx: {err}")
@@ -89,17 +107,26 @@ class Orchestrator():
             self.stereo_signal_trackouts, self.sample_rate = convert_to_stereo_signal(self.all_trackouts)
             if self.sample_rate != 44100:
                 self.processor.sample_rate = self.sample_rate
+            for trackout, stereo_signal in zip(self.all_trackouts, self.stereo_signal_trackouts):
+                self.analysis_cache.register(trackout.uuid, stereo_signal)
+                spectrum_cache.register(trackout.uuid, stereo_signal)
+            storage_name = f"wav_tmp/{self.track.uuid}/{self.track.uuid}.wav"
+            # results are mixed as they finish instead of being held until the end
+            num_samples = max(signal.shape[-1] for signal in self.stereo_signal_trackouts)
+            self.mixer = Mixer(storage_name, self.sample_rate, num_samples)
+            if self.toggle_effects_params.get('eq'):
+                self._queue_group("equalize")
             if self.toggle_effects_params.get('co'):
-                self.compress_trackouts()
+                self._queue_group("compress")
+            if self.toggle_effects_params.get('pa'):
+                self._queue_group("pan")
+            if self.toggle_effects_params.get('fa'):
+                self._queue_group("fade")
             self.engage_trackout_effects()
             Q.join()
-            storage_name = f"wav_tmp/{self.track.uuid}/{self.track.uuid}.wav"
 
-            # every track has for settings for all of the equations
-            mixer = Mixer(self.processed_signals, storage_name, self.sample_rate)
-            app.logger.info(self.processed_signals)
-            mixed_result = mixer.mix()
-            mixer.output_wav(mixed_result)
+            mixed_result = self.mixer.mix()
+            self.mixer.output_wav(mixed_result)
             firestore_path = f"track/{self.track.uuid}/song/{self.track.uuid}.wav"
             download_url = publish_to_file_store(firestore_path, storage_name)
             
@@ -113,8 +140,12 @@ class Orchestrator():
 
             # This line below is to attach a file to the email
             #     sound_file=data)
+            self.analysis_cache.clear()
+            spectrum_cache.clear()
             clean_tmp(self.track.uuid)
         except Exception as err:
+            self.analysis_cache.clear()
+            spectrum_cache.clear()
             clean_tmp(self.track.uuid)
             app.logger.error(f"error in orchestration for trackID {self.track.id}:", err)
             raise Exception(f"Error occurred in orchestration:\n {err}")
@@ -124,23 +155,10 @@ class Orchestrator():
             Seperated method for effects that only needs to run once for all trackouts
         """
         try:
+            compressed_result = self.processor.compress(self.stereo_signal_trackouts, self.co_mode)
 
-            effect_prefix = "co"
-            self.compressed_result = self.processor.compress(self.stereo_signal_trackouts)
-            correlation = zip(all_trackouts_uuids, self.compressed_result)
-            for index, (raw_trackout_uuid, processed_result) in enumerate(correlation):
-                raw_trackout = TrackOut.query.filter_by(uuid=raw_trackout_uuid).first()
-
-                self.processed_signals.append(processed_result)
-                # TODO add a dict to keep track of each trackouts processed results
-                track_uuid = raw_trackout.track_id
-                trackout_uuid = raw_trackout.uuid
-                storage_name = f"{trackout_uuid}.wav"
-                firestore_path = f"track/{track_uuid}/{effect_prefix}/{storage_name}"
-                write(f"wav_tmp/{track_uuid}/{effect_prefix}_{storage_name}", self.sample_rate, processed_result)
-                # publish_to_file_store and remove
-                publish_to_file_store(firestore_path, f"wav_tmp/{track_uuid}/{effect_prefix}_{storage_name}")
-                db_model = Compressor(
+            def compressor_model(raw_trackout, firestore_path):
+                return Compressor(
                     ratio=self.co_params["ratio"],
                     threshold=self.co_params["threshold"],
                     knee_width=self.co_params["knee_width"],
@@ -149,13 +167,86 @@ class Orchestrator():
                     path=firestore_path,
                     co=raw_trackout  # Relationship with raw_trackout
                 )
-                local_object = db.session.merge(db_model)
-                db.session.add(local_object)
-                db.session.commit()
+            self.save_group_results(all_trackouts_uuids, compressed_result, "co", compressor_model)
         except Exception as err:
             app.logger.error(f"error in compress_and_save for trackID {self.track.id}:", err)
             raise Exception(f"Error occurred in compress_and_save:\n {err}") 
 
+    def trackout_audio_types(self):
+        # the group effects only distinguish vocals from everything else
+        return ["vocal" if (trackout.type or "").lower().startswith("vocal") else "instrument"
+                for trackout in self.all_trackouts]
+
+    def save_group_results(self, all_trackouts_uuids, results, effect_prefix, db_model=None):
+        """
+            Writes and publishes the per-trackout results of an effect that runs once for all trackouts.
+            db_model(raw_trackout, firestore_path) builds the database record for a result, if any.
+        """
+        for index, raw_trackout_uuid in enumerate(all_trackouts_uuids):
+            processed_result = results[index]
+            # once a stem is written and mixed only the mix needs it, so release it
+            results[index] = None
+            raw_trackout = TrackOut.query.filter_by(uuid=raw_trackout_uuid).first()
+
+            self.mixer.add(processed_result)
+            track_uuid = raw_trackout.track_id
+            trackout_uuid = raw_trackout.uuid
+            storage_name = f"{trackout_uuid}.wav"
+            firestore_path = f"track/{track_uuid}/{effect_prefix}/{storage_name}"
+            write(f"wav_tmp/{track_uuid}/{effect_prefix}_{storage_name}", self.sample_rate, processed_result)
+            # publish_to_file_store and remove
+            publish_to_file_store(firestore_path, f"wav_tmp/{track_uuid}/{effect_prefix}_{storage_name}")
+            if db_model is not None:
+                local_object = db.session.merge(db_model(raw_trackout, firestore_path))
+                db.session.add(local_object)
+                db.session.commit()
+
+    def equalize_and_save(self, all_trackouts_uuids):
+        """
+            Masking is measured between every pair of trackouts, so it runs once for all trackouts
+        """
+        try:
+            eq_modes = [self.eq_mode] * len(self.stereo_signal_trackouts)
+            deess = [self.deess_in_eq] * len(self.stereo_signal_trackouts)
+            gate = [self.gate_params if self.gate_in_eq else None] * len(self.stereo_signal_trackouts)
+            equalized_result = self.processor.equalize_all(self.stereo_signal_trackouts, self.eq_mask_mode,
+                                                           eq_modes, deess, gate)
+
+            def equalizer_model(raw_trackout, firestore_path):
+                return Equalizer(
+                    freq=self.eq_params["freq"],
+                    filter_type=self.eq_params["filter_type"],
+                    gain=self.eq_params["gain"],
+                    path=firestore_path,
+                    eq=raw_trackout  # Relationship with raw_trackout
+                )
+            self.save_group_results(all_trackouts_uuids, equalized_result, "eq", equalizer_model)
+        except Exception as err:
+            app.logger.error(f"error in equalize_and_save for trackID {self.track.id}:", err)
+            raise Exception(f"Error occurred in equalize_and_save:\n {err}")
+
+    def pan_and_save(self, all_trackouts_uuids):
+        """
+            Panning places every trackout relative to the others, so it runs once for all trackouts
+        """
+        try:
+            panned_result = self.processor.pan(self.stereo_signal_trackouts, self.trackout_audio_types())
+            self.save_group_results(all_trackouts_uuids, panned_result, "pa")
+        except Exception as err:
+            app.logger.error(f"error in pan_and_save for trackID {self.track.id}:", err)
+            raise Exception(f"Error occurred in pan_and_save:\n {err}")
+
+    def fade_and_save(self, all_trackouts_uuids):
+        """
+            Fader levels are relative to the average loudness of all trackouts, so it runs once for all trackouts
+        """
+        try:
+            faded_result = self.processor.fade(self.stereo_signal_trackouts, self.trackout_audio_types())
+            self.save_group_results(all_trackouts_uuids, faded_result, "fa")
+        except Exception as err:
+            app.logger.error(f"error in fade_and_save for trackID {self.track.id}:", err)
+            raise Exception(f"Error occurred in fade_and_save:\n {err}")
+
     def process_and_save(self, raw_trackout_uuid, effect, main_trackout, other_trackouts):
         try:
             raw_trackout = TrackOut.query.filter_by(uuid=raw_trackout_uuid).first()
@@ -167,7 +258,7 @@ class Orchestrator():
             if effect == "reverb":
                 effect_prefix = "re"
                 firestore_path = f"track/{track_uuid}/{effect_prefix}/{storage_name}"
-                processed_result = self.processor.reverb(main_trackout)
+                processed_result = self.processor.reverb(main_trackout, self.re_engine)
                 db_model = Reverb(
                     path=firestore_path,
                     re=raw_trackout  # Relationship with raw_trackout
@@ -181,17 +272,12 @@ class Orchestrator():
                     path=firestore_path,
                     de=raw_trackout  # Relationship with raw_trackout
                 )
-            elif effect == "equalize":
-                effect_prefix = "eq"
+            elif effect == "tonal_balance":
+                effect_prefix = "tb"
                 firestore_path = f"track/{track_uuid}/{effect_prefix}/{storage_name}"
-                processed_result = self.processor.equalize(main_trackout, other_trackouts)
-                db_model = Equalizer(
-                    freq=self.eq_params["freq"],
-                    filter_type=self.eq_params["filter_type"],
-                    gain=self.eq_params["gain"],
-                    path=firestore_path,
-                    eq=raw_trackout  # Relationship with raw_trackout
-                )
+                processed_result = self.processor.tonal_balance(main_trackout)
+                # tonal balance has no parameters model yet
+                db_model = None
             else:
                 app.logger.info(f"This effect function does not exist")
 
@@ -202,11 +288,12 @@ class Orchestrator():
             # publish_to_file_store and remove
             publish_to_file_store(firestore_path, f"wav_tmp/{track_uuid}/{effect_prefix}_{storage_name}")
             if bool(processed_result.any()):
-                self.processed_signals.append(processed_result)
+                self.mixer.add(processed_result)
             # save effect results to database
-            local_object = db.session.merge(db_model)
-            db.session.add(local_object)
-            db.session.commit()
+            if db_model is not None:
+                local_object = db.session.merge(db_model)
+                db.session.add(local_object)
+                db.session.commit()
         except Exception as err:
             app.logger.error(f"error in process_and_save for trackID {self.track.id}:", err)
             raise Exception(f"Error occurred in process_and_save:\n {err}")
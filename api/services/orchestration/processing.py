@@ -1,28 +1,32 @@
-from api.services.effects import reverb, equalizer, compressor, deesser
+from api.services.effects import reverb, equalizer, compressor, deesser, tonal_balance, panner, fader
+from ravellib.lib.analysis import AnalysisCache
 from ravellib.lib.effects import SignalAggregator
 from flask import current_app as app
 
 
 class Processor():
-    def __init__(self, num_signals, sample_rate=44100):
+    def __init__(self, num_signals, sample_rate=44100, analysis_cache=None):
         self.num_signals = num_signals
         self.sample_rate = sample_rate
+        self.analysis_cache = analysis_cache or AnalysisCache()
         self.signal_aggregator = SignalAggregator(
             self.sample_rate, self.num_signals)
 
-    def equalize(self, main_trackout, other_trackouts):
+    def equalize_all(self, all_trackouts, mask_mode="average", eq_modes=None, deess=None, gate=None):
         try:
-            eq = equalizer.Equalize(main_trackout, other_trackouts, self.sample_rate)
+            eq = equalizer.EqualizeGroup(all_trackouts, self.sample_rate, mask_mode, self.analysis_cache,
+                                         eq_modes, deess, gate)
             processed = eq.equalize()
-            print(f"Successful equalization: \n\t {type(processed)}")
+            print(f"Successful group equalization of type {type(processed)}: \n\t{processed}")
             return processed
         except Exception as err:
-            app.logger.error(f"error in equalize for trackID:", err)
-            raise Exception(f"Error occurred in equalize:\n {err}")
+            app.logger.error(f"error in equalize_all for trackID:", err)
+            raise Exception(f"Error occurred in equalize_all:\n {err}")
 
-    def compress(self, all_trackouts):
+    def compress(self, all_trackouts, mode="broadband"):
         try:
-            co = compressor.Compress(all_trackouts, self.signal_aggregator, self.sample_rate)
+            co = compressor.Compress(all_trackouts, self.signal_aggregator, self.sample_rate,
+                                     self.analysis_cache, mode)
             processed = co.compress()
             print(f"Successful compression of type {type(processed)}: \n\t{processed}")
             return processed
@@ -30,9 +34,31 @@ class Processor():
             app.logger.error(f"error in compress for trackID:", err)
             raise Exception(f"Error occurred in compress:\n {err}")
 
+    def fade(self, all_trackouts, audio_types=None):
+        try:
+            fa = fader.Fader(all_trackouts, self.signal_aggregator, self.sample_rate, audio_types,
+                             self.analysis_cache)
+            processed = fa.fade()
+            print(f"Successful fading of type {type(processed)}: \n\t{processed}")
+            return processed
+        except Exception as err:
+            app.logger.error(f"error in fade for trackID:", err)
+            raise Exception(f"Error occurred in fade:\n {err}")
+
+    def pan(self, all_trackouts, audio_types=None):
+        try:
+            pa = panner.Pan(all_trackouts, self.signal_aggregator, self.sample_rate, audio_types,
+                            self.analysis_cache)
+            processed = pa.pan()
+            print(f"Successful panning of type {type(processed)}: \n\t{processed}")
+            return processed
+        except Exception as err:
+            app.logger.error(f"error in pan for trackID:", err)
+            raise Exception(f"Error occurred in pan:\n {err}")
+
     def deesser(self, main_trackout):
         try:
-            de = deesser.Deesser(main_trackout, self.sample_rate)
+            de = deesser.Deesser(main_trackout, self.sample_rate, self.analysis_cache)
             processed = de.deess()
             print(f"Successful deesser of type {type(processed)}: \n\t{processed}")
             return processed
@@ -40,12 +66,22 @@ class Processor():
             app.logger.error(f"error in deesser for trackID:", err)
             raise Exception(f"Error occurred in deesser:\n {err}")
 
-    def reverb(self, main_trackout):
+    def reverb(self, main_trackout, engine="native"):
         try:
-            re = reverb.Reverb(main_trackout, self.sample_rate)
+            re = reverb.Reverb(main_trackout, self.sample_rate, self.analysis_cache, engine)
             processed = re.reverb()
             print(f"Successful reverb of type {type(processed)}: \n\t{processed}")
             return processed
         except Exception as err:
             app.logger.error(f"error in reverb for trackID:", err)
             raise Exception(f"Error occurred in reverb:\n {err}")
+
+    def tonal_balance(self, main_trackout):
+        try:
+            tb = tonal_balance.TonalBalance(main_trackout, self.sample_rate, self.analysis_cache)
+            processed = tb.balance()
+            print(f"Successful tonal balance of type {type(processed)}: \n\t{processed}")
+            return processed
+        except Exception as err:
+            app.logger.error(f"error in tonal_balance for trackID:", err)
+            raise Exception(f"Error occurred in tonal_balance:\n {err}")
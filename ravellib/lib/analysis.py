@@ -0,0 +1,148 @@
+import threading
+import librosa
+import numpy as np
+import ravellib.lib.preprocessing as preprocessing
+from ravellib.lib.loudness import loudness_meter
+
+
+class lazy_property:
+    '''
+    Computes an attribute on first access and stores it on the instance, so
+    later reads are plain attribute lookups. Python 3.7 has no
+    functools.cached_property.
+    '''
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = self.func(instance)
+        instance.__dict__[self.name] = value
+        return value
+
+
+class SignalAnalysis:
+    '''
+    Features of one signal at one STFT setting that do not depend on any
+    effect parameters. Every feature is computed on first read, and effects
+    built on the same SignalAnalysis share the result. base is another
+    analysis of the same signal whose downmix is reused.
+    '''
+    def __init__(self, signal, n_fft, window_size, hop_length, sr, base=None):
+        self.signal = signal
+        self.n_fft = n_fft
+        self.window_size = window_size
+        self.hop_length = hop_length
+        self.sr = sr
+        self.base = base
+        self._norm_fft_db = {}
+        self._lfe = {}
+
+    @lazy_property
+    def mono_signal(self):
+        if self.base is not None:
+            return self.base.mono_signal
+        return librosa.to_mono(self.signal)
+
+    @lazy_property
+    def fft(self):
+        return np.abs(librosa.core.stft(self.mono_signal, n_fft=self.n_fft,
+                                        win_length=self.window_size, hop_length=self.hop_length))
+
+    @lazy_property
+    def num_bins(self): return 1 + self.n_fft // 2
+
+    @lazy_property
+    def fft_db(self): return librosa.amplitude_to_db(self.fft)
+
+    @lazy_property
+    def freqs(self): return np.arange(self.num_bins) * self.sr / self.num_bins
+
+    @lazy_property
+    def rms(self):
+        return librosa.feature.rms(y=self.mono_signal, frame_length=self.window_size, hop_length=self.hop_length)
+
+    @lazy_property
+    def rms_db(self): return np.mean(librosa.amplitude_to_db(self.rms))
+
+    @lazy_property
+    def peak_db(self): return librosa.amplitude_to_db(np.sum(self.fft, axis=0)).max()
+
+    @lazy_property
+    def crest_factor(self): return self.peak_db / self.rms_db
+
+    @lazy_property
+    def loudness(self): return loudness_meter(self.sr).integrated_loudness(self.mono_signal)
+
+    def norm_fft_db(self, peak):
+        '''dB spectrum of the signal normalized to peak dB'''
+        if peak not in self._norm_fft_db:
+            # the STFT is linear, so the normalized spectrum is the cached one scaled by the gain
+            gain = preprocessing.normalize_gain(self.mono_signal, peak)
+            self._norm_fft_db[peak] = librosa.amplitude_to_db(gain * self.fft)
+        return self._norm_fft_db[peak]
+
+    def lfe(self, order, cutoff):
+        '''Low-frequency energy below cutoff'''
+        if (order, cutoff) not in self._lfe:
+            self._lfe[(order, cutoff)] = preprocessing.compute_lfe(self.mono_signal, order, cutoff, self.sr)
+        return self._lfe[(order, cutoff)]
+
+
+class AnalysisCache:
+    '''
+    SignalAnalysis objects for one processing job, keyed by
+    (trackout uuid, n_fft, window_size, hop_length). Register each trackout
+    signal with its uuid; unregistered arrays are keyed by identity. Evict
+    settings that only one effect reads once it is done with them, and clear
+    the cache when the job finishes.
+    '''
+    def __init__(self):
+        self._uuids = {}
+        self._signals = {}
+        self._analyses = {}
+        self._bases = {}
+        self._lock = threading.Lock()
+
+    def register(self, uuid, signal):
+        with self._lock:
+            self._uuids[id(signal)] = uuid
+            # holding the array keeps its id from being reused
+            self._signals[uuid] = signal
+
+    def source_key(self, signal):
+        uuid = self._uuids.get(id(signal))
+        if uuid is None:
+            uuid = ('id', id(signal))
+            self._signals[uuid] = signal
+        return uuid
+
+    def analysis(self, signal, n_fft, window_size, hop_length, sr):
+        '''Returns the shared SignalAnalysis of signal, creating it on first request'''
+        with self._lock:
+            uuid = self.source_key(signal)
+            key = (uuid, n_fft, window_size, hop_length)
+            if key not in self._analyses:
+                # the downmix does not depend on the STFT setting, so every analysis
+                # of a trackout takes it from one shared base that never holds a spectrum
+                if uuid not in self._bases:
+                    self._bases[uuid] = SignalAnalysis(signal, n_fft, window_size, hop_length, sr)
+                self._analyses[key] = SignalAnalysis(signal, n_fft, window_size, hop_length, sr,
+                                                     self._bases[uuid])
+            return self._analyses[key]
+
+    def evict(self, signal, n_fft, window_size, hop_length):
+        '''Drops the analysis of signal at one STFT setting; the shared downmix is kept'''
+        with self._lock:
+            uuid = self._uuids.get(id(signal), ('id', id(signal)))
+            self._analyses.pop((uuid, n_fft, window_size, hop_length), None)
+
+    def clear(self):
+        with self._lock:
+            self._uuids.clear()
+            self._signals.clear()
+            self._analyses.clear()
+            self._bases.clear()
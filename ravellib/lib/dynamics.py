@@ -0,0 +1,185 @@
+import numba
+import numpy as np
+from ravellib.lib.envelope import forget_factor, peak_follower
+from ravellib.lib.filters import linkwitz_riley_bank, sos_bank_filter
+
+
+@numba.njit(cache=True)
+def _noise_gate_kernel(x, g, lthcnt, uthcnt, prev_g, pos, ht, rel, att, ltrhold, utrhold):
+    '''
+    Runs the hold/attack/release gate state machine over a (channels x samples)
+    block. Counter arrays are updated in place so the next block picks up
+    exactly where this one stopped.
+    '''
+    num_channels, num_samples = x.shape
+    for c in range(num_channels):
+        lth = lthcnt[c]
+        uth = uthcnt[c]
+        g_prev = prev_g[c]
+        for i in range(num_samples):
+            n = pos + i
+            x_n = x[c, i]
+            if (x_n <= ltrhold) or ((x_n < utrhold) and (lth > 0)):
+                lth += 1
+                uth = 0
+                if lth > ht:
+                    if lth > (rel + ht):
+                        g_n = 0.0
+                    else:
+                        g_n = 1.0 - ((lth - ht) / rel)
+                elif (n < ht) and (lth == n):
+                    g_n = 0.0
+                else:
+                    g_n = 1.0
+            elif (x_n >= utrhold) or ((x_n > ltrhold) and (uth > 0)):
+                uth += 1
+                if g_prev < 1:
+                    g_n = max(uth / att, g_prev)
+                else:
+                    g_n = 1.0
+                lth = 0
+            else:
+                g_n = g_prev
+                lth = 0
+                uth = 0
+            g[c, i] = g_n
+            g_prev = g_n
+        lthcnt[c] = lth
+        uthcnt[c] = uth
+        prev_g[c] = g_prev
+
+
+class NoiseGate:
+    '''
+    Stateful noise gate. Accepts 1-D signals or (channels x samples) arrays and
+    can be fed consecutive blocks; hold, attack and release counters are carried
+    across block boundaries so streaming output matches a single full pass.
+    '''
+    def __init__(self, holdtime, ltrhold, utrhold, release, attack, fs, num_channels=1):
+        self.ht = round(holdtime * fs)
+        self.rel = round(release * fs)
+        self.att = round(attack * fs)
+        self.ltrhold = float(ltrhold)
+        self.utrhold = float(utrhold)
+        self.fs = fs
+        self.num_channels = num_channels
+        self.reset()
+
+    def reset(self):
+        self.lthcnt = np.zeros(self.num_channels, dtype=np.int64)
+        self.uthcnt = np.zeros(self.num_channels, dtype=np.int64)
+        self.prev_g = np.zeros(self.num_channels)
+        self.pos = 0
+
+    def process(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        is_1d = x.ndim == 1
+        x_2d = np.atleast_2d(x)
+        if x_2d.shape[0] != self.num_channels:
+            if self.pos != 0:
+                raise ValueError(f"gate holds state for {self.num_channels} channels, got {x_2d.shape[0]}")
+            self.num_channels = x_2d.shape[0]
+            self.reset()
+        g = np.empty(x_2d.shape)
+        _noise_gate_kernel(np.ascontiguousarray(x_2d), g, self.lthcnt, self.uthcnt, self.prev_g,
+                           self.pos, self.ht, self.rel, self.att, self.ltrhold, self.utrhold)
+        self.pos += x_2d.shape[1]
+        return g[0] if is_1d else g
+
+    def process_blocks(self, x, block_size):
+        x = np.asarray(x, dtype=np.float64)
+        g = np.empty(x.shape)
+        for start in range(0, x.shape[-1], block_size):
+            g[..., start:start+block_size] = self.process(x[..., start:start+block_size])
+        return g
+
+
+def gain_computer(x_db, threshold, ratio, knee_width):
+    '''
+    Static soft-knee compression curve. Returns the gain in dB (<= 0) for
+    input levels x_db, with a quadratic knee knee_width dB wide around threshold.
+    Parameters may be arrays that broadcast against x_db.
+    '''
+    over = np.asarray(x_db) - threshold
+    slope = 1.0 / np.asarray(ratio) - 1.0
+    knee_width = np.asarray(knee_width)
+    g = np.where(over > knee_width / 2, slope * over, 0.0)
+    in_knee = (np.abs(over) <= knee_width / 2) & (knee_width > 0)
+    return np.where(in_knee, slope * (over + knee_width / 2)**2 / (2 * np.maximum(knee_width, 1e-12)), g)
+
+
+class Compressor:
+    '''
+    Feed-forward compressor built from the comp_params parameters
+    (threshold dB, ratio, attack s, release s, knee width dB). Levels are
+    detected per sample, optionally linked across channels, and the gain
+    reduction is smoothed with a branching attack/release follower.
+    '''
+    def __init__(self, threshold, ratio, attack, release, knee_width, fs):
+        self.threshold = float(threshold)
+        self.ratio = max(float(ratio), 1.0)
+        self.knee_width = float(knee_width)
+        self.alpha_attack = forget_factor(attack, fs)
+        self.alpha_release = forget_factor(release, fs)
+        self.fs = fs
+
+    def gain_db(self, x, link=True):
+        '''
+        Smoothed gain in dB for a 1-D signal or (channels x samples) array.
+        With link the louder channel drives one gain row for all channels.
+        '''
+        x_2d = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        level = np.abs(x_2d).max(axis=0, keepdims=True) if link else np.abs(x_2d)
+        x_db = 20 * np.log10(np.maximum(level, 1e-10))
+        reduction = -gain_computer(x_db, self.threshold, self.ratio, self.knee_width)
+        return -peak_follower(reduction, self.alpha_attack, self.alpha_release)
+
+    def process(self, x, link=True):
+        '''Applies the smoothed gain curve to a 1-D or (channels x samples) signal'''
+        x = np.asarray(x)
+        gain = 10**(self.gain_db(x, link) / 20)
+        y = np.atleast_2d(x) * gain.astype(x.dtype)
+        return y.reshape(x.shape)
+
+
+class MultibandCompressor:
+    '''
+    Splits the signal into bands with one Linkwitz-Riley filter-bank pass,
+    compresses every band at once with per-band parameters, and sums the
+    bands back. Each parameter holds one value per band (len(crossovers) + 1).
+    '''
+    def __init__(self, crossovers, thresholds, ratios, attacks, releases, knee_widths, fs):
+        self.bank = linkwitz_riley_bank(crossovers, fs)
+        num_bands = self.bank.shape[0]
+        self.thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), (num_bands,))
+        self.ratios = np.maximum(np.broadcast_to(np.asarray(ratios, dtype=np.float64), (num_bands,)), 1.0)
+        self.knee_widths = np.broadcast_to(np.asarray(knee_widths, dtype=np.float64), (num_bands,))
+        self.alpha_attack = forget_factor(np.broadcast_to(np.asarray(attacks, dtype=np.float64), (num_bands,)), fs)
+        self.alpha_release = forget_factor(np.broadcast_to(np.asarray(releases, dtype=np.float64), (num_bands,)), fs)
+        self.fs = fs
+
+    def split(self, x):
+        '''(bands x channels x samples) band signals of a 1-D or (channels x samples) input'''
+        return sos_bank_filter(np.atleast_2d(x), self.bank)
+
+    def gain_db(self, bands, link=True):
+        '''Smoothed (bands x rows x samples) gain, with one row per channel or one linked row'''
+        level = np.abs(bands).max(axis=1, keepdims=True) if link else np.abs(bands)
+        num_bands, num_rows = level.shape[0], level.shape[1]
+        x_db = 20 * np.log10(np.maximum(level, 1e-10))
+        per_band = (slice(None), np.newaxis, np.newaxis)
+        reduction = -gain_computer(x_db, self.thresholds[per_band], self.ratios[per_band],
+                                   self.knee_widths[per_band])
+        state = np.zeros(num_bands * num_rows)
+        smoothed = peak_follower(reduction.reshape(num_bands * num_rows, -1),
+                                 np.repeat(self.alpha_attack, num_rows),
+                                 np.repeat(self.alpha_release, num_rows), state)
+        return -smoothed.reshape(reduction.shape)
+
+    def process(self, x, link=True):
+        '''Compresses the bands in place and recombines them in the input dtype'''
+        x = np.asarray(x)
+        bands = self.split(x)
+        bands *= 10**(self.gain_db(bands, link) / 20)
+        y = bands.sum(axis=0).astype(x.dtype)
+        return y.reshape(x.shape)
@@ -1,13 +1,26 @@
+import threading
 import ravellib.lib.preprocessing as preprocessing
 import librosa
 import numpy as np
-import pyloudnorm as pyln
-from pysndfx import AudioEffectsChain
 from scipy.io.wavfile import write
+from scipy.signal import sosfilt, sosfreqz
+from ravellib.lib.analysis import SignalAnalysis, lazy_property
+from ravellib.lib.dynamics import Compressor, MultibandCompressor
+from ravellib.lib.filters import band_sos, biquad_eq_sos, linear_phase_fir, overlap_save, sos_filter
+from ravellib.lib.loudness import loudness_meter
+from ravellib.lib.reverb import apply_reverb
+from ravellib.lib.sox import SoxChain
+import ravellib.lib.stft as stft
 
 
 class Signal:
-    def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr):
+    '''
+    Analysis features (downmix, spectra, frequency axis) are computed the
+    first time they are read, so effects only pay for what they use. Pass a
+    shared SignalAnalysis, e.g. from an AnalysisCache, to reuse them across
+    effects on the same signal.
+    '''
+    def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis=None):
         # self.path = path
         # self.sr = librosa.get_samplerate(self.path)
         self.sr = sr
@@ -15,24 +28,48 @@ class Signal:
         self.window_size = window_size
         self.hop_length = hop_length
         self.signal = signal
-        self.mono_signal = librosa.to_mono(self.signal)
-        self.signal_db = librosa.amplitude_to_db(self.mono_signal)
         self.peak = peak
         self.audio_type = audio_type
-        self.x_norm = preprocessing.normalize(self.mono_signal, self.peak)
-        
-        self.fft = np.abs(librosa.core.stft(self.mono_signal, n_fft=self.n_fft, 
-                                            win_length=self.window_size, hop_length=self.hop_length))
-        self.num_bins = self.fft.shape[0]
-        self.fft_db = librosa.amplitude_to_db(self.fft)
-        self.norm_fft_db = preprocessing.compute_norm_fft_db(self.x_norm, self.n_fft, self.window_size, self.hop_length)
-        self.freqs = np.array([i * self.sr / self.fft.shape[0] for i in range(self.num_bins)])
+        if analysis is None:
+            analysis = SignalAnalysis(signal, n_fft, window_size, hop_length, sr)
+        self.analysis = analysis
+
+    @property
+    def mono_signal(self): return self.analysis.mono_signal
+
+    @lazy_property
+    def signal_db(self): return librosa.amplitude_to_db(self.mono_signal)
+
+    @lazy_property
+    def x_norm(self): return preprocessing.normalize(self.mono_signal, self.peak)
+
+    @property
+    def fft(self): return self.analysis.fft
+
+    @property
+    def num_bins(self): return self.analysis.num_bins
+
+    @property
+    def fft_db(self): return self.analysis.fft_db
+
+    @property
+    def norm_fft_db(self): return self.analysis.norm_fft_db(self.peak)
+
+    @property
+    def freqs(self): return self.analysis.freqs
 
 
 class EQSignal(Signal):
+    '''
+    mask_mode selects how masking is measured against other signals:
+        "average": compares spectra averaged over the whole signal
+        "chunk": compares spectra averaged over `seconds` long chunks, counting
+                 only the chunks where both signals are active
+    '''
     def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
-                rank_threshold, max_n, max_eq):
-        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+                rank_threshold, max_n, max_eq, mask_mode="average", seconds=5, min_overlap_ratio=0.0,
+                analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.fft_db_avg = np.mean(self.fft_db, axis=1)
         self.rank = preprocessing.rank_signal_1d(self.fft_db_avg)
         self.rank_threshold = rank_threshold
@@ -40,31 +77,72 @@ class EQSignal(Signal):
         self.maskee_rank_vec = np.where(self.rank <= self.rank_threshold, 1, 0)
         self.max_n = max_n
         self.max_eq = max_eq
+        self.mask_mode = mask_mode
+        self.seconds = seconds
+        self.min_overlap_ratio = min_overlap_ratio
+        if self.mask_mode == "chunk":
+            self.chunk_fft_db = preprocessing.compute_chunk(self.norm_fft_db, self.hop_length, self.sr, self.seconds)
+            self.chunk_rank = preprocessing.compute_rank(self.chunk_fft_db)
+            self.sparse_vec = preprocessing.compute_sparsity(self.chunk_rank, self.num_bins)
 
     def compute_mask(self, signal):
+        if self.mask_mode == "chunk":
+            return self.compute_chunk_mask(signal)
         mask_ab = (self.masker_rank_vec * signal.maskee_rank_vec) * (self.fft_db_avg - signal.fft_db_avg)
         return mask_ab
 
+    def compute_chunk_mask(self, signal):
+        overlap_vec, num_overlaps, overlap_ratio = preprocessing.overlap(self.sparse_vec, signal.sparse_vec)
+        if num_overlaps == 0 or overlap_ratio < self.min_overlap_ratio:
+            return np.zeros(self.num_bins)
+        soa_vec_i = preprocessing.sparse_overlap_avg(self.num_bins, self.chunk_fft_db,
+                                                    self.sparse_vec, overlap_vec, num_overlaps)
+        soa_vec_j = preprocessing.sparse_overlap_avg(signal.num_bins, signal.chunk_fft_db,
+                                                    signal.sparse_vec, overlap_vec, num_overlaps)
+        r_soa_vec_i = preprocessing.rank_soa_vec(soa_vec_i)
+        r_soa_vec_j = preprocessing.rank_soa_vec(soa_vec_j)
+        masker_vec_i = preprocessing.masker_rank_vec(r_soa_vec_i, self.rank_threshold)
+        maskee_vec_j = preprocessing.maskee_rank_vec(r_soa_vec_j, self.rank_threshold)
+        mask_ij = ((masker_vec_i * maskee_vec_j) * (soa_vec_i - soa_vec_j)).flatten()
+        return mask_ij
+
     def eq_params(self, signals):
-        num_signals = len(signals)
+        mask = np.stack([self.compute_mask(signal) for signal in signals])
+        return self.eq_info(mask.max(axis=0))
+
+    @staticmethod
+    def group_eq_params(signals):
+        '''
+        EQ parameters for every signal against all of the others at once.
+        Builds the (masker x maskee x bins) mask in one broadcast, so each
+        signal is analysed once instead of once per other signal. Returns
+        one eq_info list per signal, matching eq_params(others).
+        '''
+        n = len(signals)
+        if all(signal.mask_mode == "average" for signal in signals):
+            mask = preprocessing.cross_mask(np.stack([signal.fft_db_avg for signal in signals]),
+                                            np.stack([signal.masker_rank_vec for signal in signals]),
+                                            np.stack([signal.maskee_rank_vec for signal in signals]))
+        else:
+            mask = np.full((n, n, signals[0].num_bins), -np.inf if n > 1 else 0.0)
+            for i in range(n):
+                for j in range(n):
+                    if i != j:
+                        mask[i, j] = signals[i].compute_mask(signals[j])
+        mask_m = mask.max(axis=1)
+        top_m = preprocessing.top_bins(mask_m, max(signal.max_n for signal in signals))
+        return [signal.eq_info(mask_m[i], top_m[i][-signal.max_n:]) for i, signal in enumerate(signals)]
+
+    def eq_info(self, mask_m, top_m=None):
+        '''Turns the per-bin maximum mask into peaking cuts at the max_n strongest bins'''
         num_bins = self.num_bins
-        max_n = self.max_n
         sr = self.sr
         max_eq = self.max_eq
-        mask = np.array([])
         eq_info = []
-        for m in range(num_signals):
-            mask_ab = self.compute_mask(signals[m])
-            mask = np.append(mask, mask_ab, axis=0)
-        mask_m = np.zeros(num_bins)
-        for b in range(num_bins):
-            arr = mask[b::num_bins]
-            max_b = np.max(arr)
-            mask_m[b] = max_b
-        top_m = np.argsort(mask_m)[-max_n:]
+        if top_m is None:
+            top_m = preprocessing.top_bins(mask_m, self.max_n)
         top_m_max = mask_m[top_m].max()
-        idx = np.unravel_index(top_m, mask_m.shape)[0]
-        for x in idx:
+        for x in top_m:
             freq_bin = x  * (sr / num_bins)
             mask_val = mask_m[x]
             if (mask_val > 0) and (freq_bin <= 20000) and (freq_bin >= 20):
@@ -77,27 +155,56 @@ class EQSignal(Signal):
             eq_info.append([100, 0 , 1]) # highpass filter best practice
         return eq_info
 
-    def equalization(self, eq_info, Q):
-        num_filters = len(eq_info)
+    def equalization(self, eq_info, Q, eq_mode="iir", processors=()):
+        '''
+        Applies every eq_info band as one biquad cascade over both channels.
+        Peaking bands use width Q; the curves match the SoX filters used before.
+        eq_mode "linear" applies the same magnitude response with linear phase,
+        "spectral" applies it in a SpectralChain together with processors.
+        '''
+        if eq_mode == "linear":
+            return self.linear_phase_equalization(eq_info, Q)
+        if eq_mode == "spectral":
+            return self.spectral_equalization(eq_info, Q, processors)
         y = self.signal
-        for i in range(num_filters):
-            freq = float(eq_info[i][0])
-            gain = float(eq_info[i][1])
-            eq_type = int(eq_info[i][2])
-            if eq_type == 0:
-                eq = AudioEffectsChain().equalizer(freq, Q, -gain)
-                y = eq(y)
-            elif eq_type == 1:
-                eq = AudioEffectsChain().highpass(freq)
-                y = eq(y)
-            elif eq_type == 2:
-                eq = AudioEffectsChain().lowpass(freq)
-                y = eq(y)
-            elif eq_type == 3:
-                eq = AudioEffectsChain().lowshelf(-gain, freq)
-
-            elif eq_type == 4:
-                eq = AudioEffectsChain().highshelf(gain, freq)
+        if len(eq_info) > 0:
+            sos = biquad_eq_sos(eq_info, self.sr, Q)
+            y = sosfilt(sos, self.signal, axis=-1).astype(self.signal.dtype)
+        output = np.array(y)
+        write_output = output.T
+        return write_output
+
+    def spectral_eq(self, eq_info, Q):
+        '''SpectralChain processor applying the eq_info magnitude response as a per-bin gain'''
+        sos = biquad_eq_sos(eq_info, self.sr, Q)
+        def processor(magnitude, freqs, times):
+            if sos.shape[0] == 0:
+                return 1.0
+            return np.abs(sosfreqz(sos, worN=freqs, fs=self.sr)[1])[:, np.newaxis]
+        return processor
+
+    def spectral_equalization(self, eq_info, Q, processors=(), n_fft=2048, hop_length=512):
+        '''
+        Applies the eq_info response and any other SpectralChain processors,
+        e.g. a de-esser for the same trackout, between one forward and one
+        inverse STFT.
+        '''
+        chain = SpectralChain(n_fft, hop_length, self.sr).add(self.spectral_eq(eq_info, Q))
+        for processor in processors:
+            chain.add(processor)
+        write_output = chain.process(self.signal).T
+        return write_output
+
+    def linear_phase_equalization(self, eq_info, Q, num_taps=8191, block_size=2**15):
+        '''
+        Compiles all eq_info bands into a single linear-phase FIR and applies
+        it by overlap-save FFT convolution, so the cost does not grow with
+        the number of bands and memory is bounded by block_size.
+        '''
+        y = self.signal
+        if len(eq_info) > 0:
+            fir = linear_phase_fir(biquad_eq_sos(eq_info, self.sr, Q), self.sr, num_taps)
+            y = overlap_save(self.signal, fir, block_size).astype(self.signal.dtype)
         output = np.array(y)
         write_output = output.T
         return write_output
@@ -121,49 +228,37 @@ class EQSignal(Signal):
     #     r_avg = np.mean(r_active)
     #     return r_avg
 
-    # def compute_mask(self, signal, overlap_vec, num_overlaps):
-    #     soa_vec_i = preprocessing.sparse_overlap_avg(self.num_bins, self.chunk_fft_db, 
-    #                                                 self.sparse_vec, overlap_vec, num_overlaps)
-    #     soa_vec_j = preprocessing.sparse_overlap_avg(signal.num_bins, signal.chunk_fft_db, 
-    #                                                 signal.sparse_vec, overlap_vec, num_overlaps)
-    #     r_soa_vec_i = preprocessing.rank_soa_vec(soa_vec_i)
-    #     r_soa_vec_j = preprocessing.rank_soa_vec(soa_vec_j)
-    #     masker_vec_i = preprocessing.masker_rank_vec(r_soa_vec_i)
-    #     maskee_vec_j = preprocessing.maskee_rank_vec(r_soa_vec_j)
-    #     mask_ij = ((masker_vec_i * maskee_vec_j) * (soa_vec_i - soa_vec_j)).flatten()
-    #     m_f = np.concatenate((mask_ij[:, np.newaxis], self.freqs[:, np.newaxis]), axis=1)
-    #     return mask_ij 
-
 
 class CompressSignal(Signal):
     def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
-                time_constant, order, cutoff, std, attack_max, release_max):
-        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+                time_constant, order, cutoff, std, attack_max, release_max, analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.time_constant = time_constant
         self.order = order
         self.cutoff = cutoff
         self.std = std
         self.attack_max = attack_max
         self.release_max = release_max
-        self.rms = librosa.feature.rms(self.mono_signal, frame_length=self.window_size, hop_length=self.hop_length)
-        self.rms_db = np.mean(librosa.amplitude_to_db(self.rms))
-        self.peak_db = librosa.amplitude_to_db(np.sum(self.fft, axis=0)).max()
-        self.crest_factor = self.peak_db / self.rms_db
-        self.lfe = preprocessing.compute_lfe(self.mono_signal, self.order, self.cutoff, self.sr)
+        self.rms = self.analysis.rms
+        self.rms_db = self.analysis.rms_db
+        self.peak_db = self.analysis.peak_db
+        self.crest_factor = self.analysis.crest_factor
+        self.lfe = self.analysis.lfe(self.order, self.cutoff)
+        self._band_levels = {}
     
     def compute_wp(self, cf_avg): return preprocessing.wp(self.crest_factor, cf_avg, self.std)
 
     def compute_lf_weighting(self, lfa): return self.lfe / lfa
 
-    def ratio(self, wf, wp): return float(0.54*wp + 0.764*wf + 1)
+    def ratio(self, wf, wp): return float(preprocessing.ratio(wf, wp))
 
-    def threshold(self, wp):return float(-11.03 + 0.44*self.rms_db - 4.897*wp)
+    def threshold(self, wp): return float(preprocessing.threshold(self.rms_db, wp))
 
-    def knee_width(self, threshold): return abs(threshold) / 2
+    def knee_width(self, threshold): return preprocessing.knee_width(threshold)
 
-    def attack(self): return float((2*self.attack_max) / self.crest_factor ** 2)
+    def attack(self): return float(preprocessing.attack(self.attack_max, self.crest_factor ** 2))
 
-    def release(self): return float((2*self.release_max) / self.crest_factor ** 2)
+    def release(self): return float(preprocessing.release(self.release_max, self.crest_factor ** 2))
 
     def comp_params(self, cfa, lfa):
         w_p = self.compute_wp(cfa)
@@ -175,21 +270,79 @@ class CompressSignal(Signal):
         rel = self.release()
         return [t, r, a, rel, kw]
 
-    def compression(self, params):
-        compress = AudioEffectsChain().compand(attack=params[2], decay=params[3], soft_knee=params[1], 
-                    threshold=params[0], db_from=params[0], db_to=params[0])
-        y = compress(self.signal)
-        mono_y = librosa.to_mono(y)
-        makeup_gain = preprocessing.compute_makeup_gain(self.mono_signal, mono_y, self.sr)
-        gain = (AudioEffectsChain().gain(makeup_gain))
-        output = np.array(gain(y))
-        write_output = output.T
+    def input_loudness(self):
+        '''Integrated loudness of the uncompressed signal, measured once'''
+        return self.analysis.loudness
+
+    def makeup(self, compressed):
+        '''Linear makeup gain that restores the input loudness, measured on the compressed downmix'''
+        mono_y = np.mean(np.atleast_2d(compressed), axis=0)
+        makeup_gain = preprocessing.compute_makeup_gain(self.mono_signal, mono_y, self.sr,
+                                                        loudness_in=self.input_loudness())
+        if not np.isfinite(makeup_gain):
+            makeup_gain = 0.0
+        return np.asarray(10**(makeup_gain/20), dtype=self.signal.dtype)
+
+    def compression(self, params, link=True):
+        '''
+        Compresses the signal in process with params from comp_params
+        ([threshold, ratio, attack, release, knee width]). With link both
+        channels share the gain of the louder one. The makeup gain depends
+        on the compressed loudness, so it scales the compressed signal in
+        place afterwards instead of allocating another copy.
+        '''
+        compressed = Compressor(*params, self.sr).process(self.signal, link=link)
+        compressed *= self.makeup(compressed)
+        write_output = compressed.T
+        return write_output
+
+    def band_levels(self, crossovers):
+        '''Per-band (peak_db, rms_db) for bands split at crossovers, read from the cached spectrum'''
+        crossovers = tuple(crossovers)
+        if crossovers not in self._band_levels:
+            self._band_levels[crossovers] = preprocessing.band_levels(self.fft, self.freqs, crossovers, self.n_fft)
+        return self._band_levels[crossovers]
+
+    def band_crest_factors(self, crossovers):
+        peak_db, rms_db = self.band_levels(crossovers)
+        return peak_db / rms_db
+
+    def multiband_params(self, crossovers, cfa, lfa):
+        '''
+        comp_params for every band as a (5 x bands) array. The broadband
+        formulas are applied to each band's crest factor and RMS, against cfa
+        holding the per-band averages from SignalAggregator.cfa. LF weighting
+        only raises the ratio of the lowest band.
+        '''
+        peak_db, rms_db = self.band_levels(crossovers)
+        cf = peak_db / rms_db
+        w_p = preprocessing.wp(cf, cfa, self.std)
+        w_f = np.zeros(cf.shape[0])
+        w_f[0] = self.compute_lf_weighting(lfa)
+        r = preprocessing.ratio(w_f, w_p)
+        t = preprocessing.threshold(rms_db, w_p)
+        kw = preprocessing.knee_width(t)
+        # narrow bands can have small crest factors, so keep the times under their maxima
+        a = np.minimum(preprocessing.attack(self.attack_max, cf ** 2), self.attack_max)
+        rel = np.minimum(preprocessing.release(self.release_max, cf ** 2), self.release_max)
+        return np.array([t, r, a, rel, kw])
+
+    def multiband_compression(self, params, crossovers, link=True):
+        '''
+        Splits the signal at crossovers in one Linkwitz-Riley pass, compresses
+        all bands together with the per-band multiband_params and sums them
+        back, with the makeup gain measured and applied in place as in
+        compression().
+        '''
+        compressed = MultibandCompressor(crossovers, *params, self.sr).process(self.signal, link=link)
+        compressed *= self.makeup(compressed)
+        write_output = compressed.T
         return write_output
 
 class FaderSignal(Signal):
-    def __init__(self, path, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
-                decay, step, lead, max_fader, min_fader, B):
-        super().__init__(path, signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+    def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
+                decay, step, lead, max_fader, min_fader, B, analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.decay = decay
         self.step = step
         self.lead = lead
@@ -198,52 +351,42 @@ class FaderSignal(Signal):
         self.B = B
     
     def full_loudness(self):
-        x_norm = self.x_norm
-        sr = self.sr
-        step = self.step
-        decay = self.decay
-        N = x_norm.shape[0]
-        num_segments = int(N / (step * sr))
-        L_m = np.zeros(x_norm.shape)
-        for n in range(num_segments):
-            L_m[step*sr*n: step*sr*(n+1)] = preprocessing.loudness(x_norm[step*sr*n: step*sr*(n+1)], decay)
-        L_m[step*sr*(n+1):] = preprocessing.loudness(x_norm[step*sr*(n+1):], decay)
-        # ind = np.where(~np.isnan(L_m))[0] # temp fix until figuring out why function returns NaN values
-        # first, last = ind[0], ind[-1]
-        # L_m[:first] = L_m[first]
-        # L_m[last + 1:] = L_m[last]
-        mask = np.isnan(L_m)
-        L_m[mask] = np.interp(np.flatnonzero(mask), np.flatnonzero(~mask), L_m[~mask])
-        return L_m
+        '''
+        Loudness curve at one value per hop_length samples, reset every step
+        seconds. The segments are whole frames, so step is rounded to the
+        nearest multiple of hop_length samples (at least one frame).
+        '''
+        segment_length = max(1, int(round(self.step * self.sr / self.hop_length)))
+        return preprocessing.frame_loudness(self.x_norm, self.decay, self.hop_length, segment_length)
 
     def compute_fader(self, L_av, L2):
-        F_m = np.zeros(L2.shape)
-        for n in range(len(F_m)):
-            F_m[n] = 10 ** ((L_av[n] - L2[n]) / 20)
+        F_m = 10 ** ((L_av - L2) / 20)
         if self.lead == True:
-            F_m[n] = F_m[n] * 10 ** (self.B/20)
+            F_m = F_m * 10 ** (self.B/20)
+        return np.clip(F_m, self.min_fader, self.max_fader)
 
-        F_m = np.where(F_m > self.max_fader, self.max_fader, F_m)
-        F_m = np.where(F_m < self.min_fader, self.min_fader, F_m)
-        return F_m
-
-    def fader(self, fader_output): return self.signal * fader_output
+    def fader(self, fader_output):
+        '''Interpolates the frame-rate fader gain to sample rate and applies it'''
+        num_samples = self.signal.shape[-1]
+        frame_centers = (np.arange(fader_output.shape[0]) + 0.5) * self.hop_length
+        gain = np.interp(np.arange(num_samples), frame_centers, fader_output).astype(np.float32)
+        return self.signal * gain
 
 class PanSignal(Signal):
-    def __init__(self, path, signal, n_fft, window_size, hop_length, peak, audio_type, sr, 
-                cutoffs, window, order, btype):
-        super().__init__(path, signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+    def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr, 
+                cutoffs, window, order, btype, analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.window = window
         self.order = order
         self.btype = btype
         self.cutoffs = cutoffs
         self.window_step = int(self.sr * self.window)
-        self.num_steps = int(self.signal.shape[0] / self.window_step)
+        self.num_steps = int(self.mono_signal.shape[0] / self.window_step)
         self.K = len(cutoffs)
 
 
     def lead_filter(self): 
-        return preprocessing.peak_filter_bank(self.signal, self.cutoffs, 
+        return preprocessing.peak_filter_bank(self.mono_signal, self.cutoffs, 
                                 self.sr, self.order, self.btype, 
                                 self.window_step, self.num_steps)
 
@@ -252,23 +395,52 @@ class PanSignal(Signal):
         # quick fix - should be done from the signal aggregator function
         if self.audio_type == "vocal":
             P = 0.5
-        left = np.cos(P * np.pi) * self.signal
-        right = np.sin(P * np.pi) * self.signal
-        return np.dstack((left,right))[0]
+        signal = np.atleast_2d(self.signal)
+        panned = preprocessing.pan_matrix(P, signal.shape[0]) @ signal
+        return panned.T
 
 class DeEsserSignal(Signal):
-    # to do: clean up for purpose of stereo signals
+    '''
+    Sibilance detection frames the downmix once. Sharpness, zero-crossing
+    rate and short-time energy all read the same strided frame view, and
+    sharpness takes its spectrum from a single transform of those frames.
+    '''
     def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
-                critical_bands, c, sharp_thresh, max_reduction):
-        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+                critical_bands, c, sharp_thresh, max_reduction, analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.critical_bands = critical_bands
-        self.bark_idx = preprocessing.freq_bark_map(self.freqs, self.critical_bands)
+        self.bark_mat = preprocessing.critical_band_matrix(self.sr, self.n_fft, tuple(self.critical_bands))
         self.c = c
         self.sharp_thresh = sharp_thresh
         self.max_reduction = max_reduction
-        self.cb_fft = preprocessing.critical_band_sum(self.fft, self.bark_idx, len(critical_bands))
-        self.N_z = preprocessing.compute_Nz(self.cb_fft)
-        self.g_z = np.apply_along_axis(np.exp, 0, (0.171*self.cb_fft))
+
+    @lazy_property
+    def frames(self):
+        '''(frames x n_fft) view of the downmix, frame t centered on sample t * hop_length'''
+        padded = stft.pad_center(np.asarray(self.mono_signal, dtype=np.float64), self.n_fft, 'reflect')
+        return stft.frame(padded, self.n_fft, self.hop_length)
+
+    @lazy_property
+    def window_frames(self):
+        '''window_size long frames with the same centers, sliced from frames when they fit'''
+        if self.window_size <= self.n_fft:
+            offset = (self.n_fft - self.window_size) // 2
+            return self.frames[:, offset:offset + self.window_size]
+        padded = stft.pad_center(np.asarray(self.mono_signal, dtype=np.float64), self.window_size, 'reflect')
+        return stft.frame(padded, self.window_size, self.hop_length)
+
+    @lazy_property
+    def frame_fft(self):
+        return np.abs(np.fft.rfft(self.frames * stft.window('hann', self.n_fft), axis=-1)).T
+
+    @lazy_property
+    def cb_fft(self): return self.bark_mat @ self.frame_fft
+
+    @lazy_property
+    def N_z(self): return preprocessing.compute_Nz(self.cb_fft)
+
+    @lazy_property
+    def g_z(self): return np.exp(0.171*self.cb_fft)
 
     def compute_sharpness(self):
         numr = np.sum(self.N_z*self.g_z, axis=0)
@@ -276,59 +448,70 @@ class DeEsserSignal(Signal):
         S = self.c * (numr / (denom+1e-9))
         return S
 
-    def compute_zcr(self):
-        y0 = preprocessing.apply_bfilter(self.signal, 60, self.sr, 1, 'highpass')
-        y1 = preprocessing.apply_bfilter(y1, 600, self.sr, 1, 'lowpass')
-        zcr = librosa.feature.zero_crossing_rate(y1, frame_length=self.window_size, 
-                                                hop_length=self.hop_length)
-        return zcr
+    def compute_zcr(self, band=(60, 600)):
+        '''
+        Zero-crossing rate of the band-passed downmix per window_size frame.
+        Crossings are counted once over the whole signal and summed per frame
+        from a cumulative sum, so the filtered signal is never framed.
+        '''
+        y = sos_filter(self.mono_signal, band_sos(band[0], band[1], self.sr, 1))
+        y = stft.pad_center(np.where(np.abs(y) <= 1e-10, 0.0, y), self.window_size, 'edge')
+        crossings = np.concatenate(([0], np.signbit(y[1:]) != np.signbit(y[:-1])))
+        counts = np.concatenate(([0], np.cumsum(crossings)))
+        starts = np.arange(self.frames.shape[0]) * self.hop_length
+        zcr = (counts[starts + self.window_size] - counts[starts + 1]) / self.window_size
+        return zcr[np.newaxis, :]
 
     def compute_ste(self, rab):
         N = self.window_size
-        frames = librosa.util.frame(self.signal, frame_length=self.window_size,
-                                    hop_length=self.hop_length)
+        frames = self.window_frames
         if rab:
-            idx = np.array(range(256))
-            hn = 0.54 - 0.46 * np.cos(2*np.pi * idx / (N-1))
-            ste = np.sum(frames*hn, axis=0, keepdims=True)
+            hn = stft.window('hamming', N, periodic=False)
+            ste = np.sum(frames*hn, axis=1)[np.newaxis, :]
             return ste
-        ste = np.mean(np.abs(frames)**2, axis=0, keepdims=True)
+        ste = np.mean(frames**2, axis=1)[np.newaxis, :]
         return ste
 
+    def compute_features(self, rab=False):
+        '''Sharpness, zero-crossing rate and short-time energy from the one framing pass'''
+        return self.compute_sharpness(), self.compute_zcr(), self.compute_ste(rab)
+
     def gain_reduction(self, sharpness):
-        N = sharpness.shape[0]
-        sharpness
-        gain = np.ones(N)
-        for n in range(N):
-            if sharpness[n] > self.sharp_thresh:
-                gain[n] = 1 + (np.log(sharpness[n]) / np.log(0.1))
-                if gain[n] < self.max_reduction:
-                    gain[n] = self.max_reduction
-
-        return gain
-
-    def deesser(self, gain):
-        y_out = np.zeros(self.signal.shape)
-        frame_sig = librosa.util.frame(self.signal, frame_length=self.n_fft, hop_length=self.hop_length)
+        '''Per-frame gain: 1 below sharp_thresh, else 1 + log10(1/S) clipped at max_reduction'''
+        sharpness = np.asarray(sharpness, dtype=np.float64)
+        reduced = np.maximum(1 + np.log(np.maximum(sharpness, 1e-12)) / np.log(0.1), self.max_reduction)
+        return np.where(sharpness > self.sharp_thresh, reduced, 1.0)
+
+    def spectral_deesser(self, gain, band=(4000, 10000)):
+        '''
+        SpectralChain processor that applies the per-frame gain to the
+        sibilance band, interpolating it from the analysis frames onto the
+        chain's frames.
         '''
-            M is the number of time frames. It needs to remain flexible based on the length of song.
-            M will be an integer that depends on how many time frames an audio signal has.
+        frame_times = np.arange(gain.shape[0]) * self.hop_length / self.sr
+        in_band = (band[0], band[1])
+        def processor(magnitude, freqs, times):
+            gain_t = np.interp(times, frame_times, gain)
+            return np.where(((freqs >= in_band[0]) & (freqs <= in_band[1]))[:, np.newaxis], gain_t, 1.0)
+        return processor
+
+    def deesser(self, gain, band=(4000, 10000)):
         '''
-        M, N = frame_sig.shape[0], frame_sig.shape[1]
-        # fix padding that makes these dimensions not always aligned via stft
-        # quick fix is a truncation of array 
-        y = np.zeros((M, N))
-        y = y.flatten('F')
-        n = y.shape[0]
-        y_out[:n] = y
-        return y_out
+        Applies the per-frame gain to the sibilance band of every channel in
+        the STFT domain and resynthesizes with a windowed overlap-add, using a
+        quarter-frame hop.
+        '''
+        chain = SpectralChain(self.n_fft, self.n_fft // 4, self.sr)
+        chain.add(self.spectral_deesser(gain, band))
+        write_output = chain.process(self.signal).T
+        return write_output
 
 
 class ReverbSignal(Signal):
     def __init__(self, signal, n_fft, window_size, hop_length, peak, audio_type, sr,
                 reverbance, hf_damping, room_scale, wet_gain, effect_percent, hp_freq, lp_freq, order,
-                stereo_depth, pre_delay):
-        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr)
+                stereo_depth, pre_delay, analysis=None):
+        super().__init__(signal, n_fft, window_size, hop_length, peak, audio_type, sr, analysis)
         self.reverbance = reverbance
         self.hf_damping = hf_damping
         self.room_scale = room_scale
@@ -343,15 +526,75 @@ class ReverbSignal(Signal):
                                                                 self.hp_freq, self.lp_freq, self.order, self.sr)
         self.dry_signal = self.signal * (1 - self.effect_percent)
 
-    def reverb(self):
-        fx = AudioEffectsChain().reverb(self.reverbance, self.hf_damping, self.room_scale, self.stereo_depth,
-                                        self.pre_delay, self.wet_gain)
-        y_fx = fx(self.effect_signal)
-        y_out = self.dry_signal + y_fx
+    def reverb(self, engine="native"):
+        '''
+        Reverberates the band-limited send and mixes it back with the dry
+        signal. engine selects the reverb:
+            "native": convolution with a cached impulse response built from the parameters
+            "sox": the SoX reverb, run as one SoxChain process
+        '''
+        if engine == "sox":
+            chain = SoxChain(self.sr).reverb(self.reverbance, self.hf_damping, self.room_scale,
+                                             self.stereo_depth, self.pre_delay, self.wet_gain, wet_only=True)
+            y_fx = chain.process(self.effect_signal)
+            y_fx = librosa.util.fix_length(y_fx, size=self.signal.shape[-1])
+        else:
+            y_fx = apply_reverb(self.effect_signal, self.reverbance, self.hf_damping, self.room_scale,
+                                self.stereo_depth, self.pre_delay, self.wet_gain, self.sr)
+        y_out = (self.dry_signal + y_fx).astype(self.signal.dtype)
         write_output = y_out.T
         return write_output
 
 
+class SpectralChain:
+    '''
+    Runs several frequency-domain processors between one forward and one
+    inverse STFT, so chaining spectral effects costs about one transform
+    pair. A processor is called as processor(magnitude, freqs, times) with
+    the (channels x bins x frames) magnitude, the bin frequencies and the
+    frame times in seconds. It returns a gain that broadcasts against the
+    magnitude, and the gains of all processors multiply.
+    '''
+    def __init__(self, n_fft, hop_length, sr):
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.sr = sr
+        self.processors = []
+
+    def add(self, processor):
+        self.processors.append(processor)
+        return self
+
+    def process(self, signal):
+        '''Applies every processor to a 1-D or (channels x samples) signal, returning the same shape'''
+        x = np.atleast_2d(signal)
+        X = stft.stft(x, self.n_fft, self.hop_length)
+        if self.processors:
+            magnitude = np.abs(X)
+            freqs = np.fft.rfftfreq(self.n_fft, 1 / self.sr)
+            times = np.arange(X.shape[-1]) * self.hop_length / self.sr
+            G = np.ones(X.shape)
+            for processor in self.processors:
+                G *= processor(magnitude, freqs, times)
+            X = X * G
+        y = stft.istft(X, self.hop_length, x.shape[-1])
+        return y.astype(np.asarray(signal).dtype).reshape(np.shape(signal))
+
+
+class SpectralGate:
+    '''
+    SpectralChain processor that attenuates every bin whose level, linked
+    across channels, is below threshold_db by reduction_db.
+    '''
+    def __init__(self, threshold_db, reduction_db):
+        self.threshold_db = threshold_db
+        self.reduction_db = reduction_db
+
+    def __call__(self, magnitude, freqs, times):
+        level_db = librosa.amplitude_to_db(magnitude.max(axis=0), ref=1.0, top_db=None)
+        return np.where(level_db < self.threshold_db, 10**(-self.reduction_db / 20), 1.0)
+
+
 class SignalAggregator:
     '''Computes all of the aggregated stats for each effect'''
     def __init__(self, sr, M):
@@ -362,32 +605,45 @@ class SignalAggregator:
 
     def cfa(self, cfs): return sum([cf for cf in cfs]) / self.M
 
+    def _band_positions(self, signal_peaks):
+        # orders signals by lead band, then numbers them 1..N_k within each band
+        signal_peaks = np.asarray(signal_peaks)
+        order = np.argsort(signal_peaks, kind='stable')
+        _, inverse, counts = np.unique(signal_peaks[order], return_inverse=True, return_counts=True)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        N_k = counts[inverse]
+        i = np.arange(order.shape[0]) - starts[inverse] + 1
+        denom = np.maximum(2 * (N_k - 1), 1)
+        P = np.where((N_k + i) % 2 != 0, (N_k - i - 1) / denom, 1 - ((N_k - i) / denom))
+        P = np.where(N_k == 1, 1/2, P)
+        return order, P
+
     def panning_locations(self, filter_freqs, signal_peaks):
-        N_ks = np.unique(signal_peaks, return_inverse=True, return_counts=True)
-        num_k = N_ks[0].shape[0]
-        Ps = []
-        for k in np.arange(num_k):
-            freq = N_ks[0][k]
-            N_k = N_ks[2][k]
-            P = np.zeros((N_k))
-            for i in np.arange(N_k):
-                if N_k == 1:
-                    P[i] = 1/2
-                elif N_k + i % 2 != 0:
-                    P[i] = (N_k - i - 1) / (2 * (N_k - i))
-                elif (N_k + i % 2 == 0) and (N_k != 1):
-                    P[i] = 1 - ((N_k - i) / (2 * (N_k -1)))
-                idx = np.argwhere(signal_peaks == freq)[i][0]
-                Ps.append([idx, P[i]])
+        '''
+        Spreads the signals that share a lead filter band across the stereo
+        field. Returns [signal index, pan position] pairs grouped by band.
+        '''
+        order, P = self._band_positions(signal_peaks)
+        return [[int(idx), p] for idx, p in zip(order, P.tolist())]
+
+    def pan_positions(self, filter_freqs, signal_peaks):
+        '''Pan position for every signal, in signal order'''
+        order, P = self._band_positions(signal_peaks)
+        Ps = np.empty(P.shape[0])
+        Ps[order] = P
         return Ps
 
-    def loudness_avg(self, channels, holdtime, ltrhold, utrhold, release, attack):
-        gains = [preprocessing.noise_gate(channels[i], holdtime, ltrhold, utrhold, release, attack, self.sr) 
-                 for i in range(len(channels))]
-        gains = [np.where(gain < 1, 0, 1) for gain in gains]
-        gain_val = np.array(gains).sum(axis=0)
-        L_g = [channel * gain for channel, gain in zip(channels, gains)] 
-        L_c = np.array(L_g).sum(axis=0)
+    def loudness_avg(self, channels, holdtime, ltrhold, utrhold, release, attack, rate=None):
+        '''
+        Average loudness across the channels that are not gated out. rate is
+        the rate of the loudness curves and defaults to the sample rate.
+        '''
+        channels = np.asarray(channels)
+        rate = self.sr if rate is None else rate
+        gains = preprocessing.noise_gate(channels, holdtime, ltrhold, utrhold, release, attack, rate)
+        gains = np.where(gains < 1, 0, 1)
+        gain_val = gains.sum(axis=0)
+        L_c = np.sum(channels * gains, axis=0)
         # L_av = np.where(gain_val > 0, L_c / gain_val, -50)
         L_av = np.ones(gain_val.shape[0]) * -30
         np.divide(L_c, gain_val, out=L_av, where=gain_val != 0)
@@ -397,14 +653,49 @@ class SignalAggregator:
 
 
 class Mixer:
-    def __init__(self, signals, output_path, sr):
-        self.signals = signals
+    '''
+    Sums stems into one preallocated float32 (samples x channels) buffer as
+    they arrive, so only the mix is held in memory. Size it to the longest
+    stem; a longer stem grows the buffer. Stems are (samples x channels),
+    as returned by the effects, and may differ in length.
+    '''
+    def __init__(self, output_path, sr, num_samples=0, num_channels=2):
         self.output_path = output_path
         self.sr = sr
+        self.num_channels = num_channels
+        self.output = np.zeros((num_samples, num_channels), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def mix_matrix(self, num_channels, gain=1.0, pan=None):
+        '''(output channels x stem channels) matrix applying gain and, if given, a pan position in [0, 1]'''
+        if pan is None and num_channels == self.num_channels:
+            M = np.eye(num_channels)
+        elif num_channels not in (1, 2) or self.num_channels != 2:
+            raise ValueError(f"can only pan mono or stereo stems into a stereo mix, got {num_channels} "
+                             f"stem channels and {self.num_channels} mix channels")
+        elif pan is None:
+            M = preprocessing.pan_matrix(0.5, num_channels)
+        else:
+            M = preprocessing.pan_matrix(pan, num_channels)
+        return (gain * M).astype(np.float32)
+
+    def add(self, stem, gain=1.0, pan=None):
+        '''Mixes a (samples x channels) or mono stem into the output buffer'''
+        stem = np.asarray(stem)
+        if stem.ndim == 1:
+            stem = stem[:, np.newaxis]
+        M = self.mix_matrix(stem.shape[1], gain, pan)
+        contribution = stem.astype(np.float32, copy=False) @ M.T
+        num_samples = stem.shape[0]
+        with self._lock:
+            if num_samples > self.output.shape[0]:
+                grown = np.zeros((num_samples, self.num_channels), dtype=np.float32)
+                grown[:self.output.shape[0]] = self.output
+                self.output = grown
+            self.output[:num_samples] += contribution
 
     def mix(self):
-        output = np.sum(self.signals, axis=0)
-        return output.astype(np.float32)
+        return self.output
 
     def output_wav(self, mixed_file): 
         write(self.output_path, self.sr, mixed_file)
@@ -421,8 +712,7 @@ class Track:
         return peak_db[0]
 
     def calculate_loudness(self):
-        meter = pyln.Meter(self.sr)
-        loudness = meter.integrated_loudness(self.track)
+        loudness = loudness_meter(self.sr).integrated_loudness(self.track)
         return loudness
 
     def calculate_rms(self):
@@ -0,0 +1,62 @@
+import numba
+import numpy as np
+
+
+def forget_factor(time_constant, sr):
+    '''
+    Alpha signifies the forget factor for parameter autonomation equations
+    '''
+    return np.exp(-1 / (time_constant * sr))
+
+
+def peak_mask(num_frames, peaks):
+    '''Boolean vector that is True at every frame index listed in peaks'''
+    mask = np.zeros(num_frames, dtype=bool)
+    mask[peaks] = True
+    return mask
+
+
+def lagged_peak(x_sq, prev_sq, alpha):
+    '''
+    max(x[n]^2, alpha * p[n-1]^2 + (1 - alpha) * x[n]^2) for every frame but
+    the first, which stays zero. Works on the last axis of stacked arrays.
+    '''
+    y = np.zeros(x_sq.shape)
+    y[..., 1:] = np.maximum(x_sq[..., 1:], alpha * prev_sq[..., :-1] + (1 - alpha) * x_sq[..., 1:])
+    return y
+
+
+@numba.njit(cache=True)
+def _peak_follower_kernel(x, y, state, alpha_attack, alpha_release):
+    num_signals, num_samples = x.shape
+    for c in range(num_signals):
+        y_prev = state[c]
+        a_att = alpha_attack[c]
+        a_rel = alpha_release[c]
+        for n in range(num_samples):
+            x_n = x[c, n]
+            if x_n > y_prev:
+                y_prev = a_att * y_prev + (1 - a_att) * x_n
+            else:
+                y_prev = a_rel * y_prev + (1 - a_rel) * x_n
+            y[c, n] = y_prev
+        state[c] = y_prev
+
+
+def peak_follower(x, alpha_attack, alpha_release, state=None):
+    '''
+    Branching attack/release envelope follower. The choice of coefficient
+    depends on the previous output, so it runs as a compiled kernel rather
+    than lfilter. x is (samples,) or (signals x samples); state holds the
+    last output per signal and is updated in place for block processing.
+    The coefficients may be scalars or one value per signal.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    x_2d = np.ascontiguousarray(np.atleast_2d(x))
+    if state is None:
+        state = np.zeros(x_2d.shape[0])
+    alpha_attack = np.ascontiguousarray(np.broadcast_to(np.asarray(alpha_attack, dtype=np.float64), state.shape))
+    alpha_release = np.ascontiguousarray(np.broadcast_to(np.asarray(alpha_release, dtype=np.float64), state.shape))
+    y = np.empty(x_2d.shape)
+    _peak_follower_kernel(x_2d, y, state, alpha_attack, alpha_release)
+    return y[0] if x.ndim == 1 else y
@@ -0,0 +1,318 @@
+import functools
+import numba
+import numpy as np
+from scipy.signal import butter, get_window, sosfilt, sosfreqz
+
+
+def allpass_coefficient(fc, sr, G, f_type):
+    '''
+    Returns the allpass coefficient c used by the peak and shelving filters.
+    Peak filters take the bandwidth f_b as fc.
+    '''
+    V0 = 10**(G/20)
+    k = np.tan(np.pi * (fc / sr))
+    if f_type == "boost" or (f_type in ("lowshelf", "highshelf") and G >= 0):
+        return (k - 1) / (k + 1)
+    if f_type in ("cut", "lowshelf"):
+        return (k - V0) / (k + V0)
+    if f_type == "highshelf":
+        return (V0 * k - 1) / (V0 * k + 1)
+    raise ValueError(f"unknown filter type: {f_type}")
+
+
+def eq_band_sos(fc, sr, G, f_b, f_type="boost"):
+    '''
+    Converts one allpass-based EQ band into a second-order section.
+
+    Peak ("boost"/"cut") bands use the second-order allpass
+        A(z) = (-c + d(1-c)z^-1 + z^-2) / (1 + d(1-c)z^-1 - cz^-2)
+    with y = x + H0/2 * (x - A(x)). Shelving bands use the first-order allpass
+    A(z) = (c + z^-1) / (1 + cz^-1) with y = x + H0/2 * (x +/- A(x)).
+    '''
+    H0 = 10**(G/20) - 1
+    if f_type in ("boost", "cut"):
+        c = allpass_coefficient(f_b, sr, G, f_type)
+        d = -np.cos(2*np.pi * (fc/sr))
+        a = np.array([1, d * (1 - c), -c])
+        ap = np.array([-c, d * (1 - c), 1])
+        b = (1 + H0/2) * a - (H0/2) * ap
+    elif f_type in ("lowshelf", "highshelf"):
+        c = allpass_coefficient(fc, sr, G, f_type)
+        sign = 1 if f_type == "lowshelf" else -1
+        a = np.array([1, c, 0])
+        ap = np.array([c, 1, 0])
+        b = (1 + H0/2) * a + sign * (H0/2) * ap
+    else:
+        raise ValueError(f"unknown filter type: {f_type}")
+    return np.concatenate((b, a))
+
+
+def eq_bank_sos(bands, sr):
+    '''Stacks a list of (fc, G, f_b, f_type) bands into one SOS cascade'''
+    return np.array([eq_band_sos(fc, sr, G, f_b, f_type) for fc, G, f_b, f_type in bands]).reshape(-1, 6)
+
+
+def eq_filter_bank(x, bands, sr):
+    '''
+    Applies every (fc, G, f_b, f_type) band to x in a single cascaded pass.
+    x may be mono (samples,) or multichannel (channels x samples).
+    '''
+    if len(bands) == 0:
+        return np.array(x, dtype=np.float64)
+    return sosfilt(eq_bank_sos(bands, sr), x, axis=-1)
+
+
+@functools.lru_cache(maxsize=256)
+def _butter_sos(cutoff, sr, order, btype):
+    nyq = 0.5 * sr
+    normal_cutoff = np.array(cutoff) / nyq
+    sos = butter(order, normal_cutoff, btype=btype, output='sos')
+    sos.setflags(write=False)
+    return sos
+
+
+def butter_sos(cutoff, sr, order, btype='low'):
+    '''
+    Butterworth design as second-order sections, memoized on
+    (cutoff(s), sr, order, btype). The cached design is read-only; callers
+    get their own copy, since sosfilt needs a writable array.
+    '''
+    if np.ndim(cutoff) == 0:
+        cutoff = float(cutoff)
+    else:
+        cutoff = tuple(float(c) for c in cutoff)
+    return _butter_sos(cutoff, float(sr), int(order), btype).copy()
+
+
+def band_sos(hp_freq, lp_freq, sr, order, hp_order=None):
+    '''Chains a high-pass and a low-pass design into one cascade for a single band-pass pass'''
+    hp_order = order if hp_order is None else hp_order
+    return np.concatenate((butter_sos(hp_freq, sr, hp_order, 'highpass'),
+                           butter_sos(lp_freq, sr, order, 'lowpass')))
+
+
+def sos_filter(x, sos, axis=-1):
+    '''Applies an SOS cascade to a 1-D signal or along axis of stacked signals'''
+    return sosfilt(sos, x, axis=axis)
+
+
+@numba.njit(cache=True)
+def _sos_bank_kernel(x, sos_bank, y):
+    num_filters, num_sections = sos_bank.shape[0], sos_bank.shape[1]
+    num_channels, num_samples = x.shape
+    zi = np.zeros((num_filters, num_channels, num_sections, 2))
+    for n in range(num_samples):
+        for c in range(num_channels):
+            for k in range(num_filters):
+                v = x[c, n]
+                for s in range(num_sections):
+                    b0, b1, b2 = sos_bank[k, s, 0], sos_bank[k, s, 1], sos_bank[k, s, 2]
+                    a1, a2 = sos_bank[k, s, 4], sos_bank[k, s, 5]
+                    out = b0 * v + zi[k, c, s, 0]
+                    zi[k, c, s, 0] = b1 * v - a1 * out + zi[k, c, s, 1]
+                    zi[k, c, s, 1] = b2 * v - a2 * out
+                    v = out
+                y[k, c, n] = v
+
+
+def sos_bank_filter(x, sos_bank):
+    '''
+    Runs K SOS cascades of equal length, given as a (K x sections x 6) array,
+    over x in one pass through the samples. x is (samples,) or
+    (channels x samples); the result is (K x samples) or (K x channels x samples).
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    x_2d = np.ascontiguousarray(np.atleast_2d(x))
+    sos_bank = np.ascontiguousarray(sos_bank, dtype=np.float64)
+    sos_bank = sos_bank / sos_bank[:, :, 3:4]
+    y = np.empty((sos_bank.shape[0],) + x_2d.shape)
+    _sos_bank_kernel(x_2d, sos_bank, y)
+    return y[:, 0] if x.ndim == 1 else y
+
+
+def rbj_biquad(filter_type, fc, sr, G=0.0, Q=1/np.sqrt(2)):
+    '''
+    RBJ audio-EQ-cookbook biquad as a normalized second-order section.
+    filter_type is one of "peaking", "high_pass", "low_pass", "low_shelf"
+    or "high_shelf"; G is in dB and only used by peaking and shelf filters.
+    '''
+    A = 10**(G/40.0)
+    w0 = 2.0 * np.pi * (fc / sr)
+    cos_w0 = np.cos(w0)
+    alpha = np.sin(w0) / (2.0 * Q)
+    if filter_type == 'high_shelf':
+        b = A * np.array([(A+1) + (A-1)*cos_w0 + 2*np.sqrt(A)*alpha,
+                          -2 * ((A-1) + (A+1)*cos_w0),
+                          (A+1) + (A-1)*cos_w0 - 2*np.sqrt(A)*alpha])
+        a = np.array([(A+1) - (A-1)*cos_w0 + 2*np.sqrt(A)*alpha,
+                      2 * ((A-1) - (A+1)*cos_w0),
+                      (A+1) - (A-1)*cos_w0 - 2*np.sqrt(A)*alpha])
+    elif filter_type == 'low_shelf':
+        b = A * np.array([(A+1) - (A-1)*cos_w0 + 2*np.sqrt(A)*alpha,
+                          2 * ((A-1) - (A+1)*cos_w0),
+                          (A+1) - (A-1)*cos_w0 - 2*np.sqrt(A)*alpha])
+        a = np.array([(A+1) + (A-1)*cos_w0 + 2*np.sqrt(A)*alpha,
+                      -2 * ((A-1) + (A+1)*cos_w0),
+                      (A+1) + (A-1)*cos_w0 - 2*np.sqrt(A)*alpha])
+    elif filter_type == 'high_pass':
+        b = np.array([(1 + cos_w0)/2, -(1 + cos_w0), (1 + cos_w0)/2])
+        a = np.array([1 + alpha, -2*cos_w0, 1 - alpha])
+    elif filter_type == 'low_pass':
+        b = np.array([(1 - cos_w0)/2, 1 - cos_w0, (1 - cos_w0)/2])
+        a = np.array([1 + alpha, -2*cos_w0, 1 - alpha])
+    elif filter_type == 'peaking':
+        b = np.array([1 + alpha*A, -2*cos_w0, 1 - alpha*A])
+        a = np.array([1 + alpha/A, -2*cos_w0, 1 - alpha/A])
+    else:
+        raise ValueError(f"unknown filter type: {filter_type}")
+    return np.concatenate((b, a)) / a[0]
+
+
+def shelf_q(G, S):
+    '''Q equivalent of a shelf slope S (1 is the steepest without overshoot) for gain G in dB'''
+    A = 10**(G/40.0)
+    return 1.0 / np.sqrt((A + 1/A) * (1/S - 1) + 2)
+
+
+def biquad_eq_sos(eq_info, sr, Q):
+    '''
+    Converts EQSignal eq_info rows of [freq, gain, eq_type] into one SOS
+    cascade with the curves SoX uses for the same settings:
+        0: peaking cut of gain dB ("equalizer", width Q)
+        1: high-pass ("highpass", Q 0.707)
+        2: low-pass ("lowpass", Q 0.707)
+        3: low shelf of -gain dB ("bass", slope 0.5)
+        4: high shelf of gain dB ("treble", slope 0.5)
+    '''
+    sos = []
+    for freq, gain, eq_type in eq_info:
+        freq, gain, eq_type = float(freq), float(gain), int(eq_type)
+        if eq_type == 0:
+            sos.append(rbj_biquad('peaking', freq, sr, -gain, Q))
+        elif eq_type == 1:
+            sos.append(rbj_biquad('high_pass', freq, sr, 0.0, 0.707))
+        elif eq_type == 2:
+            sos.append(rbj_biquad('low_pass', freq, sr, 0.0, 0.707))
+        elif eq_type == 3:
+            sos.append(rbj_biquad('low_shelf', freq, sr, -gain, shelf_q(-gain, 0.5)))
+        elif eq_type == 4:
+            sos.append(rbj_biquad('high_shelf', freq, sr, gain, shelf_q(gain, 0.5)))
+        else:
+            raise ValueError(f"unknown eq type: {eq_type}")
+    return np.array(sos).reshape(-1, 6)
+
+
+def linkwitz_riley_bank(crossovers, sr):
+    '''
+    Fourth-order Linkwitz-Riley band split as a (bands x sections x 6) bank
+    for sos_bank_filter. Band k is high-passed at every lower crossover,
+    low-passed at its own, and allpassed at every higher one, so all bands
+    share the same phase and sum back to a flat magnitude.
+    '''
+    identity = np.array([1.0, 0.0, 0.0, 1.0, 0.0, 0.0])
+    num_bands = len(crossovers) + 1
+    bank = []
+    for k in range(num_bands):
+        sections = []
+        for j, fc in enumerate(crossovers):
+            if j < k:
+                sections.append(np.tile(butter_sos(fc, sr, 2, 'highpass'), (2, 1)))
+            elif j == k:
+                sections.append(np.tile(butter_sos(fc, sr, 2, 'lowpass'), (2, 1)))
+            else:
+                # LR4 low + high pass is the allpass over the Butterworth denominator
+                a = butter_sos(fc, sr, 2, 'lowpass')[0, 3:]
+                sections.append(np.array([[a[2], a[1], a[0], a[0], a[1], a[2]], identity]))
+        bank.append(np.concatenate(sections))
+    return np.array(bank)
+
+
+def linear_phase_fir(sos, sr, num_taps):
+    '''
+    Linear-phase FIR whose magnitude follows the SOS cascade. The whole
+    cascade becomes one response target, so the FIR length does not depend
+    on the number of sections. num_taps should be odd.
+    '''
+    n_design = 4 * int(2**np.ceil(np.log2(num_taps)))
+    _, h = sosfreqz(sos, worN=np.fft.rfftfreq(n_design, 1/sr), fs=sr)
+    impulse = np.fft.irfft(np.abs(h), n_design)
+    fir = np.roll(impulse, num_taps // 2)[:num_taps]
+    return fir * get_window('hann', num_taps, fftbins=False)
+
+
+def overlap_save(x, fir, block_size=2**15):
+    '''
+    FFT convolution of x (samples,) or (channels x samples) with a
+    linear-phase FIR, block by block with overlap-save. The FIR's delay is
+    removed so the output lines up with x. Memory stays bounded by
+    block_size, which must exceed the FIR length.
+    '''
+    x = np.asarray(x)
+    num_taps = fir.shape[0]
+    step = block_size - num_taps + 1
+    if step <= 0:
+        raise ValueError(f"block_size {block_size} must exceed the filter length {num_taps}")
+    delay = (num_taps - 1) // 2
+    num_samples = x.shape[-1]
+    H = np.fft.rfft(fir, block_size)
+    # num_taps - 1 samples of history before the signal, and delay samples after it
+    x_p = np.zeros(x.shape[:-1] + (num_taps - 1 + num_samples + delay,))
+    x_p[..., num_taps - 1:num_taps - 1 + num_samples] = x
+    y = np.empty(x.shape[:-1] + (num_samples + delay,))
+    for start in range(0, num_samples + delay, step):
+        block = x_p[..., start:start + block_size]
+        out = np.fft.irfft(np.fft.rfft(block, block_size) * H, block_size)[..., num_taps - 1:]
+        n = min(step, y.shape[-1] - start)
+        y[..., start:start + n] = out[..., :n]
+    return y[..., delay:]
+
+
+def partitioned_convolve(x, ir, block_size=4096):
+    '''
+    Uniformly partitioned overlap-save convolution of x with a long impulse
+    response, returning the first x.shape[-1] output samples. ir is split
+    into block_size partitions whose spectra are computed once; each input
+    block is transformed once and multiplied against a frequency-domain
+    delay line, so memory is bounded by the block size and partition count.
+    x and ir may each be 1-D or (channels x samples) and broadcast.
+    '''
+    x = np.asarray(x, dtype=np.float64)
+    ir = np.asarray(ir, dtype=np.float64)
+    B = block_size
+    num_parts = -(-ir.shape[-1] // B)
+    ir_p = np.zeros(ir.shape[:-1] + (num_parts * B,))
+    ir_p[..., :ir.shape[-1]] = ir
+    # (partitions, ..., bins) spectra of the zero-padded partitions
+    H = np.fft.rfft(np.moveaxis(ir_p.reshape(ir.shape[:-1] + (num_parts, B)), -2, 0), 2 * B)
+    num_samples = x.shape[-1]
+    out_shape = np.broadcast(np.empty(x.shape[:-1]), np.empty(ir.shape[:-1])).shape
+    fdl = np.zeros((num_parts,) + out_shape + (B + 1,), dtype=np.complex128)
+    prev = np.zeros(x.shape[:-1] + (B,))
+    y = np.empty(out_shape + (num_samples,))
+    for i, start in enumerate(range(0, num_samples, B)):
+        block = np.zeros(x.shape[:-1] + (B,))
+        n = min(B, num_samples - start)
+        block[..., :n] = x[..., start:start + n]
+        # circular delay line: slot j holds the block that is (pos - j) % num_parts blocks old,
+        # so it meets partition (pos - j) % num_parts, read through reversed views of H
+        pos = i % num_parts
+        fdl[pos] = np.fft.rfft(np.concatenate((prev, block), axis=-1))
+        acc = np.sum(fdl[:pos + 1] * H[pos::-1], axis=0)
+        if pos + 1 < num_parts:
+            acc += np.sum(fdl[pos + 1:] * H[:pos:-1], axis=0)
+        y[..., start:start + n] = np.fft.irfft(acc, 2 * B)[..., B:B + n]
+        prev = block
+    return y
+
+
+@functools.lru_cache(maxsize=16)
+def _k_weighting_sos(sr):
+    sos = np.array([rbj_biquad('high_shelf', 1500.0, sr, 4.0, 1/np.sqrt(2)),
+                    rbj_biquad('high_pass', 38.0, sr, 0.0, 0.5)])
+    sos.setflags(write=False)
+    return sos
+
+
+def k_weighting_sos(sr):
+    '''BS.1770 K-weighting (high shelf then high pass) as SOS, cached per sample rate and returned as a copy'''
+    return _k_weighting_sos(sr).copy()
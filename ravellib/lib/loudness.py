@@ -0,0 +1,117 @@
+import functools
+import numpy as np
+from scipy.signal import sosfilt
+from ravellib.lib.filters import k_weighting_sos
+
+
+class LoudnessMeter:
+    '''
+    ITU-R BS.1770 loudness meter that can be fed audio block by block.
+
+    Audio is K-weighted with filter state carried between blocks and reduced
+    to 100 ms mean-square energies as it arrives, so memory grows by a few
+    floats per second instead of holding the signal. Blocks are (samples,)
+    or (samples, channels), following pyloudnorm.
+    '''
+    # channel weights for L, R, C, Ls, Rs
+    channel_gains = np.array([1.0, 1.0, 1.0, 1.41, 1.41])
+
+    def __init__(self, rate, block_size=0.400):
+        self.rate = rate
+        self.block_size = block_size
+        self.step_size = int(round(0.1 * rate))
+        self.steps_per_block = int(round(block_size / 0.1))
+        self.sos = k_weighting_sos(rate)
+        self.reset()
+
+    def reset(self):
+        self.zi = None
+        self.partial_sum = 0.0
+        self.partial_count = 0
+        self.steps = []
+
+    def _energies(self, data, zi=None):
+        # K-weights data and returns its squared samples with the final filter state
+        if zi is None:
+            zi = np.zeros((self.sos.shape[0], 2) + data.shape[1:])
+        filtered, zf = sosfilt(self.sos, data, axis=0, zi=zi)
+        return filtered**2, zf
+
+    def feed(self, data):
+        '''Adds the next block of audio to the running measurement'''
+        data = np.asarray(data, dtype=np.float64)
+        data = data.reshape(data.shape[0], -1)
+        sq, self.zi = self._energies(data, self.zi)
+        n = sq.shape[0]
+        pos = 0
+        if self.partial_count:
+            take = min(self.step_size - self.partial_count, n)
+            self.partial_sum = self.partial_sum + sq[:take].sum(axis=0)
+            self.partial_count += take
+            pos = take
+            if self.partial_count == self.step_size:
+                self.steps.append((self.partial_sum / self.step_size)[np.newaxis])
+                self.partial_sum, self.partial_count = 0.0, 0
+        num_full = (n - pos) // self.step_size
+        if num_full:
+            full = sq[pos:pos + num_full*self.step_size].reshape(num_full, self.step_size, -1)
+            self.steps.append(full.mean(axis=1))
+            pos += num_full * self.step_size
+        if pos < n:
+            self.partial_sum = self.partial_sum + sq[pos:].sum(axis=0)
+            self.partial_count += n - pos
+        return self
+
+    def _step_energies(self):
+        if not self.steps:
+            return np.zeros((0, 1))
+        steps = np.concatenate(self.steps)
+        self.steps = [steps]
+        return steps
+
+    def _block_energies(self, steps, num_steps):
+        # mean-square energy of every num_steps-long window, moving 100 ms at a time
+        if steps.shape[0] < num_steps:
+            return np.zeros((0, steps.shape[1]))
+        c = np.concatenate((np.zeros((1, steps.shape[1])), np.cumsum(steps, axis=0)))
+        return (c[num_steps:] - c[:-num_steps]) / num_steps
+
+    def _loudness(self, z):
+        G = self.channel_gains[:z.shape[-1]]
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10.0 * np.log10(z @ G)
+
+    def integrated(self):
+        '''Gated integrated loudness (LUFS) of everything fed so far'''
+        z = self._block_energies(self._step_energies(), self.steps_per_block)
+        l = self._loudness(z)
+        # absolute gate at -70 LUFS, then relative gate 10 LU below the gated average
+        gated = l >= -70.0
+        if not gated.any():
+            return -np.inf
+        Gamma_r = self._loudness(z[gated].mean(axis=0)) - 10.0
+        gated = gated & (l > Gamma_r)
+        if not gated.any():
+            return -np.inf
+        return float(self._loudness(z[gated].mean(axis=0)))
+
+    def momentary(self):
+        '''Loudness (LUFS) of the most recent 400 ms'''
+        z = self._block_energies(self._step_energies()[-4:], 4)
+        return float(self._loudness(z[-1])) if z.shape[0] else -np.inf
+
+    def short_term(self):
+        '''Loudness (LUFS) of the most recent 3 s'''
+        z = self._block_energies(self._step_energies()[-30:], 30)
+        return float(self._loudness(z[-1])) if z.shape[0] else -np.inf
+
+    def integrated_loudness(self, data):
+        '''One-shot integrated loudness of data; leaves the streaming state alone'''
+        meter = LoudnessMeter(self.rate, self.block_size)
+        return meter.feed(data).integrated()
+
+
+@functools.lru_cache(maxsize=16)
+def loudness_meter(rate):
+    '''Shared meter per sample rate for one-shot integrated_loudness calls'''
+    return LoudnessMeter(rate)
@@ -1,103 +1,110 @@
 import os
 import math
+import functools
 import librosa
 import numpy as np
-import pyloudnorm as pyln
-import scipy
+from scipy import sparse
 from scipy.signal import butter, lfilter, freqz
 from scipy.fftpack import fft
 from scipy.stats import rankdata
+from ravellib.lib.dynamics import NoiseGate
+from ravellib.lib.envelope import forget_factor, lagged_peak, peak_mask
+from ravellib.lib.filters import band_sos, butter_sos, eq_filter_bank, sos_bank_filter, sos_filter
+from ravellib.lib.loudness import loudness_meter
+from ravellib.lib.spectrum import spectrum_cache
 
 
 def apply_bfilter(signal, cutoff, sr, order, btype):
-    b, a = butter_filter(cutoff, sr, order, btype)
-    y = lfilter(b, a, signal)
-    return y
+    return sos_filter(signal, butter_sos(cutoff, sr, order, btype))
     
 def attack(attack_max, crest_factor_n2):
     return (2*attack_max) / crest_factor_n2
 
 def audio_sparsity(r_y, min_y):
-    sparse_vec = np.zeros((1, r_y.shape[1]))
-    for i in range(r_y.shape[1]):
-        mu = np.mean(r_y.T[i])
-        if mu == min_y:
-            sparse_vec[0, i] = 0
-        else:
-            sparse_vec[0, i] = 1
-    return sparse_vec
+    '''Boolean (1 x chunks) vector, False where every bin of a chunk has rank min_y'''
+    return np.any(r_y != min_y, axis=0, keepdims=True)
+
+def band_levels(fft, freqs, crossovers, n_fft):
+    '''
+    Per-band (peak_db, rms_db) from a Hann-windowed magnitude STFT, with
+    bands split at the crossover frequencies. Peaks follow the broadband
+    definition (summed magnitudes per frame), and the frame RMS comes from
+    the band's share of the spectral energy, so no band signals are needed.
+    '''
+    edges = np.concatenate(([-np.inf], crossovers, [np.inf]))
+    band_of_bin = np.searchsorted(edges, freqs, side='right') - 1
+    band_mat = bark_matrix([np.flatnonzero(band_of_bin == k) for k in range(len(edges) - 1)], fft.shape[0])
+    peak_db = librosa.amplitude_to_db(band_mat @ fft).max(axis=1)
+    # one-sided Parseval with the Hann window energy 3N/8
+    rms = np.sqrt(2 * (band_mat @ fft**2) / (n_fft * (3 * n_fft / 8)))
+    rms_db = np.mean(librosa.amplitude_to_db(rms), axis=1)
+    return peak_db, rms_db
+
+def bark_matrix(bark_idx, num_bins):
+    '''Sparse (bands x bins) 0/1 matrix from the per-band bin indices of freq_bark_map'''
+    rows = np.concatenate([np.full(np.size(idx), band) for band, idx in enumerate(bark_idx)])
+    cols = np.concatenate([np.ravel(idx) for idx in bark_idx])
+    data = np.ones(rows.shape[0])
+    return sparse.csr_matrix((data, (rows, cols)), shape=(len(bark_idx), num_bins))
 
 def butter_filter(cutoff, sr, order, btype):
-    nyq = 0.5 * sr
-    normal_cutoff = cutoff / nyq
-    b, a = butter(order, normal_cutoff, btype=btype, analog=False)
+    b, a = butter(order, np.array(cutoff) / (0.5 * sr), btype=btype, analog=False)
     return b, a
 
 def butter_bandpass(lowcut, highcut, fs, order):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band', analog=False)
-    return b, a
+    return butter_filter([lowcut, highcut], fs, order, 'band')
 
 def calc_f_osc(x_d, b, a): return lfilter([1+b[0], b[1], b[2]], a, x_d)
 
 def calc_f0(x_d, b, a): return lfilter(b, a, x_d) * 2
 
-def cf_avg(signals):
-    sum = 0
-    for sig in signals:
-        cfs = cf(sig)
-        sum += cfs
-    return sum / len(signals)
+def cf(signal, time_constant, sr):
+    '''Average crest factor of a signal from its peak and RMS envelopes'''
+    peaks = peak(signal, time_constant, sr)
+    rms = rms_squared(signal, time_constant, sr)
+    n = min(peaks.shape[-1], rms.shape[-1])
+    return np.mean(crest_factor(peaks[..., :n], rms[..., :n]), axis=-1)
+
+def cf_avg(signals, time_constant, sr):
+    return np.mean([cf(sig, time_constant, sr) for sig in signals])
 
 def compression_parameters(path, files, time_constant, order, cutoff, sr, std, attack_max, release_max):
     compress_info = []
-    signal_paths = [os.path.join(path, files[i]) for i in range(len(files))]
-    signals = []
-    for sig in signal_paths:
-        y, _ = librosa.load(sig, sr=sr)
-        signals.append(y)
-    cfa = cf_avg(signals)
+    signal_paths = signal_sources(path, files)
+    signals = [spectrum_cache.load(sig, sr) for sig in signal_paths]
+    cfs = [cf(signal, time_constant, sr) for signal in signals]
+    cfa = np.mean(cfs)
     lfa = lf_avg(signals, order, cutoff, sr)
     for i, signal in enumerate(signals):
-        w_p, cf = wp(signal, cfa, std)
+        w_p = wp(cfs[i], cfa, std)
         w_f = lf_weighting(signal, lfa, order, cutoff, sr)
-        rms = librosa.feature.rms(signal, frame_length=1024, hop_length=512)
+        rms = librosa.feature.rms(y=signal, frame_length=1024, hop_length=512)
         rms_db = np.mean(librosa.amplitude_to_db(rms))
         r = float(ratio(w_f, w_p))
         t = float(threshold(rms_db, w_p))
         kw = float(knee_width(t))
-        a = float(attack(attack_max, cf**2))
-        rel = float(release(release_max, cf**2))
-        compress_info.append({signal_paths[i]:[t, r, a, rel, kw]})
+        a = float(attack(attack_max, cfs[i]**2))
+        rel = float(release(release_max, cfs[i]**2))
+        compress_info.append({source_name(signal_paths[i], i):[t, r, a, rel, kw]})
     return compress_info
 
 def compute_a0(f): return 6.5 * np.exp((-0.6*((f/1000)-3.3))**2) - 10**-3 * (f/1000)**4
 
 def compute_chunk(norm_fft_db, window_size, sr, seconds):
+    '''
+    Averages a (bins x frames) spectrogram over chunks of `seconds` length,
+    where window_size is the frame step in samples. The last chunk holds
+    whatever frames remain.
+    '''
     fft_length = norm_fft_db.shape[1]
-    num_freqs = norm_fft_db.shape[0]
     chunk_size = int(np.ceil((1 / (window_size / sr)) * seconds))
-    total_chunks = int(np.ceil(fft_length / chunk_size))
-    avg_mat = np.zeros((num_freqs, total_chunks))
-    avg_vec = np.zeros((1, chunk_size))
-    for i in range(num_freqs):
-        for j in range(total_chunks):
-            if j > total_chunks - 1:
-                avg_vec = norm_fft_db[i][chunk_size * j:]
-                mu = np.mean(avg_vec)
-                avg_mat[i][j] = mu
-            avg_vec = norm_fft_db[i][chunk_size * j: chunk_size * (j+1)]
-            mu = np.mean(avg_vec)
-            avg_mat[i][j] = mu
-    return avg_mat
+    starts = np.arange(0, fft_length, chunk_size)
+    counts = np.diff(np.append(starts, fft_length))
+    return np.add.reduceat(norm_fft_db, starts, axis=1) / counts
 
 def compute_effect_signal(y, effect_percent, hp_freq, lp_freq, order, sr):
     effect_signal = y * effect_percent
-    y_hp = apply_bfilter(effect_signal, hp_freq, sr, order, 'highpass')
-    y_out = apply_bfilter(y_hp, lp_freq, sr, order, 'lowpass')
-    return y_out
+    return sos_filter(effect_signal, band_sos(hp_freq, lp_freq, sr, order))
 
 def compute_gz(z): return np.where(z < 14, 1, 0.00012*z**4 - 0.0056*z**3 + 0.1*z**2 - 0.81*z + 3.51)
 
@@ -108,9 +115,14 @@ def compute_lfe(signal, order, cutoff, sr):
     lfe = np.sum(np.divide(x_low, x, out=np.zeros_like(x_low), where=x!=0))
     return lfe
 
-def compute_makeup_gain(x_in, x_out, rate):
-    meter = pyln.Meter(rate)
-    loudness_in = meter.integrated_loudness(x_in)
+def compute_makeup_gain(x_in, x_out, rate, loudness_in=None):
+    '''
+    Loudness difference in dB between input and output. Pass loudness_in when
+    the input has already been measured to skip metering it again.
+    '''
+    meter = loudness_meter(rate)
+    if loudness_in is None:
+        loudness_in = meter.integrated_loudness(x_in)
     loudness_out = meter.integrated_loudness(x_out)
     return loudness_in - loudness_out
 
@@ -120,30 +132,14 @@ def compute_norm_fft_db(x_norm, n_fft, window_size, hop_length):
     norm_fft_db = librosa.amplitude_to_db(norm_fft)
     return norm_fft_db
 
-def compute_Nz(critical_band_fft):
-    num = critical_band_fft.shape[0]
-    N = np.zeros(critical_band_fft.shape)
-    for z in range(num):
-        a0_z = compute_a0(critical_band_fft[z][:])
-        N[z] = a0_z * critical_band_fft[z][:]
-    return N
+def compute_Nz(critical_band_fft): return compute_a0(critical_band_fft) * critical_band_fft
 
 def compute_rank(chunk_fft_db): 
-    a = np.zeros(chunk_fft_db.shape)
-    for row in range(chunk_fft_db.shape[1]):
-        a[:, row] = np.abs(rankdata(chunk_fft_db[:, row], method='min') - (chunk_fft_db.shape[0])) + 1
-    return a
+    return rank_signal_2d(chunk_fft_db)
 
 def compute_sparsity(rank, num_bins):
-    sparse_vec = np.zeros((1, rank.shape[1]))
-    min_val = num_bins
-    for i in range(rank.shape[1]):
-        mu = np.mean(rank.T[i])
-        if mu == min_val:
-            sparse_vec[0, i] = 0
-        else:
-            sparse_vec[0, i] = 1
-    return sparse_vec
+    '''Boolean (1 x chunks) vector, False for silent chunks where every bin ties at rank num_bins'''
+    return np.any(rank != num_bins, axis=0, keepdims=True)
 
 def crest_attack_release(attack_max, release_max, crest_factor_sq):
     attack = (2 * attack_max) / crest_factor_sq
@@ -152,44 +148,49 @@ def crest_attack_release(attack_max, release_max, crest_factor_sq):
 
 def crest_factor(peaks, rms): 
     crest_factor = np.zeros(rms.shape)
-    crest_factor[0] = 0
-    crest_factor[1:] = peaks[1:] / rms[1:]
+    np.divide(peaks[..., 1:], rms[..., 1:], out=crest_factor[..., 1:], where=rms[..., 1:] != 0)
     return np.sqrt(crest_factor)
 
+@functools.lru_cache(maxsize=32)
+def critical_band_matrix(sr, n_fft, critical_bands):
+    '''
+    Sparse (bands x bins) aggregation matrix for an n_fft STFT at sr, using the
+    same bin frequencies as Signal.freqs. Cached per (sr, n_fft, critical_bands),
+    so critical_bands must be a tuple.
+    '''
+    num_bins = 1 + n_fft // 2
+    freqs = np.arange(num_bins) * sr / num_bins
+    return bark_matrix(freq_bark_map(freqs, critical_bands), num_bins)
+
 def critical_band_sum(bark_mat, bark_idx, N):
-    M = bark_mat.shape[1]
-    c_band_sum = np.zeros((N, M))
-    for n in range(N):
-        if bark_mat[n].size != 0:
-            c_band_sum[n] = np.sum(bark_mat[bark_idx[n]], axis=0)[:M]
-        else:
-            c_band_sum[n] = 0
-    return c_band_sum
+    '''Sums the rows of bark_mat (bins x frames) belonging to each of the N critical bands'''
+    return bark_matrix(bark_idx[:N], bark_mat.shape[0]) @ bark_mat
+
+def cross_mask(fft_avgs, masker_vecs, maskee_vecs):
+    '''
+    Masking of every signal by every other from stacked (signals x bins)
+    averaged spectra and rank vectors. Entry [i, j, b] is how much signal i
+    masks signal j in bin b. Self-masking on the diagonal is set to -inf.
+    '''
+    mask = (masker_vecs[:, np.newaxis] * maskee_vecs[np.newaxis]) * (fft_avgs[:, np.newaxis] - fft_avgs[np.newaxis])
+    n = mask.shape[0]
+    if n > 1:
+        mask[np.arange(n), np.arange(n)] = -np.inf
+    return mask
 
 def ema(x, y, decay): return ((1-decay)*x) + (decay*y)
 
-def eq_filter(x, fc, sr, G, f_b, f_type="boost"):
-    d = -np.cos(2*np.pi * (fc/sr))
-    V0 = 10**(G/20)
-    H0 = V0 - 1
-    c_boost = (np.tan(np.pi * (f_b / sr)) - 1) / np.tan(np.pi*(f_b/sr) + 1)
-    c_cut = (np.tan(np.pi*(f_b/sr)) - V0) / (np.tan(np.pi*(f_b/sr)) + V0)
-    x_h = np.zeros(x.shape[0])
-    y1 = np.zeros(x.shape[0])
-    y = np.zeros(x.shape[0])
-    if f_type == "boost":
-        c = c_boost
-    elif f_type == "cut":
-        c = c_cut
-    for n in range(x_h.shape[0]):
-        if n < 2:
-            x_h[n] = x[n]
-            y1[n] = -c * x_h[n]
-        else:
-            x_h[n] = x[n] - d * (1 - c) * x_h[n-1] + c * x_h[n-2]
-            y1[n] = -c * x_h[n] + d * (1 - c) * x_h[n-1] + x_h[n-2]
-        y[n] = (H0 / 2) * (x[n] - y1[n]) + x[n]
-    return y
+def eq_filter(x, fc, sr, G=None, f_b=None, f_type="boost"):
+    '''
+    Applies an allpass-based peak ("boost"/"cut") or shelving ("lowshelf"/
+    "highshelf") filter. Pass a list of (fc, G, f_b, f_type) tuples as fc to
+    apply a whole cascade in one call; x may be mono or (channels x samples).
+    '''
+    if np.ndim(fc) == 0:
+        bands = [(fc, G, f_b, f_type)]
+    else:
+        bands = fc
+    return eq_filter_bank(x, bands, sr)
 
 def export_params(path, files, rank_threshold, window_size, hop_length, sr, max_n):
     '''
@@ -197,36 +198,38 @@ def export_params(path, files, rank_threshold, window_size, hop_length, sr, max_
     sample rate, and the number of top mask values and returns a list of
     parameters in dictionary form. Each list element contains a file path
     and the top mask values according to the mask function.
+
+    files may also hold pre-loaded arrays, which are keyed by their index.
+    Every signal is decoded and transformed once for the whole batch.
     '''
 
     params_list = []
-    for idx in range(len(files)):
-        masker_path = os.path.join(path, files[idx])
-        maskee_path = [os.path.join(path, files[i]) for i in range(len(files)) if i != idx]
-        mask_array = mask(masker_path, maskee_path, rank_threshold, window_size, hop_length,  sr, max_n)
-        masker_dic = {masker_path: mask_array}
+    signals = signal_sources(path, files)
+    ffts = [fft_avg(signal, window_size, hop_length, sr) for signal in signals]
+    for idx in range(len(signals)):
+        maskee_ffts = [ffts[i] for i in range(len(signals)) if i != idx]
+        mask_array = mask_spectra(ffts[idx], maskee_ffts, rank_threshold, sr, max_n)
+        masker_dic = {source_name(signals[idx], idx): mask_array}
         params_list.append(masker_dic)
     return params_list
 
 def fft_2d(audio_signal, window_size, hop_length, sr):
 	'''
-	This function takes the path to an audio signal and the accompanying
-	sample rate and returns the magnitude (decibels) and time of the 
-	signal in a 2d numpy array.
+	This function takes the path to an audio signal (or a loaded array) and
+	the accompanying sample rate and returns the magnitude (decibels) and time
+	of the signal in a 2d numpy array.
 
 	After loading the audio signal, the function uses a short-time
 	fourier transform on non-overlapping windows of size 1024. We
 	then transform the frequency from amplitude to decibel scale.
+	The result is shared through spectrum_cache and is read-only.
 	'''	
-	y, sr = librosa.load(audio_signal, sr=sr)
-	D = np.abs(librosa.core.stft(y, n_fft=window_size, hop_length=hop_length))
-	D_db = librosa.amplitude_to_db(D)
-	return D_db
+	return spectrum_cache.stft_db(audio_signal, window_size, hop_length, sr)
 
 def fft_avg(audio_signal, window_size, hop_length, sr):
 	'''
-	This function takes the path to an audio signal and the accompanying
-	sample rate and returns the spectrum of the signal.
+	This function takes the path to an audio signal (or a loaded array) and
+	the accompanying sample rate and returns the spectrum of the signal.
 
 	After loading the audio signal, the function uses a short-time
 	fourier transform on non-overlapping windows of size 1024. We
@@ -235,22 +238,47 @@ def fft_avg(audio_signal, window_size, hop_length, sr):
 	Lastly, we create the average magnitude over the entire length of 
 	the audio signal.
 	'''
-	y, sr = librosa.load(audio_signal, sr=sr)
-	D = np.abs(librosa.core.stft(y, n_fft=window_size, hop_length=hop_length))
-	D_db = librosa.amplitude_to_db(D)
+	D_db = spectrum_cache.stft_db(audio_signal, window_size, hop_length, sr)
 	return np.mean(D_db, axis=1)
 
 def file_scraper(path): return [f for f in os.listdir(path) if not f.startswith('.') and os.path.isfile(os.path.join(path, f))]
 
+def filter_bank_peaks(signal, cutoffs, sr, order, btype, window_step):
+    '''
+    Filters signal with every cutoff in one filter-bank pass and returns the
+    (cutoffs x windows) maxima over consecutive window_step-long windows.
+    '''
+    sos_bank = np.array([butter_sos(cutoff, sr, order, btype) for cutoff in cutoffs])
+    y = sos_bank_filter(signal, sos_bank)
+    num_steps = int(signal.shape[0] / window_step)
+    return y[:, :num_steps*window_step].reshape(len(cutoffs), num_steps, window_step).max(axis=2)
+
 def full_file_scraper(path): 
     files = [os.path.join(path, f) for f in os.listdir(path) if not f.startswith('.') and os.path.isfile(os.path.join(path, f))]
     return files
 
-def forget_factor(time_constant, sr): 
+def frame_loudness(x, decay, hop_length, segment_length):
     '''
-    Alpha signifies the forget factor for parameter autonomation equations
+    Frame-rate version of loudness(), with one value per hop_length samples.
+    The running mean energy and its EMA restart every segment_length frames,
+    i.e. every segment_length * hop_length samples, matching loudness()
+    applied to consecutive segments of that length. decay is the
+    per-sample EMA coefficient and is converted to the frame rate.
     '''
-    return np.exp(-1 / (time_constant * sr))
+    num_samples = x.shape[0]
+    num_frames = int(np.ceil(num_samples / hop_length))
+    num_segments = int(np.ceil(num_frames / segment_length))
+    starts = np.arange(0, num_samples, hop_length)
+    frame_energy = np.zeros(num_segments * segment_length)
+    frame_energy[:num_frames] = np.add.reduceat(np.abs(x)**2, starts)
+    frame_count = np.ones(num_segments * segment_length)
+    frame_count[:num_frames] = np.diff(np.append(starts, num_samples))
+    energy = (np.cumsum(frame_energy.reshape(num_segments, segment_length), axis=1)
+              / np.cumsum(frame_count.reshape(num_segments, segment_length), axis=1))
+    decay_frame = decay ** hop_length
+    ema_y = lfilter([1-decay_frame], [1, -decay_frame], energy, axis=1)
+    L_m = 0.691 * (10 * np.log10(ema_y+1e-14))
+    return L_m.ravel()[:num_frames]
 
 def freq_bin(signal, n, sr): return n * (sr / signal.shape[0])
 
@@ -280,18 +308,12 @@ def h_lp(fc, sr, Q):
     b_2 = k**2 * k_1
     return np.array([b_0, b_1, b_2]), np.array([a_0, a_1, a_2])
 
+def knee_width(threshold): return abs(threshold) / 2
+
 def lf_avg(signals, order, cutoff, sr):
-    sum = 0  
-    for sig in signals:
-        x_low = low_pass(sig, order, cutoff, sr)
-        fft_xlow = np.abs(librosa.core.stft(x_low, n_fft=1024, hop_length=512))
-#         print(fft_xlow)
-        fft_x = np.abs(librosa.core.stft(sig, n_fft=1024, hop_length=512))
-#         print(fft_x)
-        total = np.sum(np.divide(fft_xlow, fft_x, out=np.zeros_like(fft_xlow), where=fft_x!=0))
-#         total = np.sum(fft_xlow / fft_x)
-        sum += total
-    return sum / 4
+    return np.mean([compute_lfe(sig, order, cutoff, sr) for sig in signals])
+
+def lf_weighting(signal, lfa, order, cutoff, sr): return compute_lfe(signal, order, cutoff, sr) / lfa
 
 # def loudness(x, decay):
 #     N = x.shape[0]
@@ -319,16 +341,12 @@ def loudness(x, decay):
     cum_sum = np.cumsum(np.abs(x)**2)
     count = np.arange(1, x.shape[0]+1)
     energy = cum_sum / count
-    ema_y = lfilter([1-decay], [1, decay], energy)
+    ema_y = lfilter([1-decay], [1, -decay], energy)
     L_m = 0.691 * (10 * np.log10(ema_y+1e-14))
     return L_m
 
 def low_pass(signal, order, cutoff, sr):
-    nyq = sr * 0.5
-    normal_cutoff = cutoff / nyq
-    b,a = scipy.signal.butter(order, normal_cutoff)
-    y = scipy.signal.lfilter(b, a, signal)
-    return y
+    return sos_filter(signal, butter_sos(cutoff, sr, order, 'low'))
 
 def mask(signal_a, signals, rank_threshold, window_size, hop_length, sr, max_n):
     '''
@@ -343,36 +361,11 @@ def mask(signal_a, signals, rank_threshold, window_size, hop_length, sr, max_n):
     returns their signal index, frequency bin,
     and the value of the masking function.
     ''' 
-    mask = np.array([])
-    mask_info = []
     masker_fft = fft_avg(signal_a, window_size, hop_length, sr)
     maskee_ffts = [fft_avg(signal, window_size, hop_length, sr) for signal in signals]
-    masker_rank = rank_signal_1d(masker_fft)
-    maskee_ranks = [rank_signal_1d(maskee_fft) for maskee_fft in maskee_ffts]
-    # creates boolean matrices that return 1 or 0 based on the rank threshold
-    masker_rank_mat = np.where(masker_rank > rank_threshold, 1, 0)
-    num_bins = masker_fft.shape[0]
-    for i in range(len(signals)):
-        maskee_fft = maskee_ffts[i]
-        maskee_rank = maskee_ranks[i]
-        maskee_rank_mat = np.where(maskee_rank <= 10, 1, 0)
-        # uses elementwise multiplication between the boolean matrices and frequency
-        # signals to calculate the spectral masking for all values that meet the rank
-        # threshold conditions
-        mask_ab = (masker_rank_mat * maskee_rank_mat) * (masker_fft - maskee_fft)
-        mask = np.append(mask, mask_ab)
-    # saves max_n mask values from the mask matrix and uses the indices to add the
-    # frequency and mask value to a mask info array    
-    top_m = np.argsort(mask)[-max_n:]
-    idx = np.unravel_index(top_m, mask.shape)[0]
-    for i in idx:
-        freq_bin = (i % num_bins) * (sr / num_bins)
-        mask_val = mask[i]
-        if (mask_val) > 0 and (freq_bin <= 20000) and (freq_bin >= 20):
-            mask_info.append([freq_bin, mask_val])
-    return np.array(mask_info)
+    return mask_spectra(masker_fft, maskee_ffts, rank_threshold, sr, max_n)
 
-def mask_2d(signals, rank_threshold, window_size, hop_length, sr, top_n):
+def mask_2d(signals, rank_threshold, window_size, hop_length, sr, top_n, max_block_bytes=2**28):
     '''
     This function returns a list of parameters that can be used during
     the equalization process using time and frequency opposed to an
@@ -385,131 +378,205 @@ def mask_2d(signals, rank_threshold, window_size, hop_length, sr, top_n):
     For the top x occurences of masking within a frequency, the function 
     returns their signal index, frequency bin,
     and the value of the masking function.
+
+    All spectrograms are ranked together, and each masker is compared against
+    every other signal at once. Maskers are processed in blocks sized so
+    that the (maskers x maskees x bins x frames) temporaries of a block,
+    including the gathered maskee spectra and the argpartition indices, stay
+    under max_block_bytes.
     '''
     n = len(signals)
-    fft_signals = [fft_2d(signal, window_size, hop_length, sr) for signal in signals]
-    rank_signals = [rank_signal_2d(fft_signal) for fft_signal in fft_signals]
+    fft_signals = stack_spectrograms([fft_2d(signal, window_size, hop_length, sr) for signal in signals])
+    rank_signals = rank_signal_2d(fft_signals)
+    # creates boolean matrices based on the rank threshold
+    r_a = rank_signals > rank_threshold
+    r_b = rank_signals <= rank_threshold
+    num_bins, num_frames = fft_signals.shape[1], fft_signals.shape[2]
+    k = min(top_n, num_bins * num_frames)
+    # maskee order for masker i matches the original (i + j + 1) % n pairing
+    maskees = (np.arange(n)[:, np.newaxis] + np.arange(1, n)[np.newaxis, :]) % n
+    # peak bytes per block element: the gathered maskee spectrum and the masking
+    # values, or the masking values and their int64 argpartition indices
+    element_bytes = fft_signals.itemsize + max(fft_signals.itemsize, np.dtype(np.intp).itemsize)
+    block_size = max(1, int(max_block_bytes // max(1, (n - 1) * num_bins * num_frames * element_bytes)))
     mask_info = []
-    for i in range(n):
-        for j in range(n-1):
-            sig_a = fft_signals[i]
-            sig_b = fft_signals[(i + j + 1) % n]
-            rank_a = rank_signals[i]
-            rank_b = rank_signals[(i+j+1) % n]
-            # creates boolean matrices that return 1 or 0 based on the rank threshold
-            r_a = np.where(rank_a > rank_threshold, 1, 0)
-            r_b = np.where(rank_b <= rank_threshold, 1, 0)
-            # uses elementwise multiplication between the boolean matrices and frequency
-            # signals to calculate the spectral masking for all values that meet the rank
-            # threshold conditions
-            v = (r_a*r_b)*(sig_a - sig_b)
-            # flattens matrix to find the top_n values and appends the signal
-            # index, freq_bin, and mask value to the mask_info list
-            v_1d = v.flatten()
-            idx_1d = v_1d.argsort()[-top_n:]
-            x_idx, y_idx = np.unravel_index(idx_1d, v.shape)
-            for x, y, in zip(x_idx, y_idx):
-                freq_bin = x * (sr / v.shape[0])
-                mask_ab = v[x][y]
-                mask_info.append([i, freq_bin, mask_ab])
+    for start in range(0, n, block_size):
+        idx = np.arange(start, min(start + block_size, n))
+        j_idx = maskees[idx]
+        # uses elementwise multiplication between the boolean matrices and frequency
+        # signals to calculate the spectral masking for all values that meet the rank
+        # threshold conditions
+        v = fft_signals[idx][:, np.newaxis] - fft_signals[j_idx]
+        v *= r_a[idx][:, np.newaxis] & r_b[j_idx]
+        v = v.reshape(len(idx), n - 1, -1)
+        # selects the top_n values of every masker/maskee pair without a full sort
+        top = np.argpartition(v, -k, axis=-1)[..., -k:]
+        top_vals = np.take_along_axis(v, top, axis=-1)
+        order = np.argsort(top_vals, axis=-1)
+        top = np.take_along_axis(top, order, axis=-1)
+        top_vals = np.take_along_axis(top_vals, order, axis=-1)
+        freq_bins = (top // num_frames) * (sr / num_bins)
+        masker_idx = np.broadcast_to(idx[:, np.newaxis, np.newaxis], top.shape)
+        mask_info.extend([[int(i), freq_bin, mask_ab] for i, freq_bin, mask_ab in
+                          zip(masker_idx.ravel(), freq_bins.ravel().tolist(), top_vals.ravel().tolist())])
     return mask_info
 
-def maskee_rank_vec(r_soa_vec): return np.expand_dims(np.where(r_soa_vec <= 10, 1, 0), axis=1)
+def mask_spectra(masker_fft, maskee_ffts, rank_threshold, sr, max_n):
+    '''
+    Computes the mask() parameters from already averaged spectra, so callers
+    that compare many signals only transform each one once.
+    '''
+    mask_info = []
+    maskee_ffts = np.array(maskee_ffts)
+    masker_rank = rank_signal_1d(masker_fft)
+    maskee_ranks = np.array([rank_signal_1d(maskee_fft) for maskee_fft in maskee_ffts])
+    # creates boolean matrices that return 1 or 0 based on the rank threshold
+    masker_rank_mat = np.where(masker_rank > rank_threshold, 1, 0)
+    maskee_rank_mat = np.where(maskee_ranks <= 10, 1, 0)
+    num_bins = masker_fft.shape[0]
+    # uses elementwise multiplication between the boolean matrices and frequency
+    # signals to calculate the spectral masking for all values that meet the rank
+    # threshold conditions
+    mask = ((masker_rank_mat * maskee_rank_mat) * (masker_fft - maskee_ffts)).flatten()
+    # saves max_n mask values from the mask matrix and uses the indices to add the
+    # frequency and mask value to a mask info array    
+    top_m = np.argsort(mask)[-max_n:]
+    idx = np.unravel_index(top_m, mask.shape)[0]
+    for i in idx:
+        freq_bin = (i % num_bins) * (sr / num_bins)
+        mask_val = mask[i]
+        if (mask_val) > 0 and (freq_bin <= 20000) and (freq_bin >= 20):
+            mask_info.append([freq_bin, mask_val])
+    return np.array(mask_info)
+
+def maskee_rank_vec(r_soa_vec, rank_threshold=10): return np.expand_dims(r_soa_vec <= rank_threshold, axis=1)
 
-def masker_rank_vec(r_soa_vec): return np.expand_dims(np.where(r_soa_vec > 10, 1, 0), axis=1)
+def masker_rank_vec(r_soa_vec, rank_threshold=10): return np.expand_dims(r_soa_vec > rank_threshold, axis=1)
 
 def noise_gate(x, holdtime, ltrhold, utrhold, release, attack, fs):
-    rel = round(release * fs)
-    att = round(attack * fs)
-    g = np.zeros(x.shape)
-    lthcnt = 0
-    uthcnt = 0
-    ht = round(holdtime * fs)
-    for n in range(len(x)):
-        if (x[n] <= ltrhold) or ((x[n] < utrhold) and (lthcnt>0)):
-            lthcnt+=1
-            uthcnt = 0
-            if lthcnt > ht:
-                if lthcnt > (rel + ht):
-                    g[n] = 0
-                else:
-                    g[n] = 1 - ((lthcnt - ht) / rel)
-            elif ((n < ht) and (lthcnt==n)):
-                g[n] = 0;
-            else:
-                g[n] = 1;
-        elif (x[n] >= utrhold) or ((x[n] > ltrhold) and (uthcnt > 0)):
-            uthcnt+=1
-            if (g[n-1] < 1):
-                g[n] = np.maximum(uthcnt / att, g[n-1])
-            else:
-                g[n] = 1
-            lthcnt = 0
-        else:
-            g[n] = g[n-1]
-            lthcnt = 0
-            uthcnt = 0
-    return g
+    '''
+    Computes the gate gain curve for a 1-D signal or a (channels x samples)
+    array. See dynamics.NoiseGate for block-wise/streaming use.
+    '''
+    gate = NoiseGate(holdtime, ltrhold, utrhold, release, attack, fs, np.atleast_2d(x).shape[0])
+    return gate.process(x)
 
 def normalize(x, peak):
-    current_peak = np.max(np.abs(x))
-    gain = np.power(10.0, peak/20.0) / current_peak
+    gain = normalize_gain(x, peak)
     output = gain * x
     return output
 
+def normalize_gain(x, peak):
+    '''Linear gain that brings the peak of x to peak dB'''
+    current_peak = np.max(np.abs(x))
+    return np.power(10.0, peak/20.0) / current_peak
+
+def octave_bands(low, high, sr, max_ratio=0.45):
+    '''
+    Octave (lower, upper) band edges from low up to high. Upper edges are
+    capped at max_ratio * sr and bands starting above the cap are dropped,
+    so every band can be designed below Nyquist.
+    '''
+    cap = max_ratio * sr
+    bands = []
+    lower = low
+    while lower < min(high, cap):
+        bands.append((lower, min(2 * lower, high, cap)))
+        lower = 2 * lower
+    return bands
+
+def oscillator_phase(f_osc, sr):
+    '''Integrates an instantaneous frequency curve (Hz) into oscillator phase'''
+    return 2*np.pi * np.cumsum(f_osc) / sr
+
 def overlap(sv0, sv1):
-    overlap_vec = sv0 * sv1
+    '''
+    Chunks where both sparsity vectors are active. Signals of different
+    lengths have different chunk counts; the chunks past the end of the
+    shorter one count as inactive.
+    '''
+    num_chunks = max(sv0.shape[1], sv1.shape[1])
+    overlap_vec = np.logical_and(pad_chunks(sv0, num_chunks), pad_chunks(sv1, num_chunks))
     num_overlaps = np.sum(overlap_vec)
     overlap_ratio = num_overlaps / overlap_vec.shape[1]
     return overlap_vec, num_overlaps, overlap_ratio
 
 def peak(audio_signal, time_constant, sr):
-    onset_env = librosa.onset.onset_strength(y=audio_signal, sr=sr, n_fft=1024, hop_length=512, aggregate=np.median)
-    peaks = librosa.util.peak_pick(onset_env, 3, 3, 3, 5, 0.5, 10)
-    peak_bool = np.array([1 if i in peaks else 0 for i in range(onset_env.shape[0])])
-    peak_mat = onset_env * peak_bool
-    x = np.mean(np.abs(librosa.core.stft(audio_signal, n_fft=1024, hop_length=512)), axis=0)
+    '''
+    Squared peak envelope per STFT frame. audio_signal is (samples,) or
+    (signals x samples) for a batch of equal-length signals.
+    '''
+    signals = np.atleast_2d(audio_signal)
+    peak_mats, frame_mags = [], []
+    for y in signals:
+        onset_env = librosa.onset.onset_strength(y=y, sr=sr, n_fft=1024, hop_length=512, aggregate=np.median)
+        peaks = librosa.util.peak_pick(onset_env, pre_max=3, post_max=3, pre_avg=3, post_avg=5, delta=0.5, wait=10)
+        peak_mats.append(onset_env * peak_mask(onset_env.shape[0], peaks))
+        frame_mags.append(np.mean(np.abs(librosa.core.stft(y, n_fft=1024, hop_length=512)), axis=0))
+    peak_mat = np.array(peak_mats)
+    x = np.array(frame_mags)[:, :peak_mat.shape[1]]
     alpha = forget_factor(time_constant, sr)
-    peaks_squared = np.zeros(peak_mat.shape)
-    for i in range(1, len(peaks_squared)):
-        peak_factor = alpha * peak_mat[i-1]**2 + (1 - alpha) * np.absolute(x[i])**2
-        peaks_squared[i] = max(x[i]**2, peak_factor)
-    return peaks_squared 
+    peaks_squared = lagged_peak(np.abs(x)**2, peak_mat**2, alpha)
+    return peaks_squared[0] if np.ndim(audio_signal) == 1 else peaks_squared
+
+def pad_chunks(sparse_vec, num_chunks):
+    '''Pads a (1 x chunks) sparsity vector with inactive chunks up to num_chunks'''
+    return np.pad(sparse_vec, ((0, 0), (0, num_chunks - sparse_vec.shape[1])), mode='constant')
+
+def pan_matrix(P, num_channels=1):
+    '''
+    Constant-power pan law for pan positions P in [0, 1] (0 left, 0.5 center,
+    1 right). Returns a (2 x num_channels) matrix, or (stems x 2 x num_channels)
+    for an array of positions. Stereo sources are balanced per side, scaled
+    so that the center position leaves them unchanged.
+    '''
+    theta = np.asarray(P, dtype=np.float64) * (np.pi / 2)
+    gains = np.stack((np.cos(theta), np.sin(theta)), axis=-1)
+    if num_channels == 1:
+        return gains[..., np.newaxis]
+    return np.sqrt(2) * gains[..., np.newaxis] * np.eye(2)
 
 def peak_filter(signal, cutoff, sr, order, btype, window_step, num_steps):
-    y = apply_bfilter(signal, cutoff, sr, order, btype)
-    num_steps = int(signal.shape[0] / window_step)
-    peaks = np.zeros(num_steps)
-    for i in range(num_steps):
-        y_window = y[i*window_step:(i+1)*window_step]
-        peak = y_window.max()
-        peaks[i] = peak
-    return peaks
+    return filter_bank_peaks(signal, [cutoff], sr, order, btype, window_step)[0]
 
 def peak_filter_bank(signal, cutoffs, sr, order, btype, window_step, num_steps):
-    num_cutoffs = len(cutoffs)
-    peaks = np.zeros((num_cutoffs, num_steps))
-    for i in range(num_cutoffs):
-        peaks[i] = peak_filter(signal, cutoffs[i], sr, order, btype, window_step, num_steps)
+    peaks = filter_bank_peaks(signal, cutoffs, sr, order, btype, window_step)
     maxs = np.argmax(peaks, axis=0)
     freq_counts = np.unique(maxs, return_counts=True)
-    max_idx = np.argmax(freq_counts[:][1])
+    max_idx = freq_counts[0][np.argmax(freq_counts[1])]
     return cutoffs[max_idx]
 
 def preprocess_pll(x, high_cutoff, low_cutoff, sr, high_order, low_order, x_env):
-    x_low = apply_bfilter(x, cutoff=low_cutoff, sr=sr, order=low_order, btype='low')
-    x = apply_bfilter(x_low, cutoff=high_cutoff, sr=sr, order=high_order, btype='high')
+    x = sos_filter(x, band_sos(high_cutoff, low_cutoff, sr, low_order, hp_order=high_order))
     x_in = x * (1/x_env)
     return x_in
 
+def rank_min(x, axis=0):
+    '''
+    Vectorized rankdata(method='min') along one axis of an n-d array.
+    Ties share the lowest rank of the group.
+    '''
+    x = np.moveaxis(np.asarray(x), axis, -1)
+    order = np.argsort(x, axis=-1, kind='mergesort')
+    x_sorted = np.take_along_axis(x, order, axis=-1)
+    pos = np.broadcast_to(np.arange(x.shape[-1]), x.shape)
+    new_val = np.ones(x.shape, dtype=bool)
+    new_val[..., 1:] = x_sorted[..., 1:] != x_sorted[..., :-1]
+    first = np.maximum.accumulate(np.where(new_val, pos, 0), axis=-1)
+    ranks = np.empty(x.shape, dtype=np.int64)
+    np.put_along_axis(ranks, order, first + 1, axis=-1)
+    return np.moveaxis(ranks, -1, axis)
+
 def rank_signal_1d(audio_signal):
 	return np.abs(rankdata(audio_signal, method='min') - (audio_signal.shape[0])) + 1
 
 def rank_signal_2d(audio_signal): 
-    a = np.zeros(audio_signal.shape)
-    for row in range(audio_signal.shape[1]):
-        a[:, row] = np.abs(rankdata(audio_signal[:, row], method='min') - (audio_signal.shape[0])) + 1
-    return a
+    '''
+    Ranks every frame (column) of a (bins x frames) spectrogram, or of a
+    stacked (signals x bins x frames) array, with the loudest bin ranked 1.
+    '''
+    num_bins = audio_signal.shape[-2]
+    return np.abs(rank_min(audio_signal, axis=-2) - num_bins) + 1
 
 def rank_soa_vec(soa_vec): return np.abs(rankdata(soa_vec, method='min') - (soa_vec.shape[0])) + 1
 
@@ -519,22 +586,49 @@ def rms_normalization(x, R):
     a = np.sqrt((n * R**2) / np.sum(x**2))
     return a
 
+def ratio(w_f, w_p): return 0.54*w_p + 0.764*w_f + 1
+
+def release(release_max, crest_factor_n2): return (2*release_max) / crest_factor_n2
+
 def rms_squared(audio_signal, time_constant, sr):
+    '''
+    Squared RMS envelope per frame. audio_signal is (samples,) or
+    (signals x samples) for a batch of equal-length signals.
+    '''
     alpha = forget_factor(time_constant, sr)
-    rms = librosa.feature.rms(audio_signal, frame_length=1024, hop_length=512)
+    signals = np.atleast_2d(audio_signal)
+    rms = np.array([librosa.feature.rms(y=y, frame_length=1024, hop_length=512)[0] for y in signals])
+    num_frames = rms.shape[1]
     rms_squared = np.zeros(rms.shape)
-    for i in range(1, rms.shape[1]):
-        rms_squared[0,i] = alpha * rms[0,i-1]**2 + (1-alpha)*np.absolute(audio_signal[i]**2)
-    return np.squeeze(rms_squared, axis=0) 
+    rms_squared[:, 1:] = alpha * rms[:, :-1]**2 + (1-alpha) * np.absolute(signals[:, 1:num_frames]**2)
+    return rms_squared[0] if np.ndim(audio_signal) == 1 else rms_squared
+
+def signal_sources(path, files):
+    '''Joins file names onto path and passes pre-loaded arrays through unchanged'''
+    return [os.path.join(path, f) if isinstance(f, str) else f for f in files]
+
+def source_name(signal, idx): return signal if isinstance(signal, str) else idx
 
 def sparse_overlap_avg(num_bins, chunk_fft_db, sparse_vec, overlap_vec, num_overlaps):
-    soa_vec = np.zeros((num_bins, 1))
-    for i in range(num_bins):
-        soa_vec[i] = np.sum((chunk_fft_db[i] * sparse_vec) * overlap_vec) / num_overlaps
-    return soa_vec
+    '''Per-bin average of chunk_fft_db over the active, overlapping chunks as a (num_bins x 1) vector'''
+    num_chunks = chunk_fft_db.shape[1]
+    active = np.logical_and(sparse_vec[:, :num_chunks], overlap_vec[:, :num_chunks]).astype(chunk_fft_db.dtype)
+    return (chunk_fft_db[:num_bins] @ active.T) / num_overlaps
 
 def spectrum(fft_signal): return np.mean(fft_signal, axis=0)
 
+def stack_spectrograms(fft_signals):
+    '''
+    Stacks (bins x frames) spectrograms into one (signals x bins x frames)
+    array. Shorter signals are padded with the lowest level of the batch.
+    '''
+    num_frames = max(fft_signal.shape[1] for fft_signal in fft_signals)
+    floor = min(fft_signal.min() for fft_signal in fft_signals)
+    stack = np.full((len(fft_signals), fft_signals[0].shape[0], num_frames), floor)
+    for i, fft_signal in enumerate(fft_signals):
+        stack[i, :, :fft_signal.shape[1]] = fft_signal
+    return stack
+
 def spectral_flux(fft_signal):
     difference = np.zeros(fft_signal.shape)
     difference[:, 1:] = np.diff(np.absolute(fft_signal), axis=1)
@@ -542,36 +636,45 @@ def spectral_flux(fft_signal):
     spectral_flux = hwr / np.absolute(fft_signal)
     return np.sum(spectral_flux, axis=0)
 
-def tonal_balance(path, high_cutoff, low_cutoff, high_order, low_order, x_env, Q, K_d, fc, G, f_b, f_type):
-    sig = Signal(path=path, window_size=1024, hop_length=512)
-    x = sig.signal
-    sr = sig.sr
-    x_in = preprocess_pll(x, high_cutoff=high_cutoff, low_cutoff=low_cutoff, 
+def threshold(rms_db, w_p): return -11.03 + 0.44*rms_db - 4.897*w_p
+
+def top_bins(mask_m, max_n):
+    '''
+    Indices of the max_n largest values along the last axis in ascending
+    order, matching np.argsort(mask_m)[..., -max_n:] without a full sort.
+    '''
+    k = min(max_n, mask_m.shape[-1])
+    top = np.argpartition(mask_m, -k, axis=-1)[..., -k:]
+    order = np.argsort(np.take_along_axis(mask_m, top, axis=-1), axis=-1)
+    return np.take_along_axis(top, order, axis=-1)
+
+def tonal_balance(x, sr, high_cutoff, low_cutoff, high_order, low_order, x_env, Q, K_d, fc, G, f_b, f_type, num_bands=5):
+    '''
+    Tracks the dominant low/mid frequencies of x with a PLL and applies the
+    (G, f_b, f_type) EQ band at each of the num_bands strongest ones.
+
+    x is a mono or (channels x samples) array at sample rate sr. The PLL runs
+    on the mono downmix and the resulting EQ cascade is applied to every channel.
+    '''
+    x_mono = librosa.to_mono(x)
+    x_in = preprocess_pll(x_mono, high_cutoff=high_cutoff, low_cutoff=low_cutoff, 
                           sr=sr, high_order=high_order, low_order=low_order, x_env=x_env)
     b, a = h_lp(fc=fc, sr=sr, Q=Q)
     x_d = x_in * K_d
     f_osc = calc_f_osc(x_d, b, a)
-    y_cos_osc = np.zeros(f_osc.shape)
-    y_sin_osc = np.zeros(f_osc.shape)
-    for n in range(x_in.shape[0]):
-        y_cos_osc[n] = np.cos(2*np.pi * (f_osc[n] / 44100) * n)
-        y_sin_osc[n] = np.sin(2*np.pi * (f_osc[n] / 44100) * n)
+    y_cos_osc = np.cos(oscillator_phase(f_osc, sr))
     x_d = x_d * y_cos_osc
     f0 = calc_f0(x_d, b, a)
-    f0_fft = np.abs(np.fft.fft(f0))
+    f0_fft = np.abs(np.fft.rfft(f0))
+    fft_freqs = np.fft.rfftfreq(f0.shape[0], d=1/sr)
     bins_arr = [20, 40, 60, 80, 100, 150, 200, 250, 500, 750, 1000, 1250, 1500]
-    val, bins = np.histogram(f0_fft, bins=bins_arr, range=(20, 1500), density=False)
-    top_vals = np.argsort(mask)[-5:]
+    val, bins = np.histogram(fft_freqs, bins=bins_arr, weights=f0_fft)
+    top_vals = np.argsort(val)[-num_bands:]
     top_freqs = bins[top_vals]
-    y = x
-    for freq in top_freqs:
-        y = eq_filter(y, fc=fc, sr=sr, G=G, f_b=f_b, f_type=f_type)
-    return y
+    bands = [(freq, G, f_b, f_type) for freq in top_freqs]
+    return eq_filter_bank(x, bands, sr)
 
 def wp(cf, cf_avg, std):
     gaussian = ((cf - cf_avg)**2) / (2*(std**2))
-    if cf <= cf_avg:
-        wp = np.exp(gaussian)
-    else:
-        wp = 2 - np.exp(gaussian)
-    return wp
\ No newline at end of file
+    wp = np.where(cf <= cf_avg, np.exp(gaussian), 2 - np.exp(gaussian))
+    return wp[()]
\ No newline at end of file
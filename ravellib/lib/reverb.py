@@ -0,0 +1,47 @@
+import functools
+import numpy as np
+from ravellib.lib.filters import butter_sos, partitioned_convolve, sos_filter
+
+
+@functools.lru_cache(maxsize=32)
+def reverb_ir(reverberance, hf_damping, room_scale, stereo_depth, pre_delay, wet_gain, sr, max_seconds=6.0):
+    '''
+    Stereo (2 x samples) impulse response from the SoX reverb parameters,
+    cached per parameter tuple and sample rate. The response is exponentially
+    decaying noise:
+        reverberance and room_scale (0-100 %) set the decay time,
+        hf_damping (0-100 %) shortens the decay above 4 kHz,
+        stereo_depth (0-100 %) decorrelates the left and right channels,
+        pre_delay (ms) delays the onset and wet_gain (dB) scales the result.
+    The returned array is shared between callers and is read-only.
+    '''
+    rt60 = 0.2 + 3.0 * (reverberance / 100) * (0.25 + 0.75 * room_scale / 100)
+    rt60_hf = rt60 * (1 - 0.8 * hf_damping / 100)
+    num_samples = int(min(1.2 * rt60, max_seconds) * sr)
+    t = np.arange(num_samples) / sr
+    # fixed seed so the same parameters always give the same room
+    rng = np.random.RandomState(0)
+    common, left, right = rng.standard_normal((3, num_samples))
+    side = stereo_depth / 100
+    noise = np.sqrt(1 - side**2) * common + side * np.array([left, right])
+    low = sos_filter(noise, butter_sos(4000, sr, 2, 'lowpass'))
+    high = noise - low
+    # 60 dB of decay over rt60 for the low band and rt60_hf for the high band
+    tail = low * 10**(-3 * t / rt60) + high * 10**(-3 * t / rt60_hf)
+    tail /= np.sqrt(np.sum(tail**2, axis=-1, keepdims=True))
+    delay = int(round(pre_delay / 1000 * sr))
+    ir = np.zeros((2, delay + num_samples))
+    ir[:, delay:] = tail * 10**(wet_gain / 20)
+    ir.setflags(write=False)
+    return ir
+
+
+def apply_reverb(x, reverberance, hf_damping, room_scale, stereo_depth, pre_delay, wet_gain, sr,
+                 block_size=4096):
+    '''
+    Reverberates x, a mono or (2 x samples) send, by partitioned convolution
+    with the cached impulse response. Returns (2 x samples) with the length of x.
+    '''
+    ir = reverb_ir(float(reverberance), float(hf_damping), float(room_scale), float(stereo_depth),
+                   float(pre_delay), float(wet_gain), sr)
+    return partitioned_convolve(x, ir, block_size)
@@ -0,0 +1,43 @@
+import subprocess
+import numpy as np
+from pysndfx import AudioEffectsChain
+
+
+class SoxChain:
+    '''
+    Collects the SoX effects for one trackout into a single AudioEffectsChain
+    and applies them in one sox process. The audio goes through stdin/stdout
+    as raw interleaved float32, so there is one process launch and one round
+    trip for the whole chain.
+    '''
+    def __init__(self, sr):
+        self.sr = sr
+        self.fx = AudioEffectsChain()
+
+    def __len__(self):
+        return len(self.fx.command)
+
+    def reverb(self, reverberance, hf_damping, room_scale, stereo_depth, pre_delay, wet_gain, wet_only=False):
+        self.fx.reverb(reverberance, hf_damping, room_scale, stereo_depth, pre_delay, wet_gain, wet_only)
+        return self
+
+    def command(self, channels):
+        '''sox command line reading and writing raw float32 with the given channel count on the pipes'''
+        pipe = ['-t', 'f32', '-r', str(self.sr), '-c', str(channels), '-']
+        return ['sox', '-N', '-V1'] + pipe + pipe + [str(arg) for arg in self.fx.command]
+
+    def process(self, signal):
+        '''Runs the chain on a 1-D or (channels x samples) signal and returns float32 in the same layout'''
+        if len(self) == 0:
+            return np.asarray(signal, dtype=np.float32)
+        x = np.atleast_2d(signal)
+        channels = x.shape[0]
+        # (channels x samples) in Fortran order is interleaved frames
+        data = np.asarray(x, dtype=np.float32).tobytes(order='F')
+        proc = subprocess.Popen(self.command(channels), stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = proc.communicate(data)
+        if proc.returncode != 0:
+            raise RuntimeError(stderr.decode())
+        y = np.frombuffer(stdout, dtype=np.float32).reshape((channels, -1), order='F')
+        return y.reshape(np.shape(signal)[:-1] + (y.shape[-1],))
@@ -0,0 +1,99 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+import librosa
+import numpy as np
+
+
+class SpectrumCache:
+    '''
+    LRU cache of decoded audio and dB magnitude spectrograms, bounded by
+    the total nbytes of the cached arrays. Arrays larger than the whole
+    budget are returned without being cached.
+
+    Entries are keyed by the file path and modification time, by the
+    trackout uuid of a registered array, or by a content hash of any other
+    array, together with the sample rate and STFT settings. Arrays are taken
+    to be at sr already. Cached arrays are returned read-only. Clear the
+    cache when a processing job finishes.
+    '''
+    def __init__(self, max_bytes=2**28):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._uuids = {}
+        self._signals = {}
+        self._lock = threading.Lock()
+
+    def register(self, uuid, signal):
+        '''Keys signal by its trackout uuid, so lookups do not hash its samples'''
+        with self._lock:
+            self._uuids[id(signal)] = uuid
+            # holding the array keeps its id from being reused
+            self._signals[uuid] = signal
+
+    def source_key(self, audio_signal):
+        if isinstance(audio_signal, np.ndarray):
+            uuid = self._uuids.get(id(audio_signal))
+            if uuid is not None:
+                return ('uuid', uuid)
+            digest = hashlib.sha1(np.ascontiguousarray(audio_signal).view(np.uint8)).hexdigest()
+            return ('array', digest, audio_signal.shape, audio_signal.dtype.str)
+        path = os.path.abspath(audio_signal)
+        return ('path', path, os.path.getmtime(path))
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        return None
+
+    def _put(self, key, value):
+        value.setflags(write=False)
+        if value.nbytes > self.max_bytes:
+            return value
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+            self._entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return value
+
+    def load(self, audio_signal, sr):
+        '''Returns the mono signal for a path or array, decoding each file and downmixing each array once'''
+        if isinstance(audio_signal, np.ndarray) and audio_signal.ndim == 1:
+            return audio_signal
+        key = ('audio',) + self.source_key(audio_signal) + (sr,)
+        y = self._get(key)
+        if y is None:
+            if isinstance(audio_signal, np.ndarray):
+                y = librosa.to_mono(audio_signal)
+            else:
+                y, _ = librosa.load(audio_signal, sr=sr)
+            y = self._put(key, y)
+        return y
+
+    def stft_db(self, audio_signal, n_fft, hop_length, sr):
+        '''Returns the (bins x frames) dB magnitude spectrogram for a path or array'''
+        key = ('stft_db',) + self.source_key(audio_signal) + (sr, n_fft, hop_length)
+        D_db = self._get(key)
+        if D_db is None:
+            y = self.load(audio_signal, sr)
+            D = np.abs(librosa.core.stft(y, n_fft=n_fft, hop_length=hop_length))
+            D_db = self._put(key, librosa.amplitude_to_db(D))
+        return D_db
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self._uuids.clear()
+            self._signals.clear()
+
+
+spectrum_cache = SpectrumCache()
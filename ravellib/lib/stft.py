@@ -0,0 +1,72 @@
+import functools
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.signal import get_window
+
+
+@functools.lru_cache(maxsize=32)
+def window(name, length, periodic=True):
+    '''Analysis window, periodic or symmetric, cached per (name, length, periodic). Treat as read-only.'''
+    w = get_window(name, length, fftbins=periodic)
+    w.setflags(write=False)
+    return w
+
+
+def frame(x, frame_length, hop_length):
+    '''
+    Read-only strided view of x (..., samples) as (..., frames, frame_length)
+    without copying. Trailing samples that do not fill a frame are dropped.
+    '''
+    x = np.ascontiguousarray(x)
+    num_frames = 1 + (x.shape[-1] - frame_length) // hop_length
+    shape = x.shape[:-1] + (num_frames, frame_length)
+    strides = x.strides[:-1] + (x.strides[-1] * hop_length, x.strides[-1])
+    return as_strided(x, shape=shape, strides=strides, writeable=False)
+
+
+def pad_center(x, n_fft, mode='constant'):
+    '''Pads n_fft // 2 samples on both ends so frame t is centered on sample t * hop'''
+    pad = [(0, 0)] * (x.ndim - 1) + [(n_fft // 2, n_fft // 2)]
+    return np.pad(x, pad, mode=mode)
+
+
+def stft(x, n_fft, hop_length, window_name='hann'):
+    '''
+    Complex STFT of x (samples,) or (channels x samples) with centered
+    frames. Returns (..., bins, frames), every channel in one transform.
+    '''
+    frames = frame(pad_center(np.asarray(x, dtype=np.float64), n_fft), n_fft, hop_length)
+    return np.swapaxes(np.fft.rfft(frames * window(window_name, n_fft), axis=-1), -1, -2)
+
+
+def istft(X, hop_length, length, window_name='hann'):
+    '''
+    Weighted overlap-add inverse of stft(). X is (..., bins, frames); the
+    result is (..., length), normalized by the summed squared window so an
+    unmodified STFT reconstructs its input.
+    '''
+    n_fft = 2 * (X.shape[-2] - 1)
+    w = window(window_name, n_fft)
+    frames = np.fft.irfft(np.swapaxes(X, -1, -2), n_fft, axis=-1) * w
+    num_frames = frames.shape[-2]
+    total = n_fft + hop_length * (num_frames - 1)
+    y = np.zeros(frames.shape[:-2] + (total,))
+    norm = np.zeros(total)
+    w_sq = w**2
+    if n_fft % hop_length == 0:
+        # adds the frames back one hop-sized slice position at a time
+        for r in range(n_fft // hop_length):
+            seg = slice(r * hop_length, (r + 1) * hop_length)
+            end = r * hop_length + num_frames * hop_length
+            y[..., r * hop_length:end] += frames[..., seg].reshape(frames.shape[:-2] + (-1,))
+            norm[r * hop_length:end] += np.tile(w_sq[seg], num_frames)
+    else:
+        for t in range(num_frames):
+            y[..., t * hop_length:t * hop_length + n_fft] += frames[..., t, :]
+            norm[t * hop_length:t * hop_length + n_fft] += w_sq
+    y = y / np.where(norm > 1e-10, norm, 1.0)
+    start = n_fft // 2
+    out = np.zeros(y.shape[:-1] + (length,))
+    n = min(length, total - start)
+    out[..., :n] = y[..., start:start + n]
+    return out
@@ -0,0 +1,32 @@
+import unittest
+import numpy as np
+from ravellib.lib.analysis import AnalysisCache
+
+
+class TestAnalysisCache(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.signal = np.random.RandomState(0).standard_normal((2, self.sr)).astype(np.float32)
+        self.cache = AnalysisCache()
+        self.cache.register("trackout", self.signal)
+
+    def test_shared_downmix(self):
+        a = self.cache.analysis(self.signal, 1024, 1024, 123, self.sr)
+        b = self.cache.analysis(self.signal, 1024, 1024, 512, self.sr)
+        self.assertIs(a, self.cache.analysis(self.signal, 1024, 1024, 123, self.sr))
+        self.assertIs(a.mono_signal, b.mono_signal)
+
+    def test_evict_keeps_other_settings(self):
+        a = self.cache.analysis(self.signal, 1024, 1024, 123, self.sr)
+        a.fft
+        b = self.cache.analysis(self.signal, 1024, 1024, 512, self.sr)
+        self.cache.evict(self.signal, 1024, 1024, 123)
+        self.assertIsNot(a, self.cache.analysis(self.signal, 1024, 1024, 123, self.sr))
+        self.assertIs(b, self.cache.analysis(self.signal, 1024, 1024, 512, self.sr))
+        # the shared downmix never holds the evicted spectrum
+        self.assertNotIn("fft", b.base.__dict__)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+import unittest
+import numpy as np
+import ravellib.lib.preprocessing as preprocessing
+from ravellib.lib.dynamics import Compressor, MultibandCompressor, NoiseGate, gain_computer
+
+
+def reference_noise_gate(x, holdtime, ltrhold, utrhold, release, attack, fs):
+    # the original sample-by-sample gate the compiled kernel replaced
+    rel = round(release * fs)
+    att = round(attack * fs)
+    g = np.zeros(x.shape)
+    lthcnt = 0
+    uthcnt = 0
+    ht = round(holdtime * fs)
+    for n in range(len(x)):
+        if (x[n] <= ltrhold) or ((x[n] < utrhold) and (lthcnt > 0)):
+            lthcnt += 1
+            uthcnt = 0
+            if lthcnt > ht:
+                if lthcnt > (rel + ht):
+                    g[n] = 0
+                else:
+                    g[n] = 1 - ((lthcnt - ht) / rel)
+            elif (n < ht) and (lthcnt == n):
+                g[n] = 0
+            else:
+                g[n] = 1
+        elif (x[n] >= utrhold) or ((x[n] > ltrhold) and (uthcnt > 0)):
+            uthcnt += 1
+            if g[n-1] < 1:
+                g[n] = np.maximum(uthcnt / att, g[n-1])
+            else:
+                g[n] = 1
+            lthcnt = 0
+        else:
+            g[n] = g[n-1]
+            lthcnt = 0
+            uthcnt = 0
+    return g
+
+
+class TestNoiseGate(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 1000
+        rng = np.random.RandomState(0)
+        # levels in dB that wander above and below the thresholds
+        self.x = np.cumsum(rng.standard_normal((2, 5000)), axis=1) - 50
+        self.params = (0.05, -60, -40, 0.1, 0.02, self.fs)
+
+    def test_matches_reference(self):
+        g = preprocessing.noise_gate(self.x, *self.params)
+        for channel, g_channel in zip(self.x, g):
+            np.testing.assert_allclose(g_channel, reference_noise_gate(channel, *self.params))
+
+    def test_blocks_match_full_pass(self):
+        full = NoiseGate(*self.params, num_channels=2).process(self.x)
+        blocks = NoiseGate(*self.params, num_channels=2).process_blocks(self.x, 333)
+        np.testing.assert_array_equal(blocks, full)
+
+
+class TestCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 1000
+
+    def test_static_curve(self):
+        x_db = np.array([-40.0, -23.0, -20.0, -17.0, -10.0, 0.0])
+        g = gain_computer(x_db, -20.0, 4.0, 6.0)
+        # below the knee there is no reduction, above it the slope is 1 / ratio
+        self.assertEqual(g[0], 0.0)
+        self.assertEqual(g[1], 0.0)
+        self.assertAlmostEqual(g[4], -10.0 * (1 - 1 / 4.0))
+        self.assertAlmostEqual(g[5], -20.0 * (1 - 1 / 4.0))
+        # the quadratic knee meets both straight segments
+        self.assertAlmostEqual(g[2], (1 / 4.0 - 1) * 3.0**2 / 12.0)
+        self.assertAlmostEqual(g[3], -3.0 * (1 - 1 / 4.0))
+        # a hard knee switches at the threshold
+        np.testing.assert_allclose(gain_computer(x_db, -20.0, 4.0, 0.0), np.minimum(0, (x_db + 20) * -0.75))
+
+    def test_attack_and_release_timing(self):
+        attack, release = 0.01, 0.1
+        compressor = Compressor(-20.0, 1e9, attack, release, 0.0, self.fs)
+        x = np.concatenate((np.ones(500), np.full(1000, 1e-3)))
+        g = compressor.gain_db(x)[0]
+        target = -20.0 * (1 - 1e-9)
+        # one time constant reaches 1 - 1/e of the step, in both directions
+        n_attack = int(attack * self.fs)
+        self.assertAlmostEqual(g[n_attack - 1] / target, 1 - np.exp(-1), places=2)
+        n_release = int(release * self.fs)
+        self.assertAlmostEqual(g[500 + n_release - 1] / g[499], np.exp(-1), places=2)
+
+    def test_linked_stereo_gain(self):
+        rng = np.random.RandomState(0)
+        x = np.array([rng.standard_normal(2000), 0.1 * rng.standard_normal(2000)])
+        compressor = Compressor(-20.0, 4.0, 0.005, 0.05, 6.0, self.fs)
+        y = compressor.process(x, link=True)
+        gain = y / np.where(x == 0, 1, x)
+        np.testing.assert_allclose(gain[0], gain[1])
+        self.assertLess(gain.min(), 1.0)
+        unlinked = compressor.process(x, link=False) / x
+        self.assertFalse(np.allclose(unlinked[0], unlinked[1]))
+
+
+class TestMultibandCompressor(unittest.TestCase):
+
+    def setUp(self):
+        self.fs = 22050
+        rng = np.random.RandomState(1)
+        self.x = (0.5 * rng.standard_normal((2, self.fs))).astype(np.float32)
+        self.crossovers = [200, 2000]
+
+    def test_unity_ratio_sums_flat(self):
+        compressor = MultibandCompressor(self.crossovers, -20.0, 1.0, 0.005, 0.05, 6.0, self.fs)
+        y = compressor.process(self.x)
+        self.assertEqual(y.dtype, np.float32)
+        expected = compressor.split(self.x).sum(axis=0)
+        np.testing.assert_allclose(y, expected, atol=1e-6)
+
+    def test_per_band_static_curve(self):
+        thresholds = np.array([-60.0, -20.0, 0.0])
+        compressor = MultibandCompressor(self.crossovers, thresholds, 4.0, 0.005, 0.05, 0.0, self.fs)
+        level = np.full((3, 1, 1), -10.0)
+        bands = 10**(level / 20) * np.ones((3, 1, 4000))
+        g = compressor.gain_db(bands)
+        # a held level settles on each band's own static curve
+        expected = gain_computer(-10.0, thresholds, 4.0, 0.0)
+        np.testing.assert_allclose(g[:, 0, -1], expected, atol=1e-3)
+
+    def test_linked_stereo_gain(self):
+        x = self.x.copy()
+        x[1] *= 0.1
+        compressor = MultibandCompressor(self.crossovers, -30.0, 4.0, 0.005, 0.05, 6.0, self.fs)
+        g = compressor.gain_db(compressor.split(x), link=True)
+        self.assertEqual(g.shape[1], 1)
+        bands = compressor.split(x)
+        y = compressor.process(x, link=True)
+        np.testing.assert_allclose(y, np.sum(bands * 10**(g / 20), axis=0), atol=1e-5)
+        self.assertLess(g.min(), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+import unittest
+import librosa
+import numpy as np
+import ravellib.lib.preprocessing as preprocessing
+import ravellib.lib.stft as stft
+from ravellib.lib.filters import band_sos, sos_filter
+from ravellib.lib.effects import DeEsserSignal, EQSignal, FaderSignal, Mixer, PanSignal, SignalAggregator, SpectralChain, SpectralGate
+
+
+class TestChunkMasking(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        rng = np.random.RandomState(0)
+        self.long = (0.1 * rng.standard_normal((2, 12 * self.sr))).astype(np.float32)
+        self.short = (0.1 * rng.standard_normal((2, 7 * self.sr))).astype(np.float32)
+
+    def eq_signal(self, signal):
+        return EQSignal(signal, 2048, 2048, 512, -12, "vocal", self.sr, 10, 3, -2,
+                        mask_mode="chunk", seconds=2)
+
+    def test_overlap_unequal_chunk_counts(self):
+        sv0 = np.array([[True, True, False, True]])
+        sv1 = np.array([[True, True]])
+        overlap_vec, num_overlaps, overlap_ratio = preprocessing.overlap(sv0, sv1)
+        np.testing.assert_array_equal(overlap_vec, [[True, True, False, False]])
+        self.assertEqual(num_overlaps, 2)
+        self.assertEqual(overlap_ratio, 0.5)
+
+    def test_group_matches_pairwise_average(self):
+        rng = np.random.RandomState(6)
+        signals = [EQSignal((0.1 * rng.standard_normal((2, 3 * self.sr))).astype(np.float32),
+                            2048, 2048, 512, -12, "vocal", self.sr, 10, 3, -2) for _ in range(3)]
+        group = EQSignal.group_eq_params(signals)
+        for i, signal in enumerate(signals):
+            others = signals[:i] + signals[i + 1:]
+            self.assertEqual(group[i], signal.eq_params(others))
+
+    def test_unequal_length_stems(self):
+        signals = [self.eq_signal(self.long), self.eq_signal(self.short)]
+        self.assertNotEqual(signals[0].sparse_vec.shape, signals[1].sparse_vec.shape)
+        pairwise = [signals[0].eq_params([signals[1]]), signals[1].eq_params([signals[0]])]
+        self.assertEqual(EQSignal.group_eq_params(signals), pairwise)
+
+
+class TestPanning(unittest.TestCase):
+
+    def test_octave_bands_below_nyquist(self):
+        for sr in (8000, 16000, 22050, 44100):
+            bands = preprocessing.octave_bands(50, 12800, sr)
+            self.assertTrue(all(upper < sr / 2 for lower, upper in bands))
+        self.assertEqual(preprocessing.octave_bands(50, 12800, 44100)[-1], (6400, 12800))
+
+    def test_lead_filter_at_22050(self):
+        sr = 22050
+        t = np.arange(2 * sr) / sr
+        signal = np.array([np.sin(2 * np.pi * 8000 * t)] * 2, dtype=np.float32)
+        cutoffs = preprocessing.octave_bands(50, 12800, sr)
+        ps = PanSignal(signal, 1024, 1024, 512, -12, "instrument", sr, cutoffs, 0.5, 2, 'bandpass')
+        lead_band = cutoffs.index(tuple(ps.lead_filter()))
+        self.assertEqual(cutoffs[lead_band], (6400, 0.45 * sr))
+        P = SignalAggregator(sr, 1).pan_positions(cutoffs, [lead_band])
+        self.assertEqual(ps.pan(P[0]).shape, signal.T.shape)
+
+
+class TestSpectralChain(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        rng = np.random.RandomState(1)
+        self.signal = (0.1 * rng.standard_normal((2, 3 * self.sr))).astype(np.float32)
+
+    def test_empty_chain_reconstructs(self):
+        y = SpectralChain(1024, 256, self.sr).process(self.signal)
+        np.testing.assert_allclose(y, self.signal, atol=1e-6)
+
+    def test_eq_and_deesser_share_one_transform(self):
+        eq = EQSignal(self.signal, 1024, 1024, 1024, -12, "vocal", self.sr, 10, 3, -2)
+        de = DeEsserSignal(self.signal, 256, 256, 256, -12, "vocal", self.sr,
+                           [100, 200, 300, 400, 510, 630, 770, 920, 1080, 1270, 1480, 1720, 2000, 2320,
+                            2700, 3150, 3700, 4400, 5300, 6400, 7700, 9500], 0.08, 1.2, 0.65)
+        eq_info = [[1000, 3, 0], [80, 0, 1]]
+        gain = de.gain_reduction(de.compute_sharpness())
+        y = eq.equalization(eq_info, 2, "spectral", [de.spectral_deesser(gain)])
+        # the same gains applied by hand to a single STFT
+        X = stft.stft(self.signal, 2048, 512)
+        magnitude = np.abs(X)
+        freqs = np.fft.rfftfreq(2048, 1 / self.sr)
+        times = np.arange(X.shape[-1]) * 512 / self.sr
+        G = eq.spectral_eq(eq_info, 2)(magnitude, freqs, times) * de.spectral_deesser(gain)(magnitude, freqs, times)
+        expected = stft.istft(X * G, 512, self.signal.shape[-1])
+        np.testing.assert_allclose(y, expected.T, atol=1e-5)
+
+    def test_spectral_gate(self):
+        t = np.arange(2 * self.sr) / self.sr
+        tone = 0.5 * np.sin(2 * np.pi * 1000 * t)
+        hiss = 1e-4 * np.random.RandomState(5).standard_normal(t.shape[0])
+        signal = np.array([np.where(t < 1, tone, hiss)] * 2)
+        gate = SpectralGate(-40, 20)
+        X = stft.stft(signal, 1024, 256)
+        G = gate(np.abs(X), np.fft.rfftfreq(1024, 1 / self.sr), None)
+        # every bin of the hiss frames and every bin away from the tone is gated
+        self.assertTrue(np.all(G[:, -20:] == 0.1))
+        self.assertTrue(np.all(G[100:, 4:80] == 0.1))
+        self.assertTrue(np.all(G[46:49, 4:80] == 1.0))
+        y = SpectralChain(1024, 256, self.sr).add(gate).process(signal)
+        half = self.sr
+        np.testing.assert_allclose(y[:, 1024:half - 1024], signal[:, 1024:half - 1024], atol=1e-4)
+        np.testing.assert_allclose(y[:, half + 1024:-1024], 0.1 * signal[:, half + 1024:-1024], atol=1e-6)
+
+
+class TestDeEsser(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.critical_bands = [100, 200, 300, 400, 510, 630, 770, 920, 1080, 1270, 1480, 1720, 2000, 2320,
+                               2700, 3150, 3700, 4400, 5300, 6400, 7700, 9500]
+        t = np.arange(2 * self.sr) / self.sr
+        self.tone = np.array([0.5 * np.sin(2 * np.pi * 500 * t)] * 2, dtype=np.float32)
+
+    def deesser_signal(self, signal):
+        return DeEsserSignal(signal, 256, 256, 256, -12, "vocal", self.sr, self.critical_bands, 0.08, 1.2, 0.65)
+
+    def test_gain_reduction_matches_loop(self):
+        de = self.deesser_signal(self.tone)
+        sharpness = np.array([0.05, 1.0, 1.2, 1.3, 2.0, 5.0, 50.0, 0.0])
+        expected = np.ones(sharpness.shape[0])
+        for n in range(sharpness.shape[0]):
+            if sharpness[n] > de.sharp_thresh:
+                expected[n] = max(1 + (np.log(sharpness[n]) / np.log(0.1)), de.max_reduction)
+        np.testing.assert_allclose(de.gain_reduction(sharpness), expected)
+
+    def test_leaves_content_below_band(self):
+        de = self.deesser_signal(self.tone)
+        num_frames = de.compute_sharpness().shape[0]
+        y = de.deesser(np.full(num_frames, de.max_reduction))
+        self.assertEqual(y.shape, self.tone.T.shape)
+        # the abrupt start and end of the tone spread into the band, so only the steady part is compared
+        np.testing.assert_allclose(y[512:-512], self.tone.T[512:-512], atol=1e-4)
+
+    def test_reduces_sibilance_band(self):
+        noise = (0.1 * np.random.RandomState(3).standard_normal((2, 2 * self.sr))).astype(np.float32)
+        de = self.deesser_signal(noise)
+        num_frames = de.compute_sharpness().shape[0]
+        y = de.deesser(np.full(num_frames, 0.5))
+        freqs = np.fft.rfftfreq(noise.shape[-1], 1 / self.sr)
+        in_band = (freqs > 5000) & (freqs < 9000)
+        ratio = np.abs(np.fft.rfft(y[:, 0]))[in_band].sum() / np.abs(np.fft.rfft(noise[0]))[in_band].sum()
+        self.assertAlmostEqual(ratio, 0.5, places=2)
+
+
+class TestDeEsserFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        rng = np.random.RandomState(4)
+        signal = (0.1 * rng.standard_normal((2, self.sr))).astype(np.float32)
+        self.de = DeEsserSignal(signal, 256, 256, 128, -12, "vocal", self.sr,
+                                [100, 200, 400, 800, 1600, 3200, 6400], 0.08, 1.2, 0.65)
+
+    def test_zcr_matches_librosa(self):
+        y = sos_filter(self.de.mono_signal, band_sos(60, 600, self.sr, 1))
+        expected = librosa.feature.zero_crossing_rate(y, frame_length=256, hop_length=128)
+        np.testing.assert_allclose(self.de.compute_zcr(), expected)
+
+    def test_ste_matches_frame_loop(self):
+        N = self.de.window_size
+        padded = np.pad(np.asarray(self.de.mono_signal, dtype=np.float64), N // 2, mode='reflect')
+        hn = 0.54 - 0.46 * np.cos(2 * np.pi * np.arange(N) / (N - 1))
+        num_frames = 1 + (padded.shape[0] - N) // self.de.hop_length
+        energy, rab = np.zeros((1, num_frames)), np.zeros((1, num_frames))
+        for t in range(num_frames):
+            frame = padded[t * self.de.hop_length:t * self.de.hop_length + N]
+            energy[0, t] = np.mean(frame**2)
+            rab[0, t] = np.sum(frame * hn)
+        np.testing.assert_allclose(self.de.compute_ste(False), energy, atol=1e-12)
+        np.testing.assert_allclose(self.de.compute_ste(True), rab, atol=1e-12)
+
+    def test_features_share_frames(self):
+        sharpness, zcr, ste = self.de.compute_features()
+        self.assertEqual(sharpness.shape[0], zcr.shape[1])
+        self.assertEqual(zcr.shape, ste.shape)
+
+
+class TestFader(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.signal = (0.1 * np.random.RandomState(7).standard_normal((2, self.sr))).astype(np.float32)
+
+    def fader_signal(self, lead):
+        return FaderSignal(self.signal, 1024, 1024, 512, -12, "vocal", self.sr, 0.99995, 3, lead, 2.0, 0.25, 3)
+
+    def test_compute_fader_clips(self):
+        L_av = np.array([-20.0, -20.0, -20.0, -20.0])
+        L2 = np.array([-60.0, -26.0, -14.0, 20.0])
+        F_m = self.fader_signal(False).compute_fader(L_av, L2)
+        np.testing.assert_allclose(F_m, [2.0, 10**(6 / 20), 10**(-6 / 20), 0.25])
+
+    def test_compute_fader_lead_boost(self):
+        L_av = np.array([-20.0, -20.0])
+        L2 = np.array([-20.0, -40.0])
+        F_m = self.fader_signal(True).compute_fader(L_av, L2)
+        np.testing.assert_allclose(F_m, [10**(3 / 20), 2.0])
+
+    def test_full_loudness_frames(self):
+        fs = self.fader_signal(False)
+        self.assertEqual(fs.full_loudness().shape, (int(np.ceil(self.sr / 512)),))
+
+
+class TestMixer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.stereo = rng.standard_normal((1000, 2)).astype(np.float32)
+        self.short = rng.standard_normal((800, 2)).astype(np.float32)
+        self.mono = rng.standard_normal(1200).astype(np.float32)
+
+    def test_accumulates_unequal_lengths(self):
+        mixer = Mixer("mix.wav", 22050, 1000)
+        mixer.add(self.stereo)
+        mixer.add(self.short, gain=0.5)
+        mixer.add(self.mono)
+        expected = np.zeros((1200, 2), dtype=np.float32)
+        expected[:1000] += self.stereo
+        expected[:800] += 0.5 * self.short
+        expected += np.cos(np.pi / 4) * self.mono[:, np.newaxis]
+        mix = mixer.mix()
+        self.assertEqual(mix.dtype, np.float32)
+        np.testing.assert_allclose(mix, expected, atol=1e-5)
+
+    def test_pan_stereo_stem(self):
+        mixer = Mixer("mix.wav", 22050, 1000)
+        mixer.add(self.stereo, pan=0.0)
+        np.testing.assert_allclose(mixer.mix()[:, 0], np.sqrt(2) * self.stereo[:, 0], atol=1e-5)
+        np.testing.assert_allclose(mixer.mix()[:, 1], 0.0, atol=1e-6)
+
+    def test_rejects_multichannel_stem(self):
+        mixer = Mixer("mix.wav", 22050, 1000)
+        with self.assertRaises(ValueError):
+            mixer.add(np.zeros((1000, 6), dtype=np.float32))
+        with self.assertRaises(ValueError):
+            mixer.add(np.zeros((1000, 6), dtype=np.float32), pan=0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import numpy as np
+from scipy.signal import fftconvolve, sosfreqz
+from ravellib.lib.filters import biquad_eq_sos, linkwitz_riley_bank, overlap_save, partitioned_convolve, sos_bank_filter
+from ravellib.lib.reverb import reverb_ir
+
+
+class TestConvolution(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.x = rng.standard_normal((2, 20000))
+        self.ir = rng.standard_normal((2, 9000)) * np.exp(-np.arange(9000) / 2000)
+
+    def test_overlap_save(self):
+        fir = np.hanning(255)
+        fir /= fir.sum()
+        y = overlap_save(self.x, fir, block_size=1024)
+        expected = fftconvolve(self.x, fir[np.newaxis], axes=-1)[:, 127:127 + self.x.shape[-1]]
+        np.testing.assert_allclose(y, expected, atol=1e-10)
+
+    def test_overlap_save_rejects_short_blocks(self):
+        with self.assertRaises(ValueError):
+            overlap_save(self.x, np.ones(512), block_size=256)
+
+    def test_partitioned_convolve(self):
+        y = partitioned_convolve(self.x, self.ir, block_size=1024)
+        expected = fftconvolve(self.x, self.ir, axes=-1)[:, :self.x.shape[-1]]
+        np.testing.assert_allclose(y, expected, atol=1e-9)
+
+    def test_partitioned_convolve_mono_send(self):
+        y = partitioned_convolve(self.x[0], self.ir, block_size=1024)
+        expected = fftconvolve(self.x[:1], self.ir, axes=-1)[:, :self.x.shape[-1]]
+        np.testing.assert_allclose(y, expected, atol=1e-9)
+
+    def test_partitioned_convolve_single_partition(self):
+        y = partitioned_convolve(self.x, self.ir[:, :500], block_size=1024)
+        expected = fftconvolve(self.x, self.ir[:, :500], axes=-1)[:, :self.x.shape[-1]]
+        np.testing.assert_allclose(y, expected, atol=1e-9)
+
+
+class TestReverbIR(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.params = (50, 50, 100, 50, 20)
+
+    def test_deterministic(self):
+        a = reverb_ir.__wrapped__(*self.params, 0, self.sr)
+        b = reverb_ir.__wrapped__(*self.params, 0, self.sr)
+        np.testing.assert_array_equal(a, b)
+        self.assertFalse(a.flags.writeable)
+
+    def test_unit_energy_and_wet_gain(self):
+        ir = reverb_ir(*self.params, 0, self.sr)
+        np.testing.assert_allclose(np.sum(ir**2, axis=-1), 1.0)
+        loud = reverb_ir(*self.params, 6, self.sr)
+        np.testing.assert_allclose(np.sum(loud**2, axis=-1), 10**(6 / 10))
+
+    def test_length(self):
+        reverberance, hf_damping, room_scale, stereo_depth, pre_delay = self.params
+        rt60 = 0.2 + 3.0 * (reverberance / 100) * (0.25 + 0.75 * room_scale / 100)
+        ir = reverb_ir(*self.params, 0, self.sr)
+        self.assertEqual(ir.shape, (2, int(round(pre_delay / 1000 * self.sr)) + int(1.2 * rt60 * self.sr)))
+        self.assertEqual(reverb_ir(100, 0, 100, 0, 0, 0, self.sr, max_seconds=1.0).shape, (2, self.sr))
+
+
+class TestBiquadEQ(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 44100
+
+    def gain_db(self, eq_info, freqs):
+        w, h = sosfreqz(biquad_eq_sos(eq_info, self.sr, 2), worN=np.asarray(freqs, dtype=float), fs=self.sr)
+        return 20 * np.log10(np.abs(h))
+
+    def test_peak_at_centre(self):
+        # eq type 0 cuts by gain at the centre frequency and leaves the far bands alone
+        np.testing.assert_allclose(self.gain_db([[1000, 6, 0]], [1000, 20, 20000]), [-6, 0, 0], atol=0.05)
+
+    def test_shelves(self):
+        # a shelf reaches half its gain at the corner and the full gain at the far end
+        np.testing.assert_allclose(self.gain_db([[200, 6, 3]], [0, 200]), [-6, -3], atol=1e-6)
+        np.testing.assert_allclose(self.gain_db([[4000, 6, 4]], [4000, self.sr / 2]), [3, 6], atol=1e-6)
+
+    def test_pass_filters(self):
+        np.testing.assert_allclose(self.gain_db([[100, 0, 1]], [100]), [-3.01], atol=0.01)
+        np.testing.assert_allclose(self.gain_db([[8000, 0, 2]], [8000]), [-3.01], atol=0.01)
+
+    def test_cascade(self):
+        eq_info = [[1000, 6, 0], [200, 6, 3]]
+        self.assertEqual(biquad_eq_sos(eq_info, self.sr, 2).shape, (2, 6))
+        expected = self.gain_db(eq_info[:1], [1000]) + self.gain_db(eq_info[1:], [1000])
+        np.testing.assert_allclose(self.gain_db(eq_info, [1000]), expected)
+
+
+class TestLinkwitzRiley(unittest.TestCase):
+
+    def test_bands_sum_flat(self):
+        sr = 44100
+        impulse = np.zeros(2**15)
+        impulse[0] = 1.0
+        bands = sos_bank_filter(impulse, linkwitz_riley_bank([200, 2000, 8000], sr))
+        self.assertEqual(bands.shape[0], 4)
+        magnitude = np.abs(np.fft.rfft(bands.sum(axis=0)))
+        np.testing.assert_allclose(magnitude, 1.0, atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
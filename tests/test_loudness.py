@@ -0,0 +1,37 @@
+import unittest
+import numpy as np
+from ravellib.lib.loudness import LoudnessMeter
+
+try:
+    import pyloudnorm as pyln
+except ImportError:
+    pyln = None
+
+
+class TestLoudnessMeter(unittest.TestCase):
+
+    def setUp(self):
+        self.rate = 44100
+        rng = np.random.RandomState(0)
+        envelope = np.repeat(rng.uniform(0.01, 0.5, 20), self.rate // 2)
+        self.data = rng.standard_normal((envelope.shape[0], 2)) * envelope[:, np.newaxis]
+
+    @unittest.skipIf(pyln is None, "pyloudnorm is not installed")
+    def test_matches_pyloudnorm(self):
+        expected = pyln.Meter(self.rate).integrated_loudness(self.data)
+        self.assertAlmostEqual(LoudnessMeter(self.rate).integrated_loudness(self.data), expected, places=8)
+        expected = pyln.Meter(self.rate).integrated_loudness(self.data[:, 0])
+        self.assertAlmostEqual(LoudnessMeter(self.rate).integrated_loudness(self.data[:, 0]), expected, places=8)
+
+    def test_streaming_matches_one_shot(self):
+        meter = LoudnessMeter(self.rate)
+        for start in range(0, self.data.shape[0], 3001):
+            meter.feed(self.data[start:start + 3001])
+        self.assertAlmostEqual(meter.integrated(), meter.integrated_loudness(self.data), places=10)
+
+    def test_silence(self):
+        self.assertEqual(LoudnessMeter(self.rate).integrated_loudness(np.zeros(self.rate)), -np.inf)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+import unittest
+import numpy as np
+import ravellib.lib.preprocessing as preprocessing
+
+
+def reference_eq_band(x, fc, sr, G, f_b, f_type):
+    # one allpass-based band, sample by sample, as eq_filter ran before the SOS bank
+    V0 = 10**(G/20)
+    H0 = V0 - 1
+    if f_type in ("boost", "cut"):
+        k = np.tan(np.pi * (f_b / sr))
+        c = (k - 1) / (k + 1) if f_type == "boost" else (k - V0) / (k + V0)
+        d = -np.cos(2*np.pi * (fc/sr))
+    else:
+        k = np.tan(np.pi * (fc / sr))
+        if G >= 0:
+            c = (k - 1) / (k + 1)
+        elif f_type == "lowshelf":
+            c = (k - V0) / (k + V0)
+        else:
+            c = (V0 * k - 1) / (V0 * k + 1)
+    x_h = np.zeros(x.shape[0] + 2)
+    y = np.zeros(x.shape[0])
+    for n in range(x.shape[0]):
+        if f_type in ("boost", "cut"):
+            x_h[n+2] = x[n] - d * (1 - c) * x_h[n+1] + c * x_h[n]
+            y1 = -c * x_h[n+2] + d * (1 - c) * x_h[n+1] + x_h[n]
+            y[n] = (H0 / 2) * (x[n] - y1) + x[n]
+        else:
+            x_h[n+2] = x[n] - c * x_h[n+1]
+            y1 = c * x_h[n+2] + x_h[n+1]
+            sign = 1 if f_type == "lowshelf" else -1
+            y[n] = (H0 / 2) * (x[n] + sign * y1) + x[n]
+    return y
+
+
+def reference_mask_2d(signals, rank_threshold, window_size, hop_length, sr, top_n):
+    # the original pairwise loop over masker/maskee spectrograms
+    n = len(signals)
+    fft_signals = [preprocessing.fft_2d(signal, window_size, hop_length, sr) for signal in signals]
+    rank_signals = [preprocessing.rank_signal_2d(fft_signal) for fft_signal in fft_signals]
+    mask_info = []
+    for i in range(n):
+        for j in range(n-1):
+            r_a = np.where(rank_signals[i] > rank_threshold, 1, 0)
+            r_b = np.where(rank_signals[(i+j+1) % n] <= rank_threshold, 1, 0)
+            v = (r_a*r_b)*(fft_signals[i] - fft_signals[(i+j+1) % n])
+            idx_1d = v.flatten().argsort()[-top_n:]
+            x_idx, y_idx = np.unravel_index(idx_1d, v.shape)
+            for x, y in zip(x_idx, y_idx):
+                mask_info.append([i, x * (sr / v.shape[0]), v[x][y]])
+    return mask_info
+
+
+class TestEQFilter(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.x = np.random.RandomState(0).standard_normal((2, 4000))
+        self.bands = [(200, 6, 100, "boost"), (1000, -9, 300, "cut"),
+                      (150, -4, None, "lowshelf"), (6000, 3, None, "highshelf"), (4000, -5, None, "highshelf")]
+
+    def per_band_loop(self, x):
+        y = x
+        for fc, G, f_b, f_type in self.bands:
+            y = reference_eq_band(y, fc, self.sr, G, f_b, f_type)
+        return y
+
+    def test_mono_matches_per_band_loop(self):
+        y = preprocessing.eq_filter(self.x[0], self.bands, self.sr)
+        np.testing.assert_allclose(y, self.per_band_loop(self.x[0]), atol=1e-10)
+
+    def test_stereo_matches_per_band_loop(self):
+        y = preprocessing.eq_filter(self.x, self.bands, self.sr)
+        self.assertEqual(y.shape, self.x.shape)
+        for channel, y_channel in zip(self.x, y):
+            np.testing.assert_allclose(y_channel, self.per_band_loop(channel), atol=1e-10)
+
+    def test_single_band(self):
+        y = preprocessing.eq_filter(self.x[0], 1000, self.sr, -9, 300, "cut")
+        np.testing.assert_allclose(y, reference_eq_band(self.x[0], 1000, self.sr, -9, 300, "cut"), atol=1e-10)
+
+
+class TestTonalBalance(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        t = np.arange(self.sr) / self.sr
+        rng = np.random.RandomState(1)
+        self.x = np.array([0.3 * np.sin(2 * np.pi * 110 * t), 0.3 * np.sin(2 * np.pi * 220 * t)])
+        self.x += 0.01 * rng.standard_normal(self.x.shape)
+
+    def balance(self, x):
+        x_env = np.sqrt(np.mean(np.asarray(x)**2)) + 1e-9
+        return preprocessing.tonal_balance(x, self.sr, 20, 1500, 2, 4, x_env, 0.707, 1.0, 10, -2, 100, "cut")
+
+    def test_stereo_output(self):
+        y = self.balance(self.x)
+        self.assertEqual(y.shape, self.x.shape)
+        self.assertTrue(np.all(np.isfinite(y)))
+
+    def test_mono_output(self):
+        y = self.balance(self.x[0])
+        self.assertEqual(y.shape, self.x[0].shape)
+        self.assertTrue(np.all(np.isfinite(y)))
+
+    def test_oscillator_phase(self):
+        # a constant frequency integrates to a linear phase
+        phase = preprocessing.oscillator_phase(np.full(100, 441.0), 44100)
+        np.testing.assert_allclose(phase, 2 * np.pi * 441.0 * np.arange(1, 101) / 44100)
+
+
+class TestMask2D(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        rng = np.random.RandomState(2)
+        # differently coloured noise, so each signal masks the others somewhere
+        self.signals = [np.cumsum(rng.standard_normal(self.sr // 2)).astype(np.float32) * 0.01,
+                        rng.standard_normal(self.sr // 2).astype(np.float32) * 0.1,
+                        np.diff(rng.standard_normal(self.sr // 2 + 1)).astype(np.float32) * 0.1]
+        self.args = (10, 1024, 512, self.sr, 5)
+
+    def assert_mask_info_equal(self, mask_info, expected):
+        self.assertEqual(len(mask_info), len(expected))
+        for row, expected_row in zip(mask_info, expected):
+            self.assertEqual(row[0], expected_row[0])
+            self.assertAlmostEqual(row[1], expected_row[1])
+            self.assertAlmostEqual(row[2], expected_row[2], places=4)
+
+    def test_matches_pairwise_loop(self):
+        expected = reference_mask_2d(self.signals, *self.args)
+        self.assertTrue(any(row[2] > 0 for row in expected))
+        self.assert_mask_info_equal(preprocessing.mask_2d(self.signals, *self.args), expected)
+
+    def test_small_blocks(self):
+        # two maskers and then one, one masker per block, and a limit below a single masker
+        expected = reference_mask_2d(self.signals, *self.args)
+        for max_block_bytes in (600000, 300000, 1):
+            mask_info = preprocessing.mask_2d(self.signals, *self.args, max_block_bytes=max_block_bytes)
+            self.assert_mask_info_equal(mask_info, expected)
+
+
+class TestCriticalBands(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.n_fft = 256
+        self.critical_bands = (100, 200, 300, 400, 510, 630, 770, 920, 1080, 1270, 1480, 1720, 2000, 2320,
+                               2700, 3150, 3700, 4400, 5300, 6400, 7700, 9500)
+
+    def test_matches_freq_bark_map_loop(self):
+        num_bins = 1 + self.n_fft // 2
+        spectrum = np.random.RandomState(3).rand(num_bins, 40)
+        freqs = np.arange(num_bins) * self.sr / num_bins
+        expected = np.array([spectrum[np.ravel(idx)].sum(axis=0)
+                             for idx in preprocessing.freq_bark_map(freqs, self.critical_bands)])
+        matrix = preprocessing.critical_band_matrix(self.sr, self.n_fft, self.critical_bands)
+        self.assertEqual(matrix.shape, (len(self.critical_bands), num_bins))
+        np.testing.assert_allclose(matrix @ spectrum, expected)
+
+    def test_cached(self):
+        matrix = preprocessing.critical_band_matrix(self.sr, self.n_fft, self.critical_bands)
+        self.assertIs(matrix, preprocessing.critical_band_matrix(self.sr, self.n_fft, self.critical_bands))
+
+
+class TestFrameLoudness(unittest.TestCase):
+
+    def setUp(self):
+        self.hop_length = 64
+        self.segment_length = 8
+        self.decay = 0.999
+        rng = np.random.RandomState(4)
+        # constant power within each segment, so the frame-rate EMA is exact at frame ends
+        levels = np.repeat(rng.uniform(0.1, 1.0, 5), self.hop_length * self.segment_length)
+        self.x = levels * np.sign(rng.standard_normal(levels.shape[0]))
+
+    def test_matches_loudness_at_frame_ends(self):
+        L = preprocessing.frame_loudness(self.x, self.decay, self.hop_length, self.segment_length)
+        segment_samples = self.hop_length * self.segment_length
+        expected = np.concatenate([preprocessing.loudness(self.x[start:start + segment_samples], self.decay)
+                                   for start in range(0, self.x.shape[0], segment_samples)])
+        self.assertEqual(L.shape, (self.x.shape[0] // self.hop_length,))
+        np.testing.assert_allclose(L, expected[self.hop_length - 1::self.hop_length], atol=1e-9)
+
+    def test_partial_last_frame(self):
+        x = self.x[:-10]
+        L = preprocessing.frame_loudness(x, self.decay, self.hop_length, self.segment_length)
+        self.assertEqual(L.shape, (int(np.ceil(x.shape[0] / self.hop_length)),))
+        self.assertTrue(np.all(np.isfinite(L)))
+
+
+if __name__ == '__main__':
+    unittest.main()
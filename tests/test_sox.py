@@ -0,0 +1,67 @@
+import unittest
+from unittest import mock
+import numpy as np
+from ravellib.lib.sox import SoxChain
+
+
+def fake_sox(*args, **kwargs):
+    '''Popen stand-in that echoes stdin back, like a sox chain with no audible effect'''
+    proc = mock.Mock(returncode=0)
+    proc.communicate.side_effect = lambda data: (data, b'')
+    return proc
+
+
+class TestSoxChain(unittest.TestCase):
+
+    def setUp(self):
+        self.sr = 22050
+        self.chain = SoxChain(self.sr).reverb(50, 50, 100, 50, 20, 0, wet_only=True)
+
+    def test_command(self):
+        pipe = ['-t', 'f32', '-r', '22050', '-c', '2', '-']
+        command = self.chain.command(2)
+        self.assertEqual(command[:3 + 2 * len(pipe)], ['sox', '-N', '-V1'] + pipe + pipe)
+        self.assertEqual(command[3 + 2 * len(pipe):], ['reverb', '-w', '50', '50', '100', '50', '20', '0'])
+
+    def test_empty_chain_skips_sox(self):
+        signal = np.zeros((2, 100), dtype=np.float32)
+        with mock.patch('ravellib.lib.sox.subprocess.Popen') as popen:
+            y = SoxChain(self.sr).process(signal)
+        popen.assert_not_called()
+        np.testing.assert_array_equal(y, signal)
+
+    def test_round_trip(self):
+        rng = np.random.RandomState(0)
+        for signal in (rng.standard_normal(1000), rng.standard_normal((2, 1000))):
+            with mock.patch('ravellib.lib.sox.subprocess.Popen', side_effect=fake_sox) as popen:
+                y = self.chain.process(signal)
+            channels = np.atleast_2d(signal).shape[0]
+            self.assertEqual(popen.call_args[0][0], self.chain.command(channels))
+            self.assertEqual(y.dtype, np.float32)
+            self.assertEqual(y.shape, signal.shape)
+            np.testing.assert_array_equal(y, signal.astype(np.float32))
+
+    def test_interleaved_pipes(self):
+        signal = np.array([[1, 2, 3], [10, 20, 30]], dtype=np.float32)
+        proc = fake_sox()
+        with mock.patch('ravellib.lib.sox.subprocess.Popen', return_value=proc):
+            self.chain.process(signal)
+        # sox reads and writes interleaved frames
+        data = proc.communicate.call_args[0][0]
+        np.testing.assert_array_equal(np.frombuffer(data, dtype=np.float32), [1, 10, 2, 20, 3, 30])
+        proc.communicate.side_effect = None
+        proc.communicate.return_value = (np.array([4, 40, 5, 50], dtype=np.float32).tobytes(), b'')
+        with mock.patch('ravellib.lib.sox.subprocess.Popen', return_value=proc):
+            y = self.chain.process(signal)
+        np.testing.assert_array_equal(y, [[4, 5], [40, 50]])
+
+    def test_sox_error(self):
+        proc = mock.Mock(returncode=2)
+        proc.communicate.return_value = (b'', b'sox FAIL reverb')
+        with mock.patch('ravellib.lib.sox.subprocess.Popen', return_value=proc):
+            with self.assertRaises(RuntimeError):
+                self.chain.process(np.zeros(100))
+
+
+if __name__ == '__main__':
+    unittest.main()
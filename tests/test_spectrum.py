@@ -0,0 +1,68 @@
+import unittest
+from unittest import mock
+import numpy as np
+from ravellib.lib.spectrum import SpectrumCache
+
+
+class TestSpectrumCache(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.signals = [rng.standard_normal(22050).astype(np.float32) for _ in range(3)]
+
+    def test_cached_spectrum_is_shared_and_read_only(self):
+        cache = SpectrumCache()
+        D_db = cache.stft_db(self.signals[0], 1024, 512, 22050)
+        self.assertIs(D_db, cache.stft_db(self.signals[0], 1024, 512, 22050))
+        self.assertFalse(D_db.flags.writeable)
+
+    def test_bounded_by_bytes(self):
+        nbytes = SpectrumCache().stft_db(self.signals[0], 1024, 512, 22050).nbytes
+        cache = SpectrumCache(max_bytes=2 * nbytes)
+        spectra = [cache.stft_db(signal, 1024, 512, 22050) for signal in self.signals]
+        self.assertEqual(cache.nbytes, 2 * nbytes)
+        # the least recently used spectrum was evicted, the newer ones are still shared
+        self.assertIsNot(spectra[0], cache.stft_db(self.signals[0], 1024, 512, 22050))
+        self.assertIs(spectra[2], cache.stft_db(self.signals[2], 1024, 512, 22050))
+
+    def test_oversized_entry_not_cached(self):
+        cache = SpectrumCache(max_bytes=1024)
+        cache.stft_db(self.signals[0], 1024, 512, 22050)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_registered_array_keyed_by_uuid(self):
+        cache = SpectrumCache()
+        stereo = np.array([self.signals[0], self.signals[1]])
+        cache.register("trackout", stereo)
+        self.assertEqual(cache.source_key(stereo), ('uuid', "trackout"))
+        D_db = cache.stft_db(stereo, 1024, 512, 22050)
+        with mock.patch('ravellib.lib.spectrum.hashlib.sha1') as sha1:
+            self.assertIs(D_db, cache.stft_db(stereo, 1024, 512, 22050))
+            self.assertIs(cache.load(stereo, 22050), cache.load(stereo, 22050))
+        sha1.assert_not_called()
+        # unregistered arrays fall back to their content hash
+        self.assertEqual(cache.source_key(stereo.copy())[0], 'array')
+
+    def test_sample_rate_in_key(self):
+        cache = SpectrumCache()
+        stereo = np.array([self.signals[0], self.signals[1]])
+        self.assertIsNot(cache.load(stereo, 22050), cache.load(stereo, 44100))
+        self.assertIs(cache.load(stereo, 22050), cache.load(stereo, 22050))
+        self.assertIsNot(cache.stft_db(stereo, 1024, 512, 22050), cache.stft_db(stereo, 1024, 512, 44100))
+
+    def test_mono_array_not_copied(self):
+        cache = SpectrumCache()
+        self.assertIs(cache.load(self.signals[0], 22050), self.signals[0])
+        self.assertTrue(self.signals[0].flags.writeable)
+
+    def test_clear(self):
+        cache = SpectrumCache()
+        cache.stft_db(self.signals[0], 1024, 512, 22050)
+        cache.register("trackout", self.signals[1])
+        cache.clear()
+        self.assertEqual(cache.nbytes, 0)
+        self.assertEqual(cache.source_key(self.signals[1])[0], 'array')
+
+
+if __name__ == '__main__':
+    unittest.main()
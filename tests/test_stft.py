@@ -0,0 +1,31 @@
+import unittest
+import librosa
+import numpy as np
+import ravellib.lib.stft as stft
+
+
+class TestSTFT(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.random.RandomState(0).standard_normal((2, 10000))
+
+    def test_matches_librosa(self):
+        X = stft.stft(self.x, 1024, 256)
+        expected = librosa.stft(self.x[0], n_fft=1024, hop_length=256, pad_mode='constant')
+        np.testing.assert_allclose(X[0], expected, atol=1e-4)
+
+    def test_istft_reconstructs(self):
+        for n_fft, hop_length in ((1024, 256), (256, 64), (1000, 300)):
+            X = stft.stft(self.x, n_fft, hop_length)
+            y = stft.istft(X, hop_length, self.x.shape[-1])
+            np.testing.assert_allclose(y, self.x, atol=1e-10)
+
+    def test_frame_is_a_view(self):
+        frames = stft.frame(self.x[0], 512, 128)
+        self.assertEqual(frames.shape, (1 + (10000 - 512) // 128, 512))
+        self.assertFalse(frames.flags.writeable)
+        np.testing.assert_array_equal(frames[3], self.x[0, 384:896])
+
+
+if __name__ == '__main__':
+    unittest.main()